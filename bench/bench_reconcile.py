@@ -0,0 +1,38 @@
+# per-reply cost of putting a finished reply on screen, at 10, 100 and 1000 messages:
+# "reconcile" is App.update_chat_display (only changed bubbles), "reset" re-renders the whole transcript
+import statistics
+import sys
+import time
+
+from common import workdir, history
+
+workdir()
+from main import App, QApplication
+
+def measure(window, app, size, mode, repeat=5):
+    times = []
+    for _ in range(repeat):
+        window.chatHistory = history(size)
+        window.chatModel.set_history(window.chatHistory)
+        app.processEvents()
+        window.chatModel.append_stream({"role": "assistant", "content": "", "llm": "Model"})
+        app.processEvents()
+        started = time.perf_counter()
+        window.chatHistory.append({"role": "assistant", "content": "Hello **world**", "llm": "Model", "stats": {"t_s": 2}})
+        if mode == "reset":
+            window.chatModel.set_history(window.chatHistory)
+        else:
+            window.update_chat_display()
+        app.processEvents()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    window = App()
+    window.resize(1000, 600)
+    window.show()
+    window.save_chat = lambda chat=None: None
+    for size in (10, 100, 1000):
+        print(f"{size:>5} messages: reconcile {measure(window, app, size, 'reconcile'):7.2f} ms   reset {measure(window, app, size, 'reset'):7.2f} ms")
+    window.close()
@@ -0,0 +1,47 @@
+# time to first token on a local SSE stand-in: a fresh connection and thread per prompt (requests.post
+# from a new thread) against GenerationBackend's keep-alive session and pooled worker threads
+import statistics
+import sys
+import threading
+import time
+
+from common import workdir
+from sse_server import Handler, serve
+
+workdir()
+from PyQt6.QtCore import QEventLoop
+from main import GenerationBackend, LLMWorker, QApplication
+
+def first_token(url, request, backend):
+    loop = QEventLoop()
+    first = []
+    started = time.perf_counter()
+    if backend is not None:
+        worker = backend.submit(dict(request), url)
+    else:
+        worker = LLMWorker(dict(request), url)
+    worker.token_emit.connect(lambda text: first or first.append(time.perf_counter()))
+    worker.result_ready.connect(lambda reply: loop.quit())
+    worker.error_emit.connect(lambda error: sys.exit(error))
+    if backend is None:
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+    loop.exec()
+    if backend is None:
+        thread.join()
+    return (first[0] - started) * 1000
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    server = serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    backend = GenerationBackend()
+    for delay in (0, 0.002):
+        request = {"messages": [], "n_events": 20, "token_delay": delay}
+        for label, pool in (("new connection + thread", None), ("GenerationBackend", backend)):
+            Handler.connections = 0
+            times = [first_token(url, request, pool) for _ in range(60)][10:]
+            print(f"events every {delay * 1000:.0f} ms, {label:<24} median {statistics.median(times):6.2f} ms, "
+                  f"p90 {sorted(times)[int(len(times) * 0.9)]:6.2f} ms, {Handler.connections} new connections")
+    backend.shutdown()
+    server.shutdown()
@@ -0,0 +1,78 @@
+# ChatStreamParser against sseclient + json.loads on recorded llama-server-shaped streams of 10k, 50k and
+# 100k events, as one chunk per event and as 4 KiB chunks; outputs are checked to be the same first
+import asyncio
+import json
+import random
+import sys
+import time
+
+import common  # puts the repository on sys.path
+from sse_server import make_events
+from main import aiter_chat_stream, iter_chat_stream
+
+try:
+    import sseclient
+except ImportError:
+    sys.exit("sseclient-py is needed for the reference parser: pip install sseclient-py")
+
+def reference(chunks):
+    out = []
+    for event in sseclient.SSEClient(chunks).events():
+        if event.data.strip() == "[DONE]":
+            out.append(("done", None))
+            continue
+        try:
+            chunk = json.loads(event.data)
+        except json.JSONDecodeError:
+            continue
+        choices = chunk.get("choices", [])
+        if not choices:
+            if "usage" in chunk or "timings" in chunk:
+                out.append(("stats", chunk))
+            continue
+        token = choices[0].get("delta", {}).get("content")
+        if token:
+            out.append(("token", token))
+    return out
+
+def split(body, low, high, rnd=random.Random(1)):
+    chunks = []
+    i = 0
+    while i < len(body):
+        size = rnd.randint(low, high)
+        chunks.append(body[i:i + size])
+        i += size
+    return chunks
+
+async def collect(chunks):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+    return [event async for event in aiter_chat_stream(source())]
+
+def check():
+    # comments, event/id fields, multi-line data and a multi-byte character split across chunks
+    extra = b': keep-alive\n\nevent: message\nid: 3\ndata: {"choices": [{"delta":\ndata: {"content": "z\\u00f3\\u0142w \xc5\xbc"}}]}\n\n'
+    body = make_events(300) + extra
+    for variant in (body, body.replace(b"\n", b"\r\n")):
+        expected = reference([variant])
+        for _ in range(100):
+            assert list(iter_chat_stream(split(variant, 1, 40))) == expected
+    assert asyncio.run(collect(split(body, 1, 50))) == reference([body])
+    print(f"same events as sseclient on {len(expected)} events, re-chunked, LF and CRLF, sync and async")
+
+if __name__ == "__main__":
+    check()
+    for n in (10000, 50000, 100000):
+        body = make_events(n)
+        per_event = [event + b"\n\n" for event in body.split(b"\n\n")[:-1]]
+        for name, chunks in (("per-event chunks", per_event), ("4 KiB chunks", split(body, 4096, 4096))):
+            best = {}
+            for label, parse in (("sseclient", reference), ("parser", lambda chunks: list(iter_chat_stream(chunks)))):
+                best[label] = float("inf")
+                for _ in range(3):
+                    started = time.perf_counter()
+                    parse(chunks)
+                    best[label] = min(best[label], time.perf_counter() - started)
+            print(f"{n:>6} events, {name:<16}: sseclient {best['sseclient'] * 1000:7.1f} ms   parser {best['parser'] * 1000:6.1f} ms"
+                  f"   x{best['sseclient'] / best['parser']:.1f}")
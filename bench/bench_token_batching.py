@@ -0,0 +1,41 @@
+# events per second LLMWorker can deliver to the GUI thread from a local SSE stand-in: one signal per
+# token with every event logged (what the worker did with its print calls), one signal per token, and
+# the default coalescing (30 ms / 32 tokens)
+import logging
+import os
+import sys
+import threading
+import time
+
+from common import workdir
+from sse_server import serve
+
+workdir()
+from main import LLMWorker, QApplication, logger
+
+def run(app, url, events, **options):
+    worker = LLMWorker({"messages": [], "n_events": events}, url, **options)
+    got = {"signals": 0, "done": False}
+    worker.token_emit.connect(lambda text: got.__setitem__("signals", got["signals"] + 1))
+    worker.result_ready.connect(lambda reply: got.__setitem__("done", True))
+    worker.error_emit.connect(lambda error: sys.exit(error))
+    started = time.perf_counter()
+    threading.Thread(target=worker.run, daemon=True).start()
+    while not got["done"]:
+        app.processEvents()
+    return time.perf_counter() - started, got["signals"]
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    server = serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    handler = logging.FileHandler(os.path.join(os.getcwd(), "events.log"))
+    for label, options, level in (("logged, per token", {"max_batch": 1}, logging.DEBUG),
+                                  ("one signal per token", {"max_batch": 1}, logging.WARNING),
+                                  ("coalesced (default)", {}, logging.WARNING)):
+        logger.setLevel(level)
+        logger.handlers = [handler] if level == logging.DEBUG else []
+        elapsed, signals = min(run(app, url, events, **options) for _ in range(3))
+        print(f"{label:<22} {events} events in {elapsed:.2f} s -> {events / elapsed:>9,.0f} events/s, {signals} signals")
+    server.shutdown()
@@ -0,0 +1,35 @@
+# GGUFTokenizer on an 8k character prompt: load time (cold and from the per-model cache) and the cost of
+# one count, cold and with the word cache warm, as the prompt token counter pays it on a keystroke
+import os
+import sys
+import tempfile
+import time
+
+from common import ROOT
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+from gguf_files import CORPUS, write_bpe_vocab, write_spm_vocab
+from main import GGUFTokenizer
+
+def best(call, repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - started) * 1000)
+    return min(times)
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp(prefix="qullychat-bench-")
+    text = (CORPUS * 3)[:8000]
+    for name, write in (("bpe (llama-bpe)", write_bpe_vocab), ("spm", write_spm_vocab)):
+        path = os.path.join(folder, f"{name.split()[0]}.gguf")
+        write(path)
+        started = time.perf_counter()
+        tokenizer = GGUFTokenizer.load(path)
+        load = (time.perf_counter() - started) * 1000
+        cached = best(lambda: GGUFTokenizer.load(path))
+        def cold():
+            tokenizer.words.clear()
+            tokenizer.count(text)
+        print(f"{name:<16} load {load:6.1f} ms, cached {cached:.3f} ms; {tokenizer.count(text)} tokens: "
+              f"cold {best(cold):6.2f} ms, typing {best(lambda: tokenizer.count(text + 'x')):6.2f} ms")
@@ -0,0 +1,24 @@
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# the CPU threads slider spans 1..cpu_count and cannot be laid out on a single-CPU machine
+os.cpu_count = lambda: 8
+
+def workdir():
+    # the app keeps its chats, settings and caches in the working directory; benchmarks get a scratch one
+    path = tempfile.mkdtemp(prefix="qullychat-bench-")
+    shutil.copy(os.path.join(ROOT, "FiraCodeNerdFont-Regular.ttf"), path)
+    os.chdir(path)
+    return path
+
+def history(size):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    while len(messages) < size:
+        messages.append({"role": "user", "content": f"Question {len(messages)}"})
+        messages.append({"role": "assistant", "content": f"# Answer {len(messages)}\n\n- one\n- two\n\n`code`", "llm": "Model", "stats": {"t_s": 1}})
+    return messages[:size]
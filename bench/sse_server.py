@@ -0,0 +1,66 @@
+# local stand-in for llama-server's streaming /v1/chat/completions: "n_events" token events, a usage/timings
+# chunk and [DONE], written in 4 KiB chunks or one event per "token_delay" seconds
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKENS = [" the", " model", "\n", " \"quoted\"", " zażółć", " 🙂", "\tcode", " back\\slash", ",", " end."]
+
+def make_events(n):
+    events = [b'data: {"choices":[{"finish_reason":null,"index":0,"delta":{"role":"assistant","content":null}}],"object":"chat.completion.chunk"}']
+    for i in range(n):
+        chunk = {"choices": [{"finish_reason": None, "index": 0, "delta": {"content": TOKENS[i % len(TOKENS)]}}], "object": "chat.completion.chunk"}
+        events.append(b"data: " + json.dumps(chunk, separators=(",", ":"), ensure_ascii=i % 2 == 0).encode())
+    stats = {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": n, "total_tokens": n + 12},
+             "timings": {"prompt_n": 12, "prompt_ms": 30.1, "predicted_n": n, "predicted_ms": 900.2, "predicted_per_second": 40.0}}
+    events.append(b"data: " + json.dumps(stats).encode())
+    events.append(b"data: [DONE]")
+    return b"".join(event + b"\n\n" for event in events)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    bodies = {}
+    connections = 0
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        Handler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        body = b'{"status":"ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        n = int(request.get("n_events", 1000))
+        body = self.bodies.get(n)
+        if body is None:
+            body = self.bodies[n] = make_events(n)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = request.get("token_delay")
+        if delay:
+            chunks = [event + b"\n\n" for event in body.split(b"\n\n")[:-1]]
+        else:
+            chunks = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay)
+            self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+def serve(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -5,202 +5,1443 @@ from PyQt6.QtWidgets import (
 	QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QTextEdit, QLineEdit,
 	QTabWidget, QMessageBox, QTableWidget, QTableWidgetItem, QSizePolicy, QFileDialog, QSplitter,
     QDialog, QListWidget, QListWidgetItem, QInputDialog, QComboBox, QCheckBox, QSlider, QFrame,
-    QRadioButton, QScrollArea, QTextBrowser, QToolTip, QStackedLayout, QMenu
+    QRadioButton, QToolTip, QMenu, QListView, QStyledItemDelegate, QAbstractItemView, QProgressDialog
 )
 from PyQt6.QtGui import (
     QTextCursor, QPixmap, QCursor, QIntValidator, QPainter, QColor, QBrush, QPen, QMouseEvent,
-    QTextOption, QFontDatabase, QFont
+    QTextOption, QFontDatabase, QFont, QFontMetrics, QTextDocument, QTextDocumentFragment,
+    QAbstractTextDocumentLayout, QPalette, QDesktopServices
 )
 from PyQt6.QtCore import (
     QTimer, Qt, QThread, pyqtSignal, QItemSelectionModel, QEvent, QPoint, QPropertyAnimation,
-    QEasingCurve, pyqtProperty
+    QEasingCurve, pyqtProperty, QAbstractListModel, QModelIndex, QRect, QRectF, QSize, QPointF, QUrl,
+    QObject, QThreadPool, QFileSystemWatcher
 )
 from PyQt6.QtTest import QTest
 import sys
 import requests
-import sseclient
+import requests.adapters
+import urllib.parse
 import json
 from markdown import markdown as md_to_html
-from gguf.gguf_reader import GGUFReader
+from gguf.constants import GGML_QUANT_SIZES
 import numpy as np
 import subprocess
 import atexit
 import threading
 import copy
 import time
-
-class Llama_cpp(QThread):
-    def __init__(self, options):
-        super().__init__()
-        self.options = options
-        self._is_running = True
-
-    def run(self):
-        self._is_running = True
-        command = ["./llama/llama-server", "-m", self.options['model_path'], "--host", "127.0.0.1", "--port", str(self.options['port']), "-n", "-1"]
-        if self.options['threads'] > 0:
-            command += ["-t", str(self.options['threads'])]
-        if self.options['gpu_layers'] > 0:
-            command += ["--n-gpu-layers", str(self.options['gpu_layers'])]
-        if self.options['batch_size'] > 0:
-            command += ["-b", str(self.options['batch_size'])]
-        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, text=True, encoding="utf-8")
-
-        atexit.register(self.process.terminate)
-
-    def stop(self):
-        self._is_running = False
+import logging
+import logging.handlers
+import queue
+import hashlib
+import struct
+import functools
+import fcntl
+import sqlite3
+import re
+import glob
+import heapq
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger("QullyChat")
+logger.addHandler(logging.StreamHandler())
+ENV_LOG_LEVEL = getattr(logging, os.environ.get("QULLYCHAT_LOG_LEVEL", "WARNING").upper(), logging.WARNING)
+logger.setLevel(ENV_LOG_LEVEL)
+
+LOG_LEVELS = {"Debug": logging.DEBUG, "Info": logging.INFO, "Warning": logging.WARNING, "Error": logging.ERROR}
+
+SERVER_LOADING = "loading"
+SERVER_READY = "ready"
+SERVER_FAILED = "failed"
+SERVER_STOPPED = "stopped"
+
+def llama_server_command(binary, options):
+    command = [binary, "-m", options['model_path'], "--host", "127.0.0.1", "--port", str(options['port']), "-n", "-1"]
+    if options['threads'] > 0:
+        command += ["-t", str(options['threads'])]
+    if options['gpu_layers'] >= 0:
+        # 0 too: newer llama-server builds offload to the GPU unless told otherwise
+        command += ["--n-gpu-layers", str(options['gpu_layers'])]
+    if options['batch_size'] > 0:
+        command += ["-b", str(options['batch_size'])]
+    # always explicit: without -c llama-server picks its own default, while estimate_memory and context_budget
+    # take 0 to mean the model's trained context_length, which is what -c 0 gives
+    command += ["-c", str(max(options.get('ctx_size', 0), 0))]
+    if options.get('parallel', 1) > 1:
+        command += ["-np", str(options['parallel'])]
+    if options.get('slot_save_path'):
+        command += ["--slot-save-path", options['slot_save_path']]
+    return command
+
+def stop_process_group(pid, process=None, timeout=1):
+    # the server runs in its own session, so its pid is also its process group id; SIGINT lets llama-server
+    # shut down cleanly, SIGTERM and SIGKILL follow when it does not go within the timeout
+    if process is not None and process.poll() is not None:
+        return True
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGKILL):
         try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            return True
+        except PermissionError as e:
+            logger.error("Error terminating llama.cpp server %d: %s", pid, e)
+            return False
+        if process is not None:
             try:
-                self.process.send_signal(signal.SIGINT)
-                self.process.wait(timeout=1)
-                return
+                process.wait(timeout=timeout)
+                return True
             except subprocess.TimeoutExpired:
+                continue
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not pid_alive(pid):
+                return True
+            time.sleep(0.05)
+    return False
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # a killed orphan stays a zombie until init gets to it
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+class ServerRegistry:
+    # the servers this app started, with the pid of the instance that owns them; shared between instances
+    # through a locked file, so a later session can stop what a crashed one left behind and nothing else
+    def __init__(self, path="models/servers.json"):
+        self.path = path
+        self.owner = os.getpid()
+        self._lock = threading.Lock()
+        self.reclaimed = threading.Event()
+
+    def _update(self, change):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r") as f:
+                    servers = json.load(f).get("servers", [])
+            except (OSError, ValueError, AttributeError):
+                servers = []
+            result = change(servers)
+            write_json_atomic(self.path, {"servers": servers}, indent=4)
+            return result
+
+    def add(self, pid, command):
+        self._update(lambda servers: servers.append({"pid": pid, "owner": self.owner, "command": command, "started": time.time()}))
+
+    def remove(self, pid):
+        def drop(servers):
+            servers[:] = [s for s in servers if s["pid"] != pid]
+        self._update(drop)
+
+    def matches(self, entry):
+        # a pid can be reused after a reboot or a long time; only a process with the recorded arguments counts
+        try:
+            with open(f"/proc/{entry['pid']}/cmdline", "rb") as f:
+                cmdline = f.read().decode("utf-8", "replace").split("\0")[:-1]
+        except FileNotFoundError:
+            return pid_alive(entry["pid"]) and not os.path.isdir("/proc")
+        except OSError:
+            return False
+        return cmdline[-len(entry["command"]) + 1:] == entry["command"][1:]
+
+    def reclaim(self):
+        # stops the servers of instances that are gone; runs off the GUI thread at startup
+        try:
+            def take(servers):
+                orphans = [s for s in servers if s["owner"] != self.owner and not pid_alive(s["owner"])]
+                servers[:] = [s for s in servers if s not in orphans and pid_alive(s["pid"])]
+                return orphans
+            for entry in self._update(take):
+                if self.matches(entry):
+                    logger.info("Stopping llama-server %d left by a previous session", entry["pid"])
+                    stop_process_group(entry["pid"])
+        except Exception as e:
+            logger.error("Could not reclaim old servers: %s", e)
+        finally:
+            self.reclaimed.set()
+
+SERVER_LOG_BUFFER = re.compile(r"(\S+) (model|KV|compute) buffer size\s*=\s*([\d.]+) MiB")
+SERVER_LOG_OFFLOAD = re.compile(r"offloaded (\d+)/(\d+) layers to GPU")
+SERVER_LOG_DEVICE = re.compile(r"using device (\S+) \(([^)]+)\)|Device \d+: ([^,]+)|registered backend (\S+)")
+SERVER_LOG_CTX = re.compile(r"\bn_ctx\s*=\s*(\d+)")
+SERVER_LOG_SIZE = re.compile(r"model size\s*=\s*([\d.]+) (GiB|MiB)")
+SERVER_LOG_TIMING = re.compile(r"(prompt eval|eval) time =\s*([\d.]+) ms /\s*(\d+) (?:tokens|runs)(?:.*?([\d.]+) tokens per second)?")
+
+def parse_server_log(line, metrics):
+    # folds one llama-server log line into metrics; returns whether anything changed. the substring
+    # checks keep the (much slower) regexes off the bulk of the lines
+    if " time =" in line and (m := SERVER_LOG_TIMING.search(line)):
+        name = "prompt" if m.group(1) == "prompt eval" else "gen"
+        metrics[f"{name}_ms"] = float(m.group(2))
+        metrics[f"{name}_t"] = int(m.group(3))
+        if m.group(4):
+            metrics[f"{name}_t_s"] = float(m.group(4))
+    elif "buffer size" in line and (m := SERVER_LOG_BUFFER.search(line)):
+        metrics.setdefault(f"{m.group(2).lower()}_mib", {})[m.group(1)] = float(m.group(3))
+    elif "offloaded" in line and (m := SERVER_LOG_OFFLOAD.search(line)):
+        metrics["offloaded"] = f"{m.group(1)}/{m.group(2)}"
+    elif ("device" in line or "Device" in line or "backend" in line) and (m := SERVER_LOG_DEVICE.search(line)):
+        device = f"{m.group(1)} ({m.group(2)})" if m.group(1) else (m.group(3) or m.group(4)).strip()
+        devices = metrics.setdefault("devices", [])
+        if device in devices:
+            return False
+        devices.append(device)
+    elif "n_ctx" in line and "n_ctx" not in metrics and (m := SERVER_LOG_CTX.search(line)):
+        metrics["n_ctx"] = int(m.group(1))
+    elif "model size" in line and (m := SERVER_LOG_SIZE.search(line)):
+        metrics["model_size_mib"] = float(m.group(1)) * (1024 if m.group(2) == "GiB" else 1)
+    else:
+        return False
+    return True
+
+def server_metrics_text(metrics):
+    lines = []
+    if metrics.get("load_ms") is not None:
+        lines.append(f"Loaded in {metrics['load_ms'] / 1000:.1f} s")
+    if metrics.get("devices"):
+        lines.append(f"Backend: {', '.join(metrics['devices'])}")
+    if metrics.get("model_size_mib"):
+        lines.append(f"Model size: {metrics['model_size_mib']:.0f} MiB")
+    if metrics.get("offloaded"):
+        lines.append(f"Layers on GPU: {metrics['offloaded']}")
+    for key, name in (("model_mib", "Model buffers"), ("kv_mib", "KV cache"), ("compute_mib", "Compute buffers")):
+        if metrics.get(key):
+            lines.append(f"{name}: " + ", ".join(f"{size:.0f} MiB ({device})" for device, size in metrics[key].items()))
+    if metrics.get("n_ctx"):
+        lines.append(f"Context: {metrics['n_ctx']}")
+    if metrics.get("gen_t_s") is not None:
+        lines.append(f"Last request: {metrics.get('prompt_t_s', 0):.1f} t/s prompt, {metrics['gen_t_s']:.1f} t/s generation")
+    return "\n".join(lines)
+
+class ServerLogPump:
+    # drains a server's output on its own thread: the last lines stay in a ring buffer, known lines become
+    # metrics and, with a path, everything goes to a rotating file. the file is written by a second thread
+    # behind a bounded queue, so a slow disk drops lines instead of blocking the pipe (and the server)
+    def __init__(self, stream, lines=1000, path=None, on_metrics=None, max_bytes=5 * 1024 * 1024, backups=3):
+        self.stream = stream
+        self.lines = deque(maxlen=lines)
+        self.metrics = {}
+        self.on_metrics = on_metrics
+        self.dropped = 0
+        self._file = None
+        self._queue = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._file = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+                self._queue = queue.Queue(maxsize=10000)
+                threading.Thread(target=self._write, daemon=True).start()
+            except OSError as e:
+                logger.error("Cannot write the server log to %s: %s", path, e)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        debug = logger.isEnabledFor(logging.DEBUG)
+        try:
+            for line in self.stream:
+                line = line.rstrip()
+                self.lines.append(line)
+                if self._queue is not None:
+                    try:
+                        self._queue.put_nowait(line)
+                    except queue.Full:
+                        self.dropped += 1
+                if debug:
+                    logger.debug("llama-server: %s", line)
+                try:
+                    changed = parse_server_log(line, self.metrics)
+                except (ValueError, TypeError, AttributeError) as e:
+                    logger.debug("Unparsed server line %r: %s", line, e)
+                    changed = False
+                if changed and self.on_metrics is not None:
+                    self.on_metrics(copy.deepcopy(self.metrics))
+        except (OSError, ValueError):
+            pass
+        finally:
+            if self._queue is not None:
+                self._queue.put(None)
+
+    def _write(self):
+        # whatever has queued up meanwhile goes out as one record: one write and one flush per batch
+        done = False
+        while not done:
+            lines = [self._queue.get()]
+            while len(lines) < 1000 and not self._queue.empty():
+                lines.append(self._queue.get_nowait())
+            if lines[-1] is None:
+                lines.pop()
+                done = True
+            if not lines:
+                continue
+            try:
+                self._file.emit(logging.makeLogRecord({"msg": "\n".join(lines), "args": None}))
+            except Exception as e:
+                logger.error("Cannot write the server log: %s", e)
+        if self.dropped:
+            logger.warning("%d server log lines were not written to the file", self.dropped)
+        self._file.close()
+
+class SlotCache:
+    # which chat each server slot holds. a chat keeps its slot (and the prompt cached in it) while it is in use;
+    # with a save path, the KV state of a chat that loses its slot is saved and comes back when the chat does.
+    # assign only decides, the worker runs the save/restore calls before its request
+    def __init__(self, slots=1, path=None, budget=0):
+        self.owners = [None] * max(1, slots)
+        self.used = [0] * len(self.owners)
+        self.path = path
+        self.budget = budget
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def filename(self, chat_id):
+        return f"chat_{chat_id}.bin"
+
+    def assign(self, chat_id):
+        with self._lock:
+            self._tick += 1
+            if chat_id in self.owners:
+                slot = self.owners.index(chat_id)
+                self.used[slot] = self._tick
+                return slot, []
+            slot = min(range(len(self.owners)), key=lambda s: (self.owners[s] is not None, self.used[s]))
+            actions = []
+            if self.path:
+                if self.owners[slot] is not None:
+                    actions.append(("save", self.filename(self.owners[slot])))
+                if os.path.exists(os.path.join(self.path, self.filename(chat_id))):
+                    actions.append(("restore", self.filename(chat_id)))
+            self.owners[slot] = chat_id
+            self.used[slot] = self._tick
+            return slot, actions
+
+    def forget(self, chat_id):
+        with self._lock:
+            if chat_id in self.owners:
+                self.owners[self.owners.index(chat_id)] = None
+
+    def prune(self):
+        # oldest saves go first once the folder outgrows the budget
+        if not self.path or self.budget <= 0:
+            return
+        try:
+            files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.path) if entry.is_file())
+        except OSError:
+            return
+        total = sum(size for _mtime, size, _path in files)
+        for _mtime, size, path in files:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
                 pass
-            
+
+class ServerSupervisor(QObject):
+    # owns the one llama-server process: launches it once per command line, polls /health until the
+    # model is loaded (or the process dies / the timeout runs out) and keeps watching it afterwards.
+    # stopping, launching and waiting for the old process happen on threads; the GUI only sees state changes
+    state_changed = pyqtSignal(str, str)
+    metrics_changed = pyqtSignal(dict)
+    _state_emit = pyqtSignal(str, str)
+    _metrics_emit = pyqtSignal(dict)
+
+    def __init__(self, backend, parent=None, interval=0.25, registry=None):
+        super().__init__(parent)
+        self.registry = registry
+        # every change goes through the event queue, so the watcher's and the GUI's changes arrive in order
+        self._state_emit.connect(self.state_changed, Qt.ConnectionType.QueuedConnection)
+        self._metrics_emit.connect(self._update_metrics, Qt.ConnectionType.QueuedConnection)
+        self.backend = backend
+        self.interval = interval
+        self.state = SERVER_STOPPED
+        self.message = ""
+        self.command = None
+        self.process = None
+        self.load_ms = None
+        self.metrics = {}
+        self.pump = None
+        self.slots = SlotCache()
+        self._stop_event = threading.Event()
+        self._gone = threading.Event()
+        self._gone.set()
+        self._stopping = set()
+        self._lock = threading.Lock()
+        atexit.register(self._terminate)
+
+    @property
+    def output(self):
+        return self.pump.lines if self.pump is not None else ()
+
+    def start(self, options, binary="./llama/llama-server", timeout=300, log_path=None, after=None):
+        # after: an event set once the previous user of the port has exited
+        command = llama_server_command(binary, options)
+        with self._lock:
+            running = command == self.command and not self._stop_event.is_set() and (self.process is None or self.process.poll() is None)
+        if running and self.state in (SERVER_LOADING, SERVER_READY):
+            self.slots.budget = options.get('slot_cache_size', 0)
+            return False
+        previous = self.stop()
+        url = f"http://{options.get('address', '127.0.0.1')}:{options['port']}/health"
+        stop_event = threading.Event()
+        gone = threading.Event()
+        with self._lock:
+            self.command = command
+            self._stop_event = stop_event
+            self._gone = gone
+            self.load_ms = None
+            self.metrics = {}
+            self.pump = None
+            self.slots = SlotCache(options.get('parallel', 1), options.get('slot_save_path'), options.get('slot_cache_size', 0))
+        self._set_state(SERVER_LOADING, os.path.basename(options['model_path']))
+        threading.Thread(target=self._launch, args=(command, options, url, timeout, log_path, stop_event, gone, (previous, after)), daemon=True).start()
+        return True
+
+    def _launch(self, command, options, url, timeout, log_path, stop_event, gone, waits):
+        # the old server has to release the port, and the servers of crashed sessions are reclaimed first
+        for event in waits:
+            if event is not None and not event.wait(10):
+                logger.warning("Starting llama-server before the previous one has exited")
+        if self.registry is not None and not self.registry.reclaimed.wait(10):
+            logger.warning("Starting llama-server before the old servers are reclaimed")
+        try:
+            if options.get('slot_save_path'):
+                os.makedirs(options['slot_save_path'], exist_ok=True)
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, text=True, encoding="utf-8", errors="replace", start_new_session=True)
+        except OSError as e:
+            with self._lock:
+                if not stop_event.is_set():
+                    stop_event.set()
+                    self.command = None
+                    self._set_state(SERVER_FAILED, f"Could not start {command[0]}: {e}")
+            gone.set()
+            return
+        if self.registry is not None:
+            self.registry.add(process.pid, command)
+        with self._lock:
+            launched = not stop_event.is_set()
+            if launched:
+                self.process = process
+                self.pump = ServerLogPump(process.stdout, path=log_path, on_metrics=lambda metrics: self._metrics_emit.emit(metrics) if self.process is process else None)
+        if not launched:
+            # stopped while it was being launched
+            self._stopping.add(process)
+            self._stop_process(process, gone)
+            return
+        try:
+            self._watch(process, url, timeout, stop_event)
+        finally:
+            if process.poll() is not None:
+                gone.set()
+
+    def _update_metrics(self, metrics):
+        self.metrics = metrics
+        self.metrics_changed.emit(metrics)
+
+    def summary(self):
+        return server_metrics_text(dict(self.metrics, load_ms=self.load_ms))
+
+    def _watch(self, process, url, timeout, stop_event):
+        session = self.backend.session(url)
+        started = time.perf_counter()
+        while not stop_event.is_set():
+            if process.poll() is not None:
+                return self._failed(process, stop_event, f"llama-server exited with code {process.returncode} while loading")
             try:
-                self.process.terminate()
-                self.process.wait(timeout=1)
-                return
-            except subprocess.TimeoutExpired:
+                response = session.get(url, timeout=max(self.interval, 1))
+                if response.status_code == 200 and response.json().get("status", "ok") != "loading model":
+                    break
+            except (requests.RequestException, ValueError):
                 pass
+            if time.perf_counter() - started > timeout:
+                stop_process_group(process.pid, process)
+                return self._failed(process, stop_event, f"The model did not load within {timeout} s")
+            stop_event.wait(self.interval)
+        load_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            if stop_event.is_set():
+                return
+            self.load_ms = load_ms
+            self._set_state(SERVER_READY, f"Loaded in {load_ms / 1000:.1f} s")
+        logger.info("Model loaded in %.0f ms", load_ms)
+        process.wait()
+        self._failed(process, stop_event, f"llama-server exited with code {process.returncode}")
+
+    def _failed(self, process, stop_event, message):
+        with self._lock:
+            if stop_event.is_set():
+                return
+            stop_event.set()
+            self.command = None
+            if self.registry is not None:
+                self.registry.remove(process.pid)
+            tail = "\n".join(list(self.output)[-5:])
+            self._set_state(SERVER_FAILED, f"{message}\n\n{tail}" if tail else message)
+
+    def _set_state(self, state, message=""):
+        self.state = state
+        self.message = message
+        self._state_emit.emit(state, message)
 
-            self.process.kill()
-            self.process.wait(timeout=1)
-        except Exception as e:
-            print(f"Error terminating llama.cpp server: {e}")
+    def stop(self):
+        # returns at once with an event that is set when the process is gone; a launch still in progress
+        # stops its own process
+        with self._lock:
+            process = self.process
+            gone = self._gone
+            self._stop_event.set()
+            self.process = None
+            self.command = None
+        if process is not None:
+            self._stopping.add(process)
+            threading.Thread(target=self._stop_process, args=(process, gone), daemon=True).start()
+        if self.state != SERVER_STOPPED:
+            self._set_state(SERVER_STOPPED)
+        return gone
+
+    def _stop_process(self, process, gone):
+        try:
+            stop_process_group(process.pid, process)
+            if self.registry is not None:
+                self.registry.remove(process.pid)
+        finally:
+            self._stopping.discard(process)
+            gone.set()
+
+    def _terminate(self):
+        for process in [self.process, *self._stopping]:
+            if process is not None and process.poll() is None:
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+class ModelPool(QObject):
+    # resident servers keyed by model path, least recently used first; each gets its own port counting up
+    # from the configured one, and the oldest are stopped once there are too many or they outgrow the budget
+    state_changed = pyqtSignal(str, str, str)
+    metrics_changed = pyqtSignal(str, dict)
+
+    def __init__(self, backend, parent=None, max_servers=1, budget=0, registry=None):
+        super().__init__(parent)
+        self.backend = backend
+        self.registry = registry
+        self.max_servers = max_servers
+        self.budget = budget
+        self.servers = OrderedDict()
+        self.ports = {}
+        self.estimates = {}
+        self.draining = {}      # port -> event set once the server released from it has exited
+
+    def configure(self, max_servers=1, budget=0):
+        self.max_servers = max(1, max_servers)
+        self.budget = max(0, budget)
+
+    def get(self, key):
+        supervisor = self.servers.get(key)
+        if supervisor is None or supervisor.state not in (SERVER_LOADING, SERVER_READY):
+            return None
+        return supervisor
+
+    def acquire(self, key, options, binary="./llama/llama-server", timeout=300, estimate=0, log_dir=""):
+        supervisor = self.servers.get(key)
+        if supervisor is not None:
+            self.servers.move_to_end(key)
+        self.estimates[key] = estimate
+        self._evict(keep=key)
+        if supervisor is None:
+            used = set(self.ports.values())
+            port = int(options['port'])
+            while port in used:
+                port += 1
+            supervisor = ServerSupervisor(self.backend, self, registry=self.registry)
+            supervisor.state_changed.connect(lambda state, message, key=key: self.state_changed.emit(key, state, message))
+            supervisor.metrics_changed.connect(lambda metrics, key=key: self.metrics_changed.emit(key, metrics))
+            self.servers[key] = supervisor
+            self.ports[key] = port
+        log_path = os.path.join(log_dir, f"llama-server-{self.ports[key]}.log") if log_dir else None
+        supervisor.start(dict(options, port=self.ports[key]), binary=binary, timeout=timeout, log_path=log_path, after=self.draining.pop(self.ports[key], None))
+        return supervisor
+
+    def address(self, key, host="127.0.0.1"):
+        return f"http://{host}:{self.ports[key]}"
+
+    def _evict(self, keep):
+        while True:
+            others = [key for key in self.servers if key != keep]
+            total = sum(self.estimates.get(key, 0) for key in others + [keep])
+            if not others or (len(others) < self.max_servers and not (self.budget and total > self.budget)):
+                return
+            logger.info("Evicting %s from the model pool", others[0])
+            self.release(others[0])
+
+    def release(self, key):
+        supervisor = self.servers.pop(key, None)
+        port = self.ports.pop(key, None)
+        self.estimates.pop(key, None)
+        if supervisor is not None:
+            self.draining[port] = supervisor.stop()
+            supervisor.deleteLater()
+
+    def stop(self, wait=0):
+        # wait: seconds to give the servers to exit, for when the app quits
+        for key in list(self.servers):
+            self.release(key)
+        deadline = time.monotonic() + wait
+        for gone in self.draining.values():
+            gone.wait(max(0, deadline - time.monotonic()))
+
+class TokenBatcher:
+    # coalesces streamed tokens into chunks: a chunk goes out after max_batch tokens or max_latency seconds, whichever comes first
+    def __init__(self, emit, max_latency=0.03, max_batch=32):
+        self.emit = emit
+        self.max_latency = max_latency
+        self.max_batch = max(1, max_batch)
+        self._buffer = []
+        self._deadline = None
+        self._last_emit = float("-inf")
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        if self.max_latency > 0 and self.max_batch > 1:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def add(self, token):
+        with self._cond:
+            self._buffer.append(token)
+            now = time.monotonic()
+            # a token arriving after a quiet period (the first one included) goes out at once
+            if self._thread is None or len(self._buffer) >= self.max_batch or now - self._last_emit >= self.max_latency:
+                self._flush_locked()
+            elif self._deadline is None:
+                self._deadline = self._last_emit + self.max_latency
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._flush_locked()
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _flush_locked(self):
+        self._deadline = None
+        if self._buffer:
+            chunk = "".join(self._buffer)
+            self._buffer.clear()
+            self._last_emit = time.monotonic()
+            self.emit(chunk)
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._flush_locked()
+
+SSE_DELTA_CONTENT = re.compile(rb'"delta":\s*\{\s*"content":\s*"([^"\\]*(?:\\.[^"\\]*)*)"\s*\}')
 
-class LLMWorker(QThread):
+class ChatStreamParser:
+    # sans-io parser for llama-server's /v1/chat/completions event stream: feed raw bytes, get
+    # ("token", str), ("stats", dict), ("error", dict) and ("done", None) back; only data and error lines are looked at
+    DONE = ("done", None)
+
+    def __init__(self):
+        self._buffer = b""
+        self._cr = False
+        self.done = False
+
+    def feed(self, data):
+        if not data:
+            return []
+        if self._cr and data[:1] == b"\n":
+            data = data[1:]
+        self._cr = data[-1:] == b"\r"
+        if b"\r" in data:
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        buffer = self._buffer + data if self._buffer else data
+        end = buffer.rfind(b"\n\n")
+        if end < 0:
+            self._buffer = buffer
+            return []
+        self._buffer = buffer[end + 2:]
+        events = []
+        for block in buffer[:end].split(b"\n\n"):
+            if block[:6] == b"data: " and b"\n" not in block:
+                event = self._decode(block[6:])
+            else:
+                event = self._parse(block)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def close(self):
+        block, self._buffer = self._buffer, b""
+        if not block.strip():
+            return []
+        event = self._parse(block)
+        return [] if event is None else [event]
+
+    def _parse(self, block):
+        lines = [line[5:] for line in block.split(b"\n") if line.startswith(b"data:")]
+        if not lines:
+            # llama-server reports a failure inside a stream on an "error:" line of its own
+            lines = [line[6:] for line in block.split(b"\n") if line.startswith(b"error:")]
+            return self._decode(b'{"error": ' + lines[0].strip() + b"}") if lines else None
+        return self._decode(b"\n".join(line[1:] if line[:1] == b" " else line for line in lines))
+
+    def _decode(self, data):
+        if data == b"[DONE]":
+            self.done = True
+            return self.DONE
+        # token chunks are the bulk of the stream; pull the content string out without decoding the whole object
+        match = SSE_DELTA_CONTENT.search(data)
+        if match is not None:
+            token = match.group(1)
+            if b"\\" in token:
+                return ("token", json.decoder.scanstring(token.decode("utf-8") + '"', 0)[0])
+            return ("token", token.decode("utf-8")) if token else None
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return None
+        choices = chunk.get("choices")
+        if choices:
+            token = choices[0].get("delta", {}).get("content")
+            return ("token", token) if token else None
+        if "usage" in chunk or "timings" in chunk:
+            return ("stats", chunk)
+        if "error" in chunk:
+            return ("error", chunk["error"] if isinstance(chunk["error"], dict) else {"message": str(chunk["error"])})
+        return None
+
+def iter_chat_stream(chunks):
+    parser = ChatStreamParser()
+    for data in chunks:
+        yield from parser.feed(data)
+    yield from parser.close()
+
+async def aiter_chat_stream(chunks):
+    # same as iter_chat_stream for asyncio clients, e.g. aiohttp's resp.content.iter_any() or httpx's aiter_bytes()
+    parser = ChatStreamParser()
+    async for data in chunks:
+        for event in parser.feed(data):
+            yield event
+    for event in parser.close():
+        yield event
+
+class ContextBuilder:
+    # what goes into a request: the system prompt always, then the newest turns that fit the token budget.
+    # counts come from the tokens cached on the messages (per tokenizer key); only messages without one
+    # are tokenized, so a build is one pass over the messages
+    OVERHEAD = 8    # role markers and separators the chat template puts around a message
+
+    def __init__(self, messages, key, budget):
+        self.messages = messages
+        self.key = key
+        self.budget = budget
+        self.counted = []
+        self.used = 0
+        self.dropped = 0
+        self._sizes = {}
+
+    def count(self, message, tokenize):
+        size = self._sizes.get(id(message))
+        if size is None:
+            tokens = (message.get("tokens") or {}).get(self.key)
+            if tokens is None:
+                tokens = tokenize(message["content"])
+                if tokens is None:
+                    tokens = len(message["content"]) // 3
+                else:
+                    self.counted.append((message, tokens))
+            size = self._sizes[id(message)] = tokens + self.OVERHEAD
+        return size
+
+    def build(self, tokenize):
+        pinned = self.messages[:1] if self.messages and self.messages[0]["role"] == "system" else []
+        turns = self.messages[len(pinned):]
+        if self.budget is None:
+            return pinned + turns
+        self.used = sum(self.count(message, tokenize) for message in pinned)
+        selected = []
+        for message in reversed(turns):
+            tokens = self.count(message, tokenize)
+            if selected and self.used + tokens > self.budget:
+                break
+            self.used += tokens
+            selected.append(message)
+        # a cut right after a user turn would start the conversation with a reply, which some templates refuse
+        while len(selected) > 1 and selected[-1]["role"] == "assistant":
+            self.used -= self.count(selected.pop(), tokenize)
+        self.dropped = len(turns) - len(selected)
+        return pinned + selected[::-1]
+
+class LLMWorker(QObject):
     result_ready = pyqtSignal(str)
     token_emit = pyqtSignal(str)
     error_emit = pyqtSignal(str)
     stats_emit = pyqtSignal(dict)
+    tokens_emit = pyqtSignal(list)
+    finished = pyqtSignal()
 
-    def __init__(self, request, url):
+    def __init__(self, request, url, session=None, max_latency=0.03, max_batch=32, slot_actions=(), slot_cache=None, context=None, tokenizer=None):
         super().__init__()
         self.request = request
+        self.context = context
+        self.tokenizer = tokenizer
+        self._no_tokenize = False
+        self.slot_actions = slot_actions
+        self.slot_cache = slot_cache
         self.reply = ""
         self._is_running = True
         self.url = url
-        print("LLMWorker is created")
+        self.session = session if session is not None else requests
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        logger.debug("LLMWorker is created")
 
     def run(self):
-        print("LLMWorker is running")
-        self._is_running = True
+        logger.debug("LLMWorker is running")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        batcher = TokenBatcher(self.token_emit.emit, self.max_latency, self.max_batch)
         try:
-            response = requests.post(self.url, json=self.request, stream=True)
-            client = sseclient.SSEClient(response)
-            self.reply = ""
-            for event in client.events():
-                print(f'Event: {event.data}')
-                if event.data.strip() == "[DONE]":
-                    break
-                try:
-                    chunk = json.loads(event.data)
-                    print(f'Chunk: {chunk}')
-                    choices = chunk.get('choices', [])
-                    print(f'Choices: {choices}')
-                    if not choices:
-                        if "usage" in chunk or "timings" in chunk:
-                            self.stats_emit.emit(chunk)
-                        continue
-                    delta = choices[0].get('delta', {})
-                    token = delta.get('content')
-                    if token:
-                        self.reply += token
-                        self.token_emit.emit(token)
-                except (json.JSONDecodeError, KeyError):
-                    continue
-            self.result_ready.emit(self.reply)
-
-            if not self._is_running:
-                return
+            slot_stats = self.prepare_slot()
+            if self.context is not None:
+                self.request["messages"] = self.context.build(self.tokenize)
+                if self.context.counted:
+                    self.tokens_emit.emit(self.context.counted)
+                if self.context.budget is not None:
+                    slot_stats = dict(slot_stats, context_t=self.context.used, dropped_m=self.context.dropped)
+            with self.session.post(self.url, json=self.request, stream=True) as response:
+                if not response.ok:
+                    # llama-server answers a rejected request (context overflow, bad slot, still loading) with a plain body
+                    batcher.close()
+                    self.error_emit.emit(f"{response.status_code} {response.reason}: {response.text.strip()}")
+                    return
+                reply = []
+                # read to the end of the body, [DONE] included, so the connection goes back to the session pool
+                for kind, payload in iter_chat_stream(response.iter_content(chunk_size=None)):
+                    if not self._is_running:
+                        break
+                    if kind == "token":
+                        reply.append(payload)
+                        batcher.add(payload)
+                    elif kind == "stats":
+                        self.stats_emit.emit(dict(payload, slot=slot_stats) if slot_stats else payload)
+                    elif kind == "error":
+                        raise RuntimeError(payload.get("message") or json.dumps(payload))
+                    if debug:
+                        logger.debug("Event: %s %s", kind, payload)
+            batcher.close()
+            self.reply = "".join(reply)
+            if self._is_running:
+                self.result_ready.emit(self.reply)
         except Exception as e:
+            batcher.close()
             self.error_emit.emit(str(e))
-        
+        finally:
+            self.finished.emit()
+
+    def tokenize(self, text):
+        # the model's own vocabulary when it is loaded; otherwise /tokenize, where one failure (an older or
+        # remote server) switches the rest of this request to estimates
+        if self.tokenizer is not None:
+            return self.tokenizer.count(text)
+        if self._no_tokenize:
+            return None
+        parts = urllib.parse.urlsplit(self.url)
+        try:
+            response = self.session.post(f"{parts.scheme}://{parts.netloc}/tokenize", json={"content": text}, timeout=30)
+            response.raise_for_status()
+            return len(response.json()["tokens"])
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.warning("Tokenize failed, estimating token counts: %s", e)
+            self._no_tokenize = True
+            return None
+
+    def prepare_slot(self):
+        # moves KV state between the slot and disk before the request; a failed save or restore only costs a longer prefill
+        stats = {}
+        parts = urllib.parse.urlsplit(self.url)
+        for action, filename in self.slot_actions:
+            started = time.perf_counter()
+            try:
+                response = self.session.post(f"{parts.scheme}://{parts.netloc}/slots/{self.request['id_slot']}?action={action}", json={"filename": filename}, timeout=120)
+                response.raise_for_status()
+                result = response.json()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("Slot %s of %s failed: %s", action, filename, e)
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            if action == "restore":
+                stats["restore_ms"] = round(result.get("timings", {}).get("restore_ms", elapsed), 2)
+                stats["restored_t"] = result.get("n_restored")
+            elif self.slot_cache is not None:
+                self.slot_cache.prune()
+            logger.debug("Slot %s %s: %s", action, filename, result)
+        return stats
+
     def stop(self):
         self._is_running = False
 
+class GenerationBackend(QObject):
+    # long-lived: keeps one keep-alive session per server address and a few worker threads that outlive single prompts
+    def __init__(self, parent=None, max_workers=2):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.pool.setExpiryTimeout(-1)
+        self.sessions = {}
+        self.jobs = set()
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        parts = urllib.parse.urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool.maxThreadCount())
+                session.mount(key, adapter)
+                self.sessions[key] = session
+            return session
+
+    def submit(self, request, url, **options):
+        job = LLMWorker(request, url, session=self.session(url), **options)
+        self.jobs.add(job)
+        job.finished.connect(lambda: self.jobs.discard(job))
+        self.pool.start(job.run)
+        return job
+
+    def cancel(self):
+        for job in list(self.jobs):
+            job.stop()
+
+    def shutdown(self, timeout=2000):
+        self.cancel()
+        self.pool.waitForDone(timeout)
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+GGUF_FILE_TYPES = {
+        0: "F32",
+        1: "F16",
+        2: "Q4_0",
+        3: "Q4_1",
+        4: "Q4_1_SOME_F16",
+        5: "Q4_2",
+        6: "Q4_3",
+        7: "Q8_0",
+        8: "Q5_0",
+        9: "Q5_1",
+        10: "Q2_K",
+        11: "Q3_K_S",
+        12: "Q3_K_M",
+        13: "Q3_K_L",
+        14: "Q4_K_S",
+        15: "Q4_K_M",
+        16: "Q5_K_S",
+        17: "Q5_K_M",
+        18: "Q6_K",
+        19: "IQ2_XSS",
+        20: "IQ2_XS",
+        21: "Q2_K_S",
+        22: "IQ3_XS",
+        23: "IQ3_XXS",
+        24: "IQ1_S",
+        25: "IQ4_NL",
+        26: "IQ3_S",
+        27: "IQ3_M",
+        28: "IQ2_S",
+        29: "IQ2_M",
+        30: "IQ4_XS",
+        31: "IQ1_M",
+        32: "BF16",
+        33: "Q4_0_4_4",
+        34: "Q4_0_4_8",
+        35: "Q4_0_8_8",
+        36: "TQ1_0",
+        37: "TQ2_0",
+        38: "MXFP4_MOE",
+        145: "IQ4_KS",
+        147: "IQ2_KS",
+        148: "IQ4_KSS",
+        150: "IQ5_KS",
+        154: "IQ3_KS",
+        155: "IQ2_KL",
+        156: "IQ1_KT"
+}
+
+GGUF_SCALAR_TYPES = {0: "B", 1: "b", 2: "H", 3: "h", 4: "I", 5: "i", 6: "f", 7: "?", 10: "Q", 11: "q", 12: "d"}
+GGUF_STRING, GGUF_ARRAY = 8, 9
+
+class GGUFMetadataReader:
+    # reads the key/value section of a GGUF file and stops where the tensor infos begin (or after them, with tensors=True),
+    # so only the first few KiB (plus the tokenizer arrays, if wanted) are read of a multi-GB model.
+    # numeric arrays come back as numpy arrays, arrays longer than max_array are skipped over and only their length is kept
+    def __init__(self, f, max_array=None, tensors=False):
+        self.f = f
+        self.max_array = max_array
+        self.tensors = tensors
+        self.endian = "<"
+        self.count = "Q"
+        self.skipped = {}
+        self.skipped_length = None
+
+    def read(self):
+        if self.f.read(4) != b"GGUF":
+            raise ValueError("not a GGUF file")
+        version = self._unpack("I")
+        if version & 0xFFFF == 0:   # written on a big-endian host
+            self.endian = ">"
+            version = struct.unpack(">I", struct.pack("<I", version))[0]
+        if version == 1:
+            self.count = "I"
+        tensor_count, kv_count = self._unpack(self.count * 2)
+        metadata = {"GGUF.version": version, "GGUF.tensor_count": tensor_count}
+        for _ in range(kv_count):
+            key = self._string()
+            self.skipped_length = None
+            value = self._value(self._unpack("I"))
+            if value is not None:
+                metadata[key] = value
+            elif self.skipped_length is not None:
+                self.skipped[key] = self.skipped_length
+        metadata["GGUF.kv_end"] = self.f.tell()
+        if self.skipped:
+            metadata["GGUF.array_lengths"] = self.skipped
+        if self.tensors:
+            metadata.update(self._tensor_sizes(tensor_count))
+        return metadata
+
+    def _tensor_sizes(self, tensor_count):
+        # what the memory estimate needs: bytes of every repeating block (blk.N.*), of the output head and of the rest.
+        # a type this gguf package doesn't know is sized by the distance to the next tensor's data
+        tensors = []
+        for _ in range(tensor_count):
+            name = self._string()
+            dims = self._unpack("I")
+            shape = struct.unpack(self.endian + self.count * dims, self._read(struct.calcsize(self.count) * dims))
+            ggml_type = self._unpack("I")
+            offset = self._unpack("Q")
+            size = None
+            if ggml_type in GGML_QUANT_SIZES:
+                block_size, type_size = GGML_QUANT_SIZES[ggml_type]
+                size = math.prod(shape) // block_size * type_size
+            tensors.append([offset, size, name])
+        tensors.sort()
+        for tensor, following in zip(tensors, tensors[1:] + [None]):
+            if tensor[1] is None:
+                tensor[1] = following[0] - tensor[0] if following else 0
+        sizes = {"GGUF.layer_bytes": [], "GGUF.output_bytes": 0, "GGUF.input_bytes": 0}
+        for _offset, size, name in tensors:
+            parts = name.split(".")
+            if parts[0] == "blk" and parts[1].isdigit():
+                layers = sizes["GGUF.layer_bytes"]
+                layers.extend([0] * (int(parts[1]) + 1 - len(layers)))
+                layers[int(parts[1])] += size
+            elif parts[0].startswith("output"):
+                sizes["GGUF.output_bytes"] += size
+            else:
+                sizes["GGUF.input_bytes"] += size
+        return sizes
+
+    def _unpack(self, fmt):
+        fmt = self.endian + fmt
+        values = struct.unpack(fmt, self._read(struct.calcsize(fmt)))
+        return values[0] if len(values) == 1 else values
+
+    def _read(self, size):
+        data = self.f.read(size)
+        if len(data) != size:
+            raise ValueError("GGUF header is truncated")
+        return data
+
+    def _string(self, skip=False):
+        length = self._unpack(self.count)
+        if skip:
+            self.f.seek(length, os.SEEK_CUR)
+            return None
+        return self._read(length).decode("utf-8", errors="replace")
+
+    def _value(self, value_type, skip=False):
+        if value_type in GGUF_SCALAR_TYPES:
+            fmt = GGUF_SCALAR_TYPES[value_type]
+            if skip:
+                self.f.seek(struct.calcsize(fmt), os.SEEK_CUR)
+                return None
+            return self._unpack(fmt)
+        if value_type == GGUF_STRING:
+            return self._string(skip)
+        if value_type != GGUF_ARRAY:
+            raise ValueError(f"unknown GGUF value type {value_type}")
+        item_type = self._unpack("I")
+        length = self._unpack(self.count)
+        if not skip and self.max_array is not None and length > self.max_array:
+            skip, self.skipped_length = True, length
+        if item_type in GGUF_SCALAR_TYPES:
+            dtype = np.dtype(self.endian + GGUF_SCALAR_TYPES[item_type])
+            if skip:
+                self.f.seek(length * dtype.itemsize, os.SEEK_CUR)
+                return None
+            return np.frombuffer(self._read(length * dtype.itemsize), dtype=dtype)
+        if item_type == GGUF_STRING:
+            return self._strings(length, skip)
+        items = [self._value(item_type, skip) for _ in range(length)]
+        return None if skip else items
+
+    def _strings(self, length, skip):
+        # vocabularies hold 100k+ strings, walk them through a buffer instead of two reads per string
+        unpack = struct.Struct(self.endian + self.count).unpack_from
+        size = struct.calcsize(self.count)
+        buffer, offset, items = b"", 0, []
+        for _ in range(length):
+            if len(buffer) - offset < size:
+                buffer, offset = self._refill(buffer, offset, size)
+            string_length = unpack(buffer, offset)[0]
+            offset += size
+            if len(buffer) - offset < string_length:
+                buffer, offset = self._refill(buffer, offset, string_length)
+            if not skip:
+                items.append(buffer[offset:offset + string_length].decode("utf-8", errors="replace"))
+            offset += string_length
+        self.f.seek(offset - len(buffer), os.SEEK_CUR)
+        return None if skip else items
+
+    def _refill(self, buffer, offset, size):
+        buffer = buffer[offset:] + self.f.read(max(size, 1 << 20))
+        if len(buffer) < size:
+            raise ValueError("GGUF header is truncated")
+        return buffer, 0
+
+def read_gguf_metadata(path, max_array=None, tensors=False):
+    with open(path, "rb", buffering=1 << 16) as f:
+        metadata = GGUFMetadataReader(f, max_array, tensors).read()
+    split_count = metadata.get("split.count", 1)
+    if tensors and split_count > 1 and metadata.get("split.no", 0) == 0:
+        # the tensors of a split model are spread over its shards, the sizes cover all of them
+        for shard in range(2, split_count + 1):
+            with open(GGUF_SHARD.sub(f"-{shard:05d}-of-{split_count:05d}.gguf", path), "rb", buffering=1 << 16) as f:
+                part = GGUFMetadataReader(f, 0, True).read()
+            layers = metadata["GGUF.layer_bytes"]
+            layers.extend([0] * (len(part["GGUF.layer_bytes"]) - len(layers)))
+            for block, size in enumerate(part["GGUF.layer_bytes"]):
+                layers[block] += size
+            metadata["GGUF.output_bytes"] += part["GGUF.output_bytes"]
+            metadata["GGUF.input_bytes"] += part["GGUF.input_bytes"]
+    return metadata
+
+def gguf_model_info(path, metadata):
+    arch = metadata.get("general.architecture")
+    layers = metadata.get(f"{arch}.block_count", next((value for key, value in metadata.items() if key.endswith(".block_count")), "Unknown"))
+    file_type = metadata.get("general.file_type")
+    return {
+        "path": path,
+        "name": str(metadata.get("general.name", "Unknown")),
+        "parameters": str(metadata.get("general.size_label", "Unknown")),
+        "weights": "Unknown" if file_type is None else GGUF_FILE_TYPES.get(file_type, f"Unknown ({file_type})"),
+        "layers": str(layers)
+    }
+
+def estimate_memory(metadata, gpu_layers, ctx_size=0, batch_size=512):
+    # bytes of RAM and VRAM llama.cpp needs with gpu_layers offloaded: the last blocks go to the GPU first and the output
+    # head once all of them are there (gpu_layers = blocks + 1), each block takes its share of an f16 KV cache,
+    # and whichever side computes holds the compute buffer, sized by the larger of the logits and the attention scores
+    # of one micro-batch (llama.cpp's graph allocator reuses the memory of one for the other)
+    arch = metadata.get("general.architecture")
+    layers = metadata.get("GGUF.layer_bytes", [])
+    blocks = len(layers)
+    gpu_layers = max(0, min(gpu_layers, blocks + 1))
+    ctx_size = ctx_size if ctx_size > 0 else metadata.get(f"{arch}.context_length", 4096)
+    embedding = metadata.get(f"{arch}.embedding_length", 0)
+    heads = metadata.get(f"{arch}.attention.head_count", 1)
+    heads = max(heads) if isinstance(heads, list) else heads
+    kv_heads = metadata.get(f"{arch}.attention.head_count_kv", heads)
+    kv_heads = kv_heads if isinstance(kv_heads, list) else [kv_heads] * blocks
+    key_length = metadata.get(f"{arch}.attention.key_length", embedding // max(heads, 1))
+    value_length = metadata.get(f"{arch}.attention.value_length", embedding // max(heads, 1))
+    vocab = metadata.get(f"{arch}.vocab_size", metadata.get("GGUF.array_lengths", {}).get("tokenizer.ggml.tokens", 0))
+    kv = [ctx_size * kv_heads[block] * (key_length + value_length) * 2 for block in range(min(blocks, len(kv_heads)))]
+    first_gpu = blocks - min(gpu_layers, blocks)
+    ubatch = min(batch_size, 512)
+    compute = ubatch * max(vocab, ctx_size * heads) * 4
+    vram = sum(layers[first_gpu:]) + sum(kv[first_gpu:])
+    ram = metadata.get("GGUF.input_bytes", 0) + sum(layers[:first_gpu]) + sum(kv[:first_gpu])
+    if gpu_layers > blocks:
+        vram += metadata.get("GGUF.output_bytes", 0)
+    else:
+        ram += metadata.get("GGUF.output_bytes", 0)
+    if gpu_layers > 0:
+        vram += compute
+    else:
+        ram += compute
+    return {"ram": ram, "vram": vram, "gpu_layers": gpu_layers, "ctx_size": ctx_size}
+
+def fit_gpu_layers(metadata, budget, ctx_size=0, batch_size=512):
+    # the most layers whose estimate fits the VRAM budget (bytes)
+    for gpu_layers in range(len(metadata.get("GGUF.layer_bytes", [])) + 1, 0, -1):
+        if estimate_memory(metadata, gpu_layers, ctx_size, batch_size)["vram"] <= budget:
+            return gpu_layers
+    return 0
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+class GGUFMetadataCache:
+    # GGUF metadata keyed by path; an entry is only used while the file keeps the size and mtime it was read with.
+    # the tokenizer vocabularies are left out, anything that needs them reads the file
+    MAX_ARRAY = 64
+    VERSION = 2     # 2: tensor sizes for the memory estimate
+
+    def __init__(self, path="models/gguf_cache.json", writer=None):
+        self.path = path
+        self.writer = writer
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.files = json.load(f).get("files", {})
+        except (OSError, ValueError, AttributeError):
+            self.files = {}
+
+    def stamp(self, path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path, stamp=None):
+        stamp = self.stamp(path) if stamp is None else stamp
+        with self._lock:
+            entry = self.files.get(path)
+        if entry is not None and entry["stamp"] == stamp and entry.get("version") == self.VERSION:
+            return entry["metadata"]
+        return None
+
+    def put(self, path, metadata, stamp=None):
+        stamp = self.stamp(path) if stamp is None else stamp
+        metadata = {key: self._plain(value) for key, value in metadata.items()}
+        with self._lock:
+            self.files[path] = {"stamp": stamp, "version": self.VERSION, "metadata": metadata}
+        if self.writer is not None:
+            self.writer.submit(("gguf_cache", self.path), self.save)
+        else:
+            self.save()
+        return metadata
+
+    def read(self, path):
+        stamp = self.stamp(path)
+        metadata = self.get(path, stamp)
+        if metadata is None:
+            metadata = self.put(path, read_gguf_metadata(path, self.MAX_ARRAY, tensors=True), stamp)
+        return metadata
+
+    def _plain(self, value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, list):
+            return [self._plain(item) for item in value]
+        return value
+
+    def save(self):
+        with self._lock:
+            files = dict(self.files)
+        if os.path.dirname(self.path) and not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        write_json_atomic(self.path, {"files": files})
+
+# llama.cpp's pre-tokenizer regexes; re has no \p{L}/\p{N}, so letters are [^\W\d_] and numbers \d
+GGUF_PRETOKENIZE_GPT2 = r"'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d+| ?(?:[^\s\w]|_)+|\s+(?!\S)|\s+"
+GGUF_PRETOKENIZE_LLAMA3 = r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|(?:[^\r\n\w]|_)?[^\W\d_]+|\d{1,3}| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+GGUF_PRETOKENIZE_QWEN2 = r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|(?:[^\r\n\w]|_)?[^\W\d_]+|\d| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+GGUF_PRETOKENIZERS = {
+        "llama-bpe": GGUF_PRETOKENIZE_LLAMA3,
+        "llama3": GGUF_PRETOKENIZE_LLAMA3,
+        "smaug-bpe": GGUF_PRETOKENIZE_LLAMA3,
+        "dbrx": GGUF_PRETOKENIZE_LLAMA3,
+        "qwen2": GGUF_PRETOKENIZE_QWEN2,
+        "deepseek-r1-qwen": GGUF_PRETOKENIZE_QWEN2,
+}
+
+def gpt2_byte_table():
+    # byte-level BPE spells every byte as a printable character; as a latin-1 -> unicode translate table
+    # the whole mapping runs in C
+    printable = [*range(ord("!"), ord("~") + 1), *range(ord("¡"), ord("¬") + 1), *range(ord("®"), ord("ÿ") + 1)]
+    table = np.arange(256, dtype=np.int32)
+    unprintable = np.setdiff1d(table, printable)
+    table[unprintable] = 256 + np.arange(len(unprintable))
+    return {byte: int(char) for byte, char in enumerate(table)}
+
+class GGUFTokenizer:
+    # token counts from the vocabulary in a GGUF (tokenizer.ggml.*), no server needed: byte-level BPE ("gpt2")
+    # and sentencepiece ("llama"), merging in the same order as llama.cpp. counts match /tokenize, which adds
+    # no BOS and matches unknown, control and user-defined tokens whole
+    CACHE_SIZE = 4
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        stat = os.stat(path)
+        stamp = (path, stat.st_size, stat.st_mtime_ns)
+        with cls._cache_lock:
+            tokenizer = cls._cache.get(stamp)
+            if tokenizer is not None:
+                cls._cache.move_to_end(stamp)
+                return tokenizer
+        tokenizer = cls(read_gguf_metadata(path))
+        with cls._cache_lock:
+            cls._cache[stamp] = tokenizer
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return tokenizer
+
+    def __init__(self, metadata):
+        self.model = metadata.get("tokenizer.ggml.model")
+        if self.model not in ("gpt2", "llama"):
+            raise ValueError(f"Unsupported tokenizer: {self.model}")
+        tokens = metadata["tokenizer.ggml.tokens"]
+        self.vocab = {token: id for id, token in enumerate(tokens)}
+        types = np.asarray(metadata.get("tokenizer.ggml.token_type", np.ones(len(tokens))), dtype=np.int32)
+        specials = sorted((tokens[id] for id in np.flatnonzero((types == 2) | (types == 3) | (types == 4)) if tokens[id]), key=len, reverse=True)
+        self.special = re.compile("|".join(map(re.escape, specials))) if specials else None
+        self.words = {}
+        if self.model == "gpt2":
+            pre = metadata.get("tokenizer.ggml.pre", "default")
+            self.pattern = re.compile(GGUF_PRETOKENIZERS.get(pre, GGUF_PRETOKENIZE_GPT2))
+            self.ignore_merges = GGUF_PRETOKENIZERS.get(pre) is GGUF_PRETOKENIZE_LLAMA3
+            self.ranks = {tuple(merge.split(" ", 1)): rank for rank, merge in enumerate(metadata.get("tokenizer.ggml.merges", []))}
+            self.bytes = gpt2_byte_table()
+        else:
+            self.scores = np.asarray(metadata.get("tokenizer.ggml.scores", np.zeros(len(tokens))), dtype=np.float32)
+            self.add_space_prefix = metadata.get("tokenizer.ggml.add_space_prefix", True)
+
+    def count(self, text):
+        total = 0
+        prev_special = True
+        position = 0
+        for match in self.special.finditer(text) if self.special is not None else ():
+            if match.start() > position:
+                total += self._count_text(text[position:match.start()], prev_special)
+            total += 1
+            prev_special = True
+            position = match.end()
+        if position < len(text):
+            total += self._count_text(text[position:], prev_special)
+        return total
+
+    def _count_text(self, text, prev_special):
+        if self.model == "llama":
+            if self.add_space_prefix and prev_special:
+                text = " " + text
+            return self._spm(text.replace(" ", "▁"))
+        total = 0
+        words = self.words
+        if len(words) > 200000:
+            words.clear()
+        for word in self.pattern.findall(text):
+            count = words.get(word)
+            if count is None:
+                count = words[word] = self._bpe(word.encode("utf-8").decode("latin-1").translate(self.bytes))
+            total += count
+        return total
+
+    def _bpe(self, word):
+        if self.ignore_merges and word in self.vocab:
+            return 1
+        # lowest rank first, the leftmost of equals; one merge at a time like llama.cpp's work queue
+        symbols = list(word)
+        ranks = self.ranks
+        while len(symbols) > 1:
+            best = None
+            for i in range(len(symbols) - 1):
+                rank = ranks.get((symbols[i], symbols[i + 1]))
+                if rank is not None and (best is None or rank < best[0]):
+                    best = (rank, i)
+            if best is None:
+                break
+            i = best[1]
+            symbols[i:i + 2] = [symbols[i] + symbols[i + 1]]
+        # a symbol outside the vocabulary falls back to one token per byte
+        return sum(1 if symbol in self.vocab else len(symbol) for symbol in symbols)
+
+    def _spm(self, text):
+        # highest scoring bigram that is in the vocabulary first, the leftmost of equals
+        size = len(text)
+        if not size:
+            return 0
+        vocab = self.vocab
+        scores = self.scores
+        lengths = [1] * size
+        following = list(range(1, size + 1))
+        preceding = list(range(-1, size - 1))
+        queue = []
+        def bigram(left, right):
+            if left >= 0 and right < size:
+                id = vocab.get(text[left:right + lengths[right]])
+                if id is not None:
+                    heapq.heappush(queue, (-scores[id], left, right, lengths[left] + lengths[right]))
+        for i in range(size - 1):
+            bigram(i, i + 1)
+        while queue:
+            _score, left, right, length = heapq.heappop(queue)
+            if not lengths[left] or not lengths[right] or lengths[left] + lengths[right] != length or following[left] != right:
+                continue
+            lengths[left] = length
+            lengths[right] = 0
+            following[left] = following[right]
+            if following[left] < size:
+                preceding[following[left]] = left
+            bigram(preceding[left], left)
+            bigram(left, following[left])
+        total = 0
+        i = 0
+        while i < size:
+            piece = text[i:i + lengths[i]]
+            total += 1 if piece in vocab else len(piece.encode("utf-8"))
+            i = following[i]
+        return total
+
 class GGUFInfoWoker(QThread):
     info_ready = pyqtSignal(dict)
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, cache):
         super().__init__()
         self._is_running = True
         self.model_path = model_path
-        self.weights_map = {
-            0: "F32",
-            1: "F16",
-            2: "Q4_0",
-            3: "Q4_1",
-            4: "Q4_1_SOME_F16",
-            5: "Q4_2",
-            6: "Q4_3",
-            7: "Q8_0",
-            8: "Q5_0",
-            9: "Q5_1",
-            10: "Q2_K",
-            11: "Q3_K_S",
-            12: "Q3_K_M",
-            13: "Q3_K_L",
-            14: "Q4_K_S",
-            15: "Q4_K_M",
-            16: "Q5_K_S",
-            17: "Q5_K_M",
-            18: "Q6_K",
-            19: "IQ2_XSS",
-            20: "IQ2_XS",
-            21: "Q2_K_S",
-            22: "IQ3_XS",
-            23: "IQ3_XXS",
-            24: "IQ1_S",
-            25: "IQ4_NL",
-            26: "IQ3_S",
-            27: "IQ3_M",
-            28: "IQ2_S",
-            29: "IQ2_M",
-            30: "IQ4_XS",
-            31: "IQ1_M",
-            32: "BF16",
-            33: "Q4_0_4_4",
-            34: "Q4_0_4_8",
-            35: "Q4_0_8_8",
-            36: "TQ1_0",
-            37: "TQ2_0",
-            38: "MXFP4_MOE",
-            145: "IQ4_KS",
-            147: "IQ2_KS",
-            148: "IQ4_KSS",
-            150: "IQ5_KS",
-            154: "IQ3_KS",
-            155: "IQ2_KL",
-            156: "IQ1_KT"
-        }
+        self.cache = cache
 
     def run(self):
         self._is_running = True
-        info = {}
         try:
-            model_info = GGUFReader(self.model_path)
-            info.update({"path": self.model_path})
-            for key, field in model_info.fields.items():
-                if key == "general.name":
-                    info.update({"name": str(self.maybe_decode(field.parts[field.data[0]]))})
-                elif key == "general.size_label":
-                    info.update({"parameters": str(self.maybe_decode(field.parts[field.data[0]]))})
-                elif key == "general.file_type":
-                    info.update({"weights": self.weights_map.get(self.maybe_decode(field.parts[field.data[0]]), f"Unknown ({field.data[0]})")})
-                elif key.endswith("block_count"):
-                    info.update({"layers": str(self.maybe_decode(field.parts[field.data[0]]))})
-            if "name" not in info:
-                info["name"] = "Unknown"
-            if "parameters" not in info:
-                info["parameters"] = "Unknown"
-            if "weights" not in info:
-                info["weights"] = "Unknown"
-            if "layers" not in info:
-                info["layers"] = "Unknown"
+            info = gguf_model_info(self.model_path, self.cache.read(self.model_path))
         except Exception as e:
+            logger.error("Failed to read GGUF metadata of %s: %s", self.model_path, e)
             info = {"path": self.model_path, "name": "Error", "parameters": "Error", "weights": "Error", "layers": "Error"}
         
         self.info_ready.emit(info)
@@ -210,25 +1451,100 @@ class GGUFInfoWoker(QThread):
         
     def stop(self):
         self._is_running = False
-    
-    def maybe_decode(self, value):
-        # bytes or bytearray -> try UTF-8
-        if isinstance(value, (bytes, bytearray)):
-            return value.decode("utf-8", errors="replace")
 
-        # numpy array of uint8 -> bytes -> UTF-8
-        if isinstance(value, np.ndarray) and value.dtype == np.uint8:
-            return value.tobytes().decode("utf-8", errors="replace")
+class GGUFTokenizerWorker(QThread):
+    tokenizer_ready = pyqtSignal(str, object)
 
-        # list/tuple of ints 0..255 -> bytes -> UTF-8
-        if isinstance(value, (list, tuple)) and value and all(isinstance(x, (int, np.integer)) and 0 <= int(x) <= 255 for x in value):
-            return bytes(value).decode("utf-8", errors="replace")
+    def __init__(self, model_path, parent=None):
+        super().__init__(parent)
+        self.model_path = model_path
+        self.finished.connect(self.deleteLater)
 
-        # list/tuple of bytes -> decode each
-        if isinstance(value, (list, tuple)) and value and all(isinstance(x, (bytes, bytearray)) for x in value):
-            return [x.decode("utf-8", errors="replace") for x in value]
+    def run(self):
+        try:
+            tokenizer = GGUFTokenizer.load(self.model_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No local tokenizer for %s: %s", self.model_path, e)
+            tokenizer = None
+        self.tokenizer_ready.emit(self.model_path, tokenizer)
+
+GGUF_SHARD = re.compile(r"-(\d{5})-of-(\d{5})\.gguf$", re.IGNORECASE)
+
+def find_gguf_models(folder):
+    # every *.gguf below folder; a split model is listed once, by its first shard (the one llama.cpp is given)
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(".gguf"):
+                continue
+            shard = GGUF_SHARD.search(name)
+            if shard and int(shard.group(1)) != 1:
+                continue
+            found.append(os.path.join(root, name))
+    return found
+
+class GGUFScanWorker(QThread):
+    progress = pyqtSignal(int, int)
+    scan_ready = pyqtSignal(list)
+
+    def __init__(self, paths, cache, max_workers=None, processes=True, parent=None):
+        super().__init__(parent)
+        self._is_running = True
+        self.paths = paths
+        self.cache = cache
+        self.max_workers = max_workers or min(os.cpu_count() or 1, 8)
+        self.processes = processes
+
+    def run(self):
+        # cached files are answered right away, the rest are parsed in a process pool (spawned, never forked from a Qt process)
+        self._is_running = True
+        infos, pending = {}, {}
+        for path in self.paths:
+            try:
+                stamp = self.cache.stamp(path)
+            except OSError as e:
+                logger.error("Failed to read %s: %s", path, e)
+                continue
+            metadata = self.cache.get(path, stamp)
+            if metadata is None:
+                pending[path] = stamp
+            else:
+                infos[path] = gguf_model_info(path, metadata)
+        done = len(self.paths) - len(pending)
+        self.progress.emit(done, len(self.paths))
+        if not self.processes:
+            for path in pending:
+                if not self._is_running:
+                    break
+                try:
+                    infos[path] = gguf_model_info(path, self.cache.read(path))
+                except Exception as e:
+                    logger.error("Failed to read GGUF metadata of %s: %s", path, e)
+                done += 1
+                self.progress.emit(done, len(self.paths))
+        elif pending and self._is_running:
+            pool = ProcessPoolExecutor(max_workers=min(self.max_workers, len(pending)), mp_context=multiprocessing.get_context("spawn"))
+            futures = {pool.submit(read_gguf_metadata, path, GGUFMetadataCache.MAX_ARRAY, True): path for path in pending}
+            try:
+                for future in as_completed(futures):
+                    if not self._is_running:
+                        break
+                    path = futures[future]
+                    try:
+                        infos[path] = gguf_model_info(path, self.cache.put(path, future.result(), pending[path]))
+                    except Exception as e:
+                        logger.error("Failed to read GGUF metadata of %s: %s", path, e)
+                    done += 1
+                    self.progress.emit(done, len(self.paths))
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        if self._is_running:
+            # a cancelled scan reports nothing, its partial results would land after the dialog is gone
+            self.scan_ready.emit([infos[path] for path in self.paths if path in infos])
 
-        return value[0]
+    def stop(self):
+        self._is_running = False
 
 class ToggleSwitch(QRadioButton):
 	def __init__(self, parent=None):
@@ -304,362 +1620,1395 @@ class ToggleSwitch(QRadioButton):
 		super().resizeEvent(event)
 		self._handle_position = self._get_target_handle_pos()
 
-class ChatBubble(QFrame):
-    def __init__(self, text, speaker, llm = None):
-        super().__init__()
-        self.text = text
-        self.speaker = speaker
-        self.speaker_print = ""
-        self.styleBase = ""
-        self.margins = (0, 0, 0, 0)
-        align = Qt.AlignmentFlag.AlignCenter
-
-        font_id = QFontDatabase.addApplicationFont("FiraCodeNerdFont-Regular.ttf")
-        self.font_family = QFontDatabase.applicationFontFamilies(font_id)[0]
-
-        if self.speaker == "user":
-            self.speaker = "User"
-            self.speaker_print = self.speaker
-            align = Qt.AlignmentFlag.AlignRight
-        elif self.speaker == "assistant":
-            self.speaker = "Assistant"
-            self.speaker_print = llm if llm else self.speaker
-            align = Qt.AlignmentFlag.AlignLeft
-        elif self.speaker == "system":
-            self.speaker = "System"
-            self.speaker_print = self.speaker
-
-        layout = QStackedLayout()
-        layout.setContentsMargins(0, 0, 0, 0)
-        mainPage = QWidget()
-        mainPage.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
-        mp_layout = QVBoxLayout()
-        label = QLabel(self.speaker_print)
-        mp_layout.addWidget(label)
-        self.textbox = ChatBubbleText(self.text, align=align)
-        mp_layout.addWidget(self.textbox, 10)
-
-        btnS = QHBoxLayout()
-        btnS.addStretch()
-        btnS.setSizeConstraint(QHBoxLayout.SizeConstraint.SetMinimumSize)
-
-        if self.speaker == "Assistant":
-            self.statsBtn = HoverLabel("📊", "")
-            self.statsBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-            btnS.addWidget(self.statsBtn)
-
-        copyBtn = QPushButton("🗎")
-        copyBtn.setToolTip("Copy text to clipboard")
-        copyBtn.clicked.connect(self.copy_to_clipboard)
-        copyBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-        btnS.addWidget(copyBtn)
-
-        if self.speaker == "User":
-            self.editBtn = QPushButton("🖍️")
-            self.editBtn.setToolTip("Edit this prompt")
-            self.editBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-            self.editBtn.clicked.connect(self.edit)
-            btnS.addWidget(self.editBtn)
-        
-        self.branchBtn = QPushButton("\ue0a0")
-        self.branchBtn.setFont(QFont(self.font_family))
-        self.branchBtn.setToolTip("Branch from this bubble to a new chat")
-        self.branchBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-        btnS.addWidget(self.branchBtn)
-
-        self.deleteBtn = QPushButton("🗑")
-        self.deleteBtn.setToolTip("Delete this bubble")
-        self.deleteBtn.clicked.connect(self.deleteLater)
-        self.deleteBtn.setVisible(False)
-        self.deleteBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-        btnS.addWidget(self.deleteBtn)
-
-        self.deleteDownBtn = QPushButton("🗑⬇")
-        self.deleteDownBtn.setToolTip("Delete all below bubbles")
-        self.deleteDownBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-        btnS.addWidget(self.deleteDownBtn)
-
-        self.generateBtn = QPushButton("Regenerate response")
-        self.generateBtn.setToolTip("Generate an assistant response")
-        self.generateBtn.setVisible(False)
-        self.generateBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-        btnS.addWidget(self.generateBtn)
-
-        mp_layout.addLayout(btnS, 1)
-        mainPage.setLayout(mp_layout)
-        layout.addWidget(mainPage)
-
-        if self.speaker == "User":
-            editPage = QWidget()
-            ed_layout = QVBoxLayout()
-            self.editbox = QTextEdit()
-            self.editbox.setPlainText(self.text)
-            self.editbox.setLineWrapMode(QTextEdit.LineWrapMode.WidgetWidth)
-            self.editbox.setSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Preferred)
-            self.editbox.setMaximumHeight(self.textbox.height()*4)
-            self.editbox.setStyleSheet("QTextEdit { color: black; }")
-            ed_layout.addWidget(self.editbox)
-            ed_BtnS = QHBoxLayout()
-            ed_BtnS.addStretch()
-
-            self.saveBtn = QPushButton("💾 && 🗑⬇")
-            self.saveBtn.setToolTip("Save changes and delete all bubbles below")
-            self.saveBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-            ed_BtnS.addWidget(self.saveBtn)
-
-            self.editBranchBtn = QPushButton("\ue0a0")
-            self.editBranchBtn.setFont(QFont(self.font_family))
-            self.editBranchBtn.setToolTip("Branch to a new chat with edits")
-            self.editBranchBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-            ed_BtnS.addWidget(self.editBranchBtn)
-
-            cancelBtn = QPushButton("❌")
-            cancelBtn.setToolTip("Cancel editing")
-            cancelBtn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
-            cancelBtn.clicked.connect(self.cancel_edit)
-            ed_BtnS.addWidget(cancelBtn)
-
-            ed_layout.addLayout(ed_BtnS)
-            editPage.setLayout(ed_layout)
-            layout.addWidget(editPage)
-
-        self.setLayout(layout)
-        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Maximum)
-        self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
-        self.setAutoFillBackground(True)
-        self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose, True)
-
-        if self.speaker == "User":
-            self.styleBase = """
-QFrame {
-    background-color: #d1e7dd;
-    border: 1px solid #badbcc;
-    border-radius: 8px;
-    padding: 8px;
-    margin: 8px 16px 8px 144px;
-}
-QLabel {
-    color: #0f5132;
-    font-weight: bold;
-}
-QTextBrowser {
-    color: #0f5132;
-    font-weight: bold;
-}
-QPushButton {
-    background-color: #badbcc;
-    border: none;
-    border-radius: 4px;
-    padding: 4px 8px;
-    color: #0f5132;
-    font-weight: bold;
-}
-QPushButton:hover {
-    background-color: #0f5132;
-    color: #ffffff;
+BUBBLE_STYLES = {
+    "User": {"background": "#d1e7dd", "border": "#badbcc", "text": "#0f5132", "button": "#badbcc", "margins": (8, 16, 8, 144)},
+    "Assistant": {"background": "#cff4fc", "border": "#b6effb", "text": "#055160", "button": "#b6effb", "margins": (8, 144, 8, 16)},
+    "System": {"background": "#e2e3e5", "border": "#d3d6d8", "text": "#41464b", "button": "#d3d6d8", "margins": (8, 80, 8, 80)}
 }
+
+BUBBLE_DOCUMENT_STYLESHEET = """
+    p, pre, ul, ol, h1, h2, h3, h4, h5, h6 { margin-top:0px; margin-bottom:0px; }
+    ul, ol { padding-left: 18px; }
+    code, pre { font-family: monospace; }
 """
-            self.margins = (8, 16, 8, 144)
-        elif self.speaker == "Assistant":
-            self.styleBase = """
-QFrame {
-    background-color: #cff4fc;
-    border: 1px solid #b6effb;
+
+def speaker_for_role(role):
+    if role == "user":
+        return "User"
+    if role == "assistant":
+        return "Assistant"
+    return "System"
+
+def stats_to_html(stats):
+    return f'''
+        <b>Time</b>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Input (ms):</b> {stats.get('input_ms', "Unavailable")}</div>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Generation (ms):</b> {stats.get('gen_ms', "Unavailable")}</div>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Total (ms):</b> {stats.get('total_ms', "Unavailable")}</div>
+        <b>Tokens</b>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Input:</b> {stats.get('input_t', "Unavailable")}</div>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Generated:</b> {stats.get('gen_t', "Unavailable")}</div>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Total:</b> {stats.get('total_t', "Unavailable")}</div>
+        <b>Tokens per second:</b> {stats.get('t_s', "Unavailable")}
+    ''' + (f'''
+        <br><b>Prompt cache</b>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Reused tokens:</b> {stats.get('cached_t', "Unavailable")}</div>
+        <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Restore (ms):</b> {stats.get('restore_ms', "Not restored")}</div>
+    ''' if 'cached_t' in stats or 'restore_ms' in stats else "") + (f'''
+        <br><b>Context:</b> {stats['context_t']} tokens{f", {stats['dropped_m']} older messages left out" if stats.get('dropped_m') else ""}
+    ''' if 'context_t' in stats else "")
+
+class MarkdownRenderCache:
+    # content-addressed LRU of markdown -> html, persisted next to the chat files
+    extensions = ["extra", "fenced_code", "sane_lists", "nl2br"]
+
+    def __init__(self, path="chats/render_cache.json", max_entries=4096):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.dirty = False
+        self._prefix = ",".join(self.extensions) + "\0"
+        self.load()
+
+    def key(self, content):
+        return hashlib.sha1((self._prefix + content).encode("utf-8")).hexdigest()
+
+    def render(self, content):
+        key = self.key(content)
+        html = self.entries.get(key)
+        if html is not None:
+            self.entries.move_to_end(key)
+            return html
+        html = md_to_html(content, extensions=self.extensions)
+        self.put(key, html)
+        return html
+
+    def put(self, key, html):
+        self.entries[key] = html
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def discard(self, content):
+        if self.entries.pop(self.key(content), None) is not None:
+            self.dirty = True
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("extensions") != self.extensions:
+                return
+            for key, html in data.get("entries", [])[-self.max_entries:]:
+                self.entries[key] = html
+        except (FileNotFoundError, json.JSONDecodeError, TypeError, ValueError):
+            self.entries.clear()
+
+    def save(self):
+        if not self.dirty:
+            return
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        try:
+            write_json_atomic(self.path, {"extensions": self.extensions, "entries": list(self.entries.items())})
+            self.dirty = False
+        except Exception as e:
+            logger.error("Error saving render cache: %s", e)
+
+def chat_tooltip(info):
+    modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(info['modified']))
+    return (f"Messages: {info['message_count']}\nModified: {modified}\nLast model: {info['last_llm'] or 'None'}\n"
+            f"Tokens: {info['input_tokens']} input, {info['gen_tokens']} generated")
+
+MARKDOWN_LIST_ITEM = re.compile(r"^\s*([-*+]|\d+[.)])\s")
+
+def split_markdown_blocks(text):
+    # splits off the blocks that can no longer change as more text arrives; the rest is the open tail
+    blocks = []
+    start = pos = 0
+    fence = None
+    prev_blank = False
+    block_is_list = None
+    for line in text.splitlines(keepends=True):
+        if not line.endswith("\n"):
+            break
+        stripped = line.strip()
+        if fence:
+            if stripped.startswith(fence):
+                fence = None
+        elif not stripped:
+            prev_blank = True
+        else:
+            is_list = bool(MARKDOWN_LIST_ITEM.match(line))
+            if prev_blank and pos > start and not line[0].isspace() and not (is_list and block_is_list):
+                blocks.append(text[start:pos])
+                start = pos
+                block_is_list = None
+            if block_is_list is None:
+                block_is_list = is_list
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                fence = stripped[:3]
+            prev_blank = False
+        pos += len(line)
+    return blocks, text[start:]
+
+class StreamingMarkdown:
+    # buffers streamed tokens; completed blocks are converted once, only the open tail is re-rendered per flush
+    def __init__(self, render_cache):
+        self.render_cache = render_cache
+        self.text = ""
+        self._pending = []
+        self._done = 0
+        self._blocks = []
+        self._block_html = {}
+        self._tail_html = ""
+
+    def feed(self, token):
+        self._pending.append(token)
+
+    def flush(self):
+        if not self._pending:
+            return False
+        self.text += "".join(self._pending)
+        self._pending.clear()
+        # _done counts characters of the text after its leading newlines
+        blocks, tail = split_markdown_blocks(self.text.lstrip("\n")[self._done:])
+        for block in blocks:
+            self._blocks.append(self._render_block(block))
+            self._done += len(block)
+        self._tail_html = md_to_html(tail, extensions=self.render_cache.extensions) if tail.strip() else ""
+        return True
+
+    def _render_block(self, block):
+        html = self._block_html.get(block)
+        if html is None:
+            html = md_to_html(block, extensions=self.render_cache.extensions)
+            self._block_html[block] = html
+        return html
+
+    def html(self):
+        return "\n".join(self._blocks + [self._tail_html])
+
+    def finish(self, content):
+        # the final message is converted whole: reference links, footnotes and abbreviations resolve across blocks
+        return self.render_cache.render(content.lstrip("\n"))
+
+class BubbleResources:
+    # process-wide: the font file is registered once, styles are compiled once per speaker and
+    # documents are cloned from one template per speaker instead of being configured per bubble
+    font_path = "FiraCodeNerdFont-Regular.ttf"
+    max_documents = 256
+
+    _font_family = None
+    _styles = {}
+    _fonts = {}
+    _metrics = {}
+    _templates = {}
+    _documents = OrderedDict()
+
+    @classmethod
+    def load(cls):
+        if cls._font_family is not None:
+            return
+        font_id = QFontDatabase.addApplicationFont(cls.font_path)
+        families = QFontDatabase.applicationFontFamilies(font_id) if font_id >= 0 else []
+        cls._font_family = families[0] if families else QApplication.font().family()
+        for speaker, base in BUBBLE_STYLES.items():
+            align = Qt.AlignmentFlag.AlignCenter
+            if speaker == "User":
+                align = Qt.AlignmentFlag.AlignRight
+            elif speaker == "Assistant":
+                align = Qt.AlignmentFlag.AlignLeft
+            cls._styles[speaker] = {
+                'align': align,
+                'margins': base['margins'],
+                'border': QPen(QColor(base['border'])),
+                'background': QBrush(QColor(base['background'])),
+                'text': QColor(base['text']),
+                'button': QBrush(QColor(base['button'])),
+                'button_hover': QBrush(QColor(base['text'])),
+                'button_hover_text': QColor("#ffffff"),
+                'editor_stylesheet': f"""
+QFrame {{
+    background-color: {base['background']};
+    border: 1px solid {base['border']};
     border-radius: 8px;
-    padding: 8px;
-    margin: 8px 144px 8px 16px;
-}
-QLabel {
-    color: #055160;
-    font-weight: bold;
-}
-QTextBrowser {
-    color: #055160;
-    font-weight: bold;
-}
-QPushButton {
-    background-color: #b6effb;
+}}
+QTextEdit {{
+    color: black;
+    background-color: #ffffff;
+}}
+QPushButton {{
+    background-color: {base['button']};
     border: none;
     border-radius: 4px;
     padding: 4px 8px;
-    color: #055160;
+    color: {base['text']};
     font-weight: bold;
-}
-QPushButton:hover {
-    background-color: #055160;
+}}
+QPushButton:hover {{
+    background-color: {base['text']};
     color: #ffffff;
-}
+}}
 """
-            self.margins = (8, 144, 8, 16)
-        elif self.speaker == "System":
-            self.styleBase ="""
-QFrame {
-    background-color: #e2e3e5;
-    border: 1px solid #d3d6d8;
-    border-radius: 8px;
-    padding: 8px;
-    margin: 8px 80px 8px 80px;
-}
-QLabel {
-    color: #41464b;
-    font-weight: bold;
-}
-QTextBrowser {
-    color: #41464b;
-    font-weight: bold;
-}
-QPushButton {
-    background-color: #d3d6d8;
-    border: none;
-    border-radius: 4px;
-    padding: 4px 8px;
-    color: #41464b;
-    font-weight: bold;
-}
-QPushButton:hover {
-    background-color: #41464b;
-    color: #ffffff;
-}
-"""
-            self.margins = (8, 80, 8, 80)
-        self.setStyleSheet(self.styleBase)
-
-    def showEvent(self, e):
-        self._applyResponsiveMargins()
-        super().showEvent(e)
-
-    def resizeEvent(self, e):
-        self._applyResponsiveMargins()
-        super().resizeEvent(e)
-
-    def _basisWidth(self):
-        w = self.parentWidget()
-        while w and not isinstance(w, QScrollArea):
-            w = w.parentWidget()
-        if isinstance(w, QScrollArea):
-            return max(1, w.viewport().width())
-        win = self.window()
-        return 800
-    
-    def _applyResponsiveMargins(self):
-        if self.styleBase is None:
+            }
+
+    @classmethod
+    def font_family(cls):
+        cls.load()
+        return cls._font_family
+
+    @classmethod
+    def style(cls, speaker):
+        cls.load()
+        return cls._styles[speaker]
+
+    @classmethod
+    def bold_font(cls, base_font):
+        key = base_font.key()
+        font = cls._fonts.get(key)
+        if font is None:
+            font = QFont(base_font)
+            font.setBold(True)
+            cls._fonts[key] = font
+        return font
+
+    @classmethod
+    def icon_font(cls):
+        return cls.bold_font(QFont(cls.font_family()))
+
+    @classmethod
+    def metrics(cls, font):
+        key = font.key()
+        fm = cls._metrics.get(key)
+        if fm is None:
+            fm = QFontMetrics(font)
+            cls._metrics[key] = fm
+        return fm
+
+    @classmethod
+    def _template(cls, speaker, font):
+        key = (speaker, font.key())
+        template = cls._templates.get(key)
+        if template is None:
+            template = QTextDocument()
+            template.setDefaultFont(font)
+            template.setDefaultStyleSheet(BUBBLE_DOCUMENT_STYLESHEET)
+            text_option = QTextOption(cls.style(speaker)['align'])
+            text_option.setWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+            template.setDefaultTextOption(text_option)
+            cls._templates[key] = template
+        return template
+
+    @classmethod
+    def document(cls, speaker, font, text, is_html, width):
+        # laid-out documents are kept in a small LRU so repaints (hover, scrolling) don't rebuild them
+        key = (speaker, font.key(), text, is_html, width)
+        doc = cls._documents.get(key)
+        if doc is not None:
+            cls._documents.move_to_end(key)
+            return doc
+        doc = cls._template(speaker, font).clone()
+        doc.setDocumentMargin(0)
+        if is_html:
+            doc.setHtml(text)
+        else:
+            doc.setPlainText(text)
+        doc.setTextWidth(max(1, width))
+        cls._documents[key] = doc
+        if len(cls._documents) > cls.max_documents:
+            cls._documents.popitem(last=False)
+        return doc
+
+class ChatHistoryModel(QAbstractListModel):
+    MessageRole = Qt.ItemDataRole.UserRole
+    RenderRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, render_cache, parent=None):
+        super().__init__(parent)
+        self.render_cache = render_cache
+        self._rows = []
+        self._signatures = []
+        self._stream_row = None
+        self._stream_html = ""
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        message = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message['content']
+        if role == self.MessageRole:
+            return message
+        if role == self.RenderRole:
+            return self.render(index.row())
+        return None
+
+    def render(self, row):
+        # (text, is_html) as the bubble should show it; markdown is converted lazily, only for rows that get painted
+        message = self._rows[row]
+        content = message['content'].lstrip("\n")
+        if message['role'] != 'assistant':
+            return (content, "<" in content and "</" in content)
+        if row == self._stream_row:
+            # rendered incrementally by StreamingMarkdown, partial replies never go into the cache
+            return (self._stream_html, True)
+        return (self.render_cache.render(content), True)
+
+    def message(self, row):
+        return self._rows[row]
+
+    def plain_text(self, row):
+        text, is_html = self.render(row)
+        if is_html:
+            return QTextDocumentFragment.fromHtml(text).toPlainText()
+        return text
+
+    def _signature(self, message):
+        # snapshot of what a bubble shows; history dicts are edited in place, so the dicts themselves can't be compared later
+        return (message['role'], message['content'], message.get('llm'), dict(message.get('stats') or {}))
+
+    def set_history(self, history):
+        self.beginResetModel()
+        self._rows = list(history)
+        self._signatures = [self._signature(m) for m in history]
+        self._stream_row = None
+        self.endResetModel()
+
+    def reconcile(self, history):
+        new_signatures = [self._signature(m) for m in history]
+        old_signatures = self._signatures
+        n_old, n_new = len(old_signatures), len(new_signatures)
+
+        start = 0
+        while start < n_old and start < n_new and old_signatures[start] == new_signatures[start]:
+            start += 1
+        end_old, end_new = n_old, n_new
+        while end_old > start and end_new > start and old_signatures[end_old - 1] == new_signatures[end_new - 1]:
+            end_old -= 1
+            end_new -= 1
+
+        if start == 0 and end_old == n_old and end_new == n_new and n_old and n_new:
+            # nothing in common (another chat), a reset is cheaper than row-by-row signals
+            self.set_history(history)
             return
-        base = self._basisWidth()
-        t0, r0, b0, l0 = self.margins
-        k = base / float(800)
-        clamp = lambda v: int(round(max(8, min(160, v))))
-        mt, mr, mb, ml = map(clamp, (t0 * k, r0 * k, b0 * k, l0 * k))
-        
-        override = f"QFrame {{ margin: {mt}px {mr}px {mb}px {ml}px; }}"
-        self.setStyleSheet(f"{self.styleBase}\n{override}")
 
-    def copy_to_clipboard(self):
-        QApplication.clipboard().setText(self.textbox.toPlainText())
-    
-    def edit(self):
-        self.editbox.setPlainText(self.text)
-        self.layout().setCurrentIndex(1)
-
-    def cancel_edit(self):
-        self.editbox.setPlainText(self.text)
-        self.layout().setCurrentIndex(0)
-
-class ChatBubbleText(QTextBrowser):
-    def __init__(self, text="", align=Qt.AlignmentFlag.AlignCenter):
-        super().__init__()
-        self._align = align
-        self.document().setDefaultTextOption(QTextOption(self._align))
-        self.setReadOnly(True)
-        self.setOpenExternalLinks(True)
-        self.setUndoRedoEnabled(False)
-        self.setWordWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
-        self.setLineWrapMode(QTextEdit.LineWrapMode.WidgetWidth)
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setFrameStyle(QFrame.Shape.NoFrame)
-        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
-        self.setStyleSheet("margin:0;padding:0;border:0;")
-        self.document().setDocumentMargin(0)
-        self.document().setDefaultStyleSheet("""
-            p, pre, ul, ol, h1, h2, h3, h4, h5, h6 { margin-top:0px; margin-bottom:0px; }
-            ul, ol { padding-left: 18px; }
-            code, pre { font-family: monospace; }
-        """)
-
-        if "<" in text and "</" in text:
-            self.setHtml(text)
+        # unchanged rows may still be new dict objects (branches deep-copy the history)
+        self._rows[:start] = history[:start]
+        self._rows[end_old:] = history[end_new:]
+
+        replaced = min(end_old, end_new) - start
+        if self._stream_row is not None and self._stream_row >= start:
+            self._stream_row = None
+        if replaced > 0:
+            self._rows[start:start + replaced] = history[start:start + replaced]
+            self._signatures[start:start + replaced] = new_signatures[start:start + replaced]
+            self.dataChanged.emit(self.index(start), self.index(start + replaced - 1))
+        first = start + replaced
+        if end_new > end_old:
+            self.beginInsertRows(QModelIndex(), first, first + (end_new - end_old) - 1)
+            self._rows[first:first] = history[first:end_new]
+            self._signatures[first:first] = new_signatures[first:end_new]
+            self.endInsertRows()
+        elif end_old > end_new:
+            self.beginRemoveRows(QModelIndex(), first, first + (end_old - end_new) - 1)
+            del self._rows[first:end_old]
+            del self._signatures[first:end_old]
+            self.endRemoveRows()
+        if end_new != end_old and end_new == n_new and first > 0:
+            # the previous bubble gains or loses its "last bubble" buttons
+            self.dataChanged.emit(self.index(first - 1), self.index(first - 1))
+
+    def append_message(self, message):
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.append(message)
+        self._signatures.append(self._signature(message))
+        self.endInsertRows()
+        if row > 0:
+            # the previous bubble loses its "last bubble" buttons
+            self.dataChanged.emit(self.index(row - 1), self.index(row - 1))
+        return row
+
+    def append_stream(self, message):
+        self._stream_html = ""
+        self._stream_row = self.append_message(message)
+        return self._stream_row
+
+    def update_stream(self, content, html):
+        if self._stream_row is None:
+            return
+        row = self._stream_row
+        self._rows[row]['content'] = content
+        self._stream_html = html
+        self._signatures[row] = self._signature(self._rows[row])
+        self.dataChanged.emit(self.index(row), self.index(row))
+
+    def remove_from(self, row):
+        if row >= len(self._rows):
+            return
+        self.beginRemoveRows(QModelIndex(), row, len(self._rows) - 1)
+        del self._rows[row:]
+        del self._signatures[row:]
+        if self._stream_row is not None and self._stream_row >= row:
+            self._stream_row = None
+        self.endRemoveRows()
+        if row > 0:
+            self.dataChanged.emit(self.index(row - 1), self.index(row - 1))
+
+class ChatBubbleEditor(QFrame):
+    save_requested = pyqtSignal(str)
+    branch_requested = pyqtSignal(str)
+    cancel_requested = pyqtSignal()
+
+    def __init__(self, text, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
+        self.setAutoFillBackground(True)
+        self.setStyleSheet(BubbleResources.style("User")['editor_stylesheet'])
+        ed_layout = QVBoxLayout()
+        ed_layout.setContentsMargins(8, 8, 8, 8)
+        self.editbox = QTextEdit()
+        self.editbox.setPlainText(text)
+        self.editbox.setLineWrapMode(QTextEdit.LineWrapMode.WidgetWidth)
+        ed_layout.addWidget(self.editbox)
+
+        ed_BtnS = QHBoxLayout()
+        ed_BtnS.addStretch()
+
+        saveBtn = QPushButton("💾 && 🗑⬇")
+        saveBtn.setToolTip("Save changes and delete all bubbles below")
+        saveBtn.clicked.connect(lambda _c: self.save_requested.emit(self.editbox.toPlainText().strip()))
+        ed_BtnS.addWidget(saveBtn)
+
+        editBranchBtn = QPushButton("\ue0a0")
+        editBranchBtn.setFont(QFont(BubbleResources.font_family()))
+        editBranchBtn.setToolTip("Branch to a new chat with edits")
+        editBranchBtn.clicked.connect(lambda _c: self.branch_requested.emit(self.editbox.toPlainText().strip()))
+        ed_BtnS.addWidget(editBranchBtn)
+
+        cancelBtn = QPushButton("❌")
+        cancelBtn.setToolTip("Cancel editing")
+        cancelBtn.clicked.connect(lambda _c: self.cancel_requested.emit())
+        ed_BtnS.addWidget(cancelBtn)
+
+        ed_layout.addLayout(ed_BtnS)
+        self.setLayout(ed_layout)
+
+class ChatBubbleDelegate(QStyledItemDelegate):
+    action_triggered = pyqtSignal(str, int)
+    edit_triggered = pyqtSignal(str, int, str)
+
+    PADDING = 8
+    SPACING = 6
+    BUTTON_HEIGHT = 24
+    EDITOR_HEIGHT = 180
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self._heights = {}
+        self._margin_cache = {}
+        self._editing = set()
+        self._hover = None
+
+    def begin_edit(self, row):
+        self._editing.add(row)
+        self.sizeHintChanged.emit(self.view.model().index(row))
+
+    def end_edit(self, row):
+        self._editing.discard(row)
+        self.sizeHintChanged.emit(self.view.model().index(row))
+
+    def clear_edits(self):
+        self._editing.clear()
+
+    def _margins(self, speaker):
+        base = max(1, self.view.viewport().width())
+        margins = self._margin_cache.get((speaker, base))
+        if margins is None:
+            t0, r0, b0, l0 = BubbleResources.style(speaker)['margins']
+            k = base / float(800)
+            clamp = lambda v: int(round(max(8, min(160, v))))
+            margins = tuple(map(clamp, (t0 * k, r0 * k, b0 * k, l0 * k)))
+            self._margin_cache[(speaker, base)] = margins
+        return margins
+
+    def _frame_rect(self, rect, speaker):
+        mt, mr, mb, ml = self._margins(speaker)
+        return rect.adjusted(ml, mt, -mr, -mb)
+
+    def _document(self, index, option, width):
+        message = index.data(ChatHistoryModel.MessageRole)
+        text, is_html = index.data(ChatHistoryModel.RenderRole)
+        return BubbleResources.document(speaker_for_role(message['role']), BubbleResources.bold_font(option.font), text, is_html, width)
+
+    def _height_key(self, message):
+        return (message['role'], message['content'], message.get('llm'), self.view.viewport().width())
+
+    def _estimate_text_height(self, message, option, width):
+        # cheap line-count estimate for rows that were never painted; refined on first paint
+        fm = BubbleResources.metrics(BubbleResources.bold_font(option.font))
+        per_line = max(1, width // max(1, fm.averageCharWidth()))
+        lines = 0
+        for line in message['content'].lstrip("\n").split("\n"):
+            lines += max(1, math.ceil(len(line) / per_line))
+        return lines * fm.lineSpacing()
+
+    def _bubble_height(self, speaker, option, text_height):
+        fm = BubbleResources.metrics(BubbleResources.bold_font(option.font))
+        mt, mr, mb, ml = self._margins(speaker)
+        return mt + mb + 2 * self.PADDING + fm.height() + self.SPACING + text_height + self.SPACING + self.BUTTON_HEIGHT
+
+    def sizeHint(self, option, index):
+        # called for every row on each relayout of the view, so the common path is a single dict lookup
+        message = index.model().message(index.row())
+        key = self._height_key(message)
+        cached = self._heights.get(key)
+        if cached is None:
+            speaker = speaker_for_role(message['role'])
+            frame = self._frame_rect(QRect(0, 0, self.view.viewport().width(), 0), speaker)
+            width = frame.width() - 2 * self.PADDING
+            cached = self._store_height(key, self._bubble_height(speaker, option, self._estimate_text_height(message, option, width)), False)
+        if index.row() in self._editing:
+            mt, mr, mb, ml = self._margins(speaker_for_role(message['role']))
+            return QSize(key[3], max(cached[0], mt + mb + self.EDITOR_HEIGHT))
+        return cached[2]
+
+    def _store_height(self, key, height, exact):
+        if len(self._heights) > 65536:
+            self._heights.clear()
+        value = (height, exact, QSize(key[3], height))
+        self._heights[key] = value
+        return value
+
+    def _buttons(self, index, frame):
+        message = index.data(ChatHistoryModel.MessageRole)
+        speaker = speaker_for_role(message['role'])
+        last = index.row() == index.model().rowCount() - 1
+        buttons = []
+        if speaker == "Assistant":
+            buttons.append(("stats", "📊", ""))
+        buttons.append(("copy", "🗎", "Copy text to clipboard"))
+        if speaker == "User":
+            buttons.append(("edit", "🖍️", "Edit this prompt"))
+        buttons.append(("branch", "\ue0a0", "Branch from this bubble to a new chat"))
+        if last:
+            buttons.append(("delete", "🗑", "Delete this bubble"))
         else:
-            self.setPlainText(text)
+            buttons.append(("delete_down", "🗑⬇", "Delete all below bubbles"))
+        if last and speaker == "User":
+            buttons.append(("regenerate", "Regenerate response", "Generate an assistant response"))
+
+        rects = []
+        fm = BubbleResources.metrics(BubbleResources.bold_font(self.view.font()))
+        branch_fm = BubbleResources.metrics(BubbleResources.icon_font())
+        x = frame.right() - self.PADDING
+        y = frame.bottom() - self.PADDING - self.BUTTON_HEIGHT
+        for name, text, tip in reversed(buttons):
+            metrics = branch_fm if name == "branch" else fm
+            w = metrics.horizontalAdvance(text) + 16
+            x -= w
+            rects.append((name, text, tip, QRect(x, y, w, self.BUTTON_HEIGHT)))
+            x -= self.SPACING
+        rects.reverse()
+        return rects
+
+    def _text_rect(self, option, frame):
+        fm = BubbleResources.metrics(BubbleResources.bold_font(option.font))
+        top = frame.top() + self.PADDING + fm.height() + self.SPACING
+        bottom = frame.bottom() - self.PADDING - self.BUTTON_HEIGHT - self.SPACING
+        return QRect(frame.left() + self.PADDING, top, frame.width() - 2 * self.PADDING, max(0, bottom - top))
+
+    def paint(self, painter, option, index):
+        message = index.data(ChatHistoryModel.MessageRole)
+        speaker = speaker_for_role(message['role'])
+        style = BubbleResources.style(speaker)
+        frame = self._frame_rect(option.rect, speaker)
+        width = frame.width() - 2 * self.PADDING
+        doc = self._document(index, option, width)
+
+        text_height = math.ceil(doc.documentLayout().documentSize().height())
+        height = self._bubble_height(speaker, option, text_height)
+        key = self._height_key(message)
+        if self._heights.get(key, (None, False))[:2] != (height, True):
+            self._store_height(key, height, True)
+            self.sizeHintChanged.emit(index)
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(style['border'])
+        painter.setBrush(style['background'])
+        painter.drawRoundedRect(QRectF(frame).adjusted(0.5, 0.5, -0.5, -0.5), 8, 8)
+
+        label_font = BubbleResources.bold_font(option.font)
+        painter.setFont(label_font)
+        painter.setPen(style['text'])
+        speaker_print = (message.get('llm') or speaker) if speaker == "Assistant" else speaker
+        label_rect = QRect(frame.left() + self.PADDING, frame.top() + self.PADDING, width, BubbleResources.metrics(label_font).height())
+        painter.drawText(label_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, speaker_print)
+
+        text_rect = self._text_rect(option, frame)
+        painter.save()
+        painter.translate(text_rect.topLeft())
+        painter.setClipRect(QRect(0, 0, text_rect.width(), text_rect.height()))
+        ctx = QAbstractTextDocumentLayout.PaintContext()
+        ctx.palette.setColor(QPalette.ColorRole.Text, style['text'])
+        doc.documentLayout().draw(painter, ctx)
+        painter.restore()
+
+        if index.row() not in self._editing:
+            for name, text, tip, rect in self._buttons(index, frame):
+                hovered = self._hover == (index.row(), name)
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(style['button_hover'] if hovered else style['button'])
+                painter.drawRoundedRect(QRectF(rect), 4, 4)
+                painter.setPen(style['button_hover_text'] if hovered else style['text'])
+                painter.setFont(BubbleResources.icon_font() if name == "branch" else label_font)
+                painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, text)
+        painter.restore()
+
+    def _button_at(self, index, option, pos):
+        message = index.data(ChatHistoryModel.MessageRole)
+        frame = self._frame_rect(option.rect, speaker_for_role(message['role']))
+        for name, text, tip, rect in self._buttons(index, frame):
+            if rect.contains(pos):
+                return name, tip
+        return None, None
+
+    def _anchor_at(self, index, option, pos):
+        message = index.data(ChatHistoryModel.MessageRole)
+        frame = self._frame_rect(option.rect, speaker_for_role(message['role']))
+        text_rect = self._text_rect(option, frame)
+        if not text_rect.contains(pos):
+            return ""
+        doc = self._document(index, option, text_rect.width())
+        return doc.documentLayout().anchorAt(QPointF(pos - text_rect.topLeft()))
+
+    def editorEvent(self, event, model, option, index):
+        if index.row() in self._editing:
+            return False
+        if event.type() == QEvent.Type.MouseMove:
+            name, _tip = self._button_at(index, option, event.position().toPoint())
+            hover = (index.row(), name) if name else None
+            if hover != self._hover:
+                self._hover = hover
+                self.view.viewport().update()
+            return False
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            pos = event.position().toPoint()
+            name, _tip = self._button_at(index, option, pos)
+            if name and name != "stats":
+                self.action_triggered.emit(name, index.row())
+                return True
+            anchor = self._anchor_at(index, option, pos)
+            if anchor:
+                QDesktopServices.openUrl(QUrl(anchor))
+                return True
+        return False
+
+    def helpEvent(self, event, view, option, index):
+        if event.type() == QEvent.Type.ToolTip and index.isValid():
+            name, tip = self._button_at(index, option, event.pos())
+            if name == "stats":
+                tip = stats_to_html(index.data(ChatHistoryModel.MessageRole).get('stats', {}))
+            if tip:
+                QToolTip.showText(event.globalPos(), tip, view)
+                return True
+            QToolTip.hideText()
+            return True
+        return super().helpEvent(event, view, option, index)
+
+    def createEditor(self, parent, option, index):
+        message = index.data(ChatHistoryModel.MessageRole)
+        if message['role'] != 'user':
+            return None
+        editor = ChatBubbleEditor(message['content'], parent)
+        row = index.row()
+        editor.save_requested.connect(lambda text: self.edit_triggered.emit("save", row, text))
+        editor.branch_requested.connect(lambda text: self.edit_triggered.emit("branch", row, text))
+        editor.cancel_requested.connect(lambda: self.edit_triggered.emit("cancel", row, ""))
+        return editor
+
+    def setEditorData(self, editor, index):
+        pass
 
-        self.document().contentsChanged.connect(self._apply_height)
-        self.document().documentLayout().documentSizeChanged.connect(lambda _=None: self._apply_height())
+    def setModelData(self, editor, model, index):
+        pass
 
-        self._apply_height()
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(self._frame_rect(option.rect, "User"))
 
-    def resizeEvent(self, e):
-        super().resizeEvent(e)
-        self._apply_height()
+CHAT_STATS_FIELDS = ("input_ms", "gen_ms", "total_ms", "input_t", "gen_t", "total_t", "t_s")
 
-    def setPlainText(self, text: str) -> None:
-        super().setPlainText(text)
-        self._apply_height()
+class PersistenceService(QObject):
+    # single writer thread for everything that goes to disk; jobs are keyed, and submitting a key that is still
+    # pending replaces its job and pushes it back by the debounce window, but never past max_delay from the first submit
+    error_emit = pyqtSignal(str)
 
-    def setHtml(self, html: str) -> None:
-        super().setHtml(html)
-        self._apply_height()
+    def __init__(self, debounce=0.25, max_delay=1.0, parent=None):
+        super().__init__(parent)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._jobs = {}
+        self._running = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, fn, delay=None):
+        delay = self.debounce if delay is None else delay
+        now = time.monotonic()
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                job = self._jobs.get(key)
+                if job is None:
+                    self._jobs[key] = [now + delay, now + max(delay, self.max_delay), fn]
+                else:
+                    job[0] = min(now + delay, job[1])
+                    job[2] = fn
+                self._cond.notify_all()
+        if closed:
+            # the writer thread is gone; a save that comes in after close is written through
+            self._execute(key, fn)
+
+    def flush(self, key=None, wait=True):
+        # barrier: runs the pending job for key (or every pending job) now and waits until it is written
+        with self._cond:
+            for pending in (self._jobs if key is None else [key]):
+                if pending in self._jobs:
+                    self._jobs[pending][0] = 0
+            self._cond.notify_all()
+            if not wait:
+                return
+            if key is None:
+                while self._jobs or self._running is not None:
+                    self._cond.wait()
+            else:
+                while key in self._jobs or self._running == key:
+                    self._cond.wait()
+
+    def cancel(self, key):
+        # drops the pending job for key; one already being written is waited for, so nothing lands after this returns
+        with self._cond:
+            self._jobs.pop(key, None)
+            while self._running == key:
+                self._cond.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._jobs:
+                        key, job = min(self._jobs.items(), key=lambda item: item[1][0])
+                        remaining = job[0] - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                del self._jobs[key]
+                self._running = key
+            try:
+                self._execute(key, job[2])
+            finally:
+                with self._cond:
+                    self._running = None
+                    self._cond.notify_all()
 
-    def _apply_height(self):
-        w = max(1, self.viewport().width())
-        if self.document().textWidth() != w:
-            self.document().setTextWidth(w)
+    def _execute(self, key, fn):
+        try:
+            fn()
+        except Exception as e:
+            logger.error("Background save of %s failed: %s", key, e)
+            self.error_emit.emit(str(e))
 
-        doc_h = math.ceil(self.document().documentLayout().documentSize().height())
-        h = max(1, doc_h + 2 * self.frameWidth())
-        self.setFixedHeight(h)
-        self.updateGeometry()
+def write_json_atomic(path, data, **kwargs):
+    # readers see either the old file or the new one, never a truncated one
+    temp = f"{path}.tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(temp, path)
+
+class ChatStore:
+    # chats, messages, stats and chat settings in one sqlite database (WAL); a chat keeps the
+    # messages it was last synced with, so saving the history only appends, updates or drops the rows that changed.
+    # writes are queued per chat and committed on the persistence thread; history and settings reads flush the chat
+    # they look at first, chat metadata and search read what is committed and never wait on the writer
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            modified REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS chats_position ON chats(position);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            llm TEXT,
+            extra TEXT,
+            UNIQUE(chat_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            message_id INTEGER PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+            input_ms REAL, gen_ms REAL, total_ms REAL,
+            input_t INTEGER, gen_t INTEGER, total_t INTEGER,
+            t_s REAL,
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id INTEGER PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+            settings TEXT NOT NULL
+        );
+    """
+    VERSION = 4
+    CHAT_COLUMNS = ("id", "title", "created", "modified", "message_count", "last_llm", "input_tokens", "gen_tokens")
+
+    def __init__(self, path="chats/chats.db", legacy_dir="chats", writer=None, max_synced=8, checkpoint_bytes=4 * 1024 * 1024):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.db = self._connect()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        self.wdb = self._connect(check_same_thread=False)
+        self.writer = writer if writer is not None else PersistenceService()
+        self._own_writer = writer is None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._failed = set()
+        self._settings = {}
+        self.max_synced = max_synced
+        self._synced = OrderedDict()
+        self.checkpoint_bytes = checkpoint_bytes
+        self._compact_wanted = threading.Event()
+        self._closing = False
+        self._compactor = threading.Thread(target=self._compact, daemon=True)
+        self._compactor.start()
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self.migrate_json(legacy_dir)
+        if version < 2:
+            self._add_chat_metadata()
+        if version < 3:
+            self._add_search_index()
+        if version < 4:
+            self._narrow_search_trigger()
+        self._next_id, self._next_position = self.db.execute("SELECT COALESCE(MAX(id) + 1, 0), COALESCE(MAX(position) + 1, 0) FROM chats").fetchone()
+
+    def _connect(self, **kwargs):
+        db = sqlite3.connect(self.path, **kwargs)
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA foreign_keys=ON")
+        # commits only append to the WAL; folding it back into the database is left to the compactor thread
+        db.execute("PRAGMA wal_autocheckpoint=0")
+        return db
+
+    def close(self):
+        if self._closing:
+            return
+        self.flush()
+        if self._own_writer:
+            self.writer.close()
+        self._closing = True
+        self._compact_wanted.set()
+        self._compactor.join()
+        self.wdb.close()
+        self.db.close()
+
+    def flush(self, chat_id=None):
+        self.writer.flush(None if chat_id is None else (self.path, chat_id))
+
+    def _write(self, key, op, delay=None, replace=False):
+        with self._pending_lock:
+            ops = self._pending.setdefault(key, [])
+            if replace:
+                ops.clear()
+            ops.append(op)
+        self.writer.submit((self.path, key), functools.partial(self._commit, key), delay)
+
+    def _commit(self, key):
+        with self._pending_lock:
+            ops = self._pending.pop(key, [])
+        if not ops:
+            return
+        try:
+            with self.wdb:
+                for op in ops:
+                    op(self.wdb)
+        except sqlite3.Error:
+            self._failed.add(key)
+            raise
+        self._written()
+
+    def _written(self):
+        self._compact_wanted.set()
+
+    def _compact(self):
+        db = sqlite3.connect(self.path)
+        try:
+            while True:
+                self._compact_wanted.wait()
+                self._compact_wanted.clear()
+                if self._closing:
+                    break
+                try:
+                    if os.path.getsize(self.path + "-wal") < self.checkpoint_bytes:
+                        continue
+                    busy, pages, moved = db.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                    logger.debug("Chat store checkpoint: busy=%s pages=%s moved=%s", busy, pages, moved)
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("Chat store checkpoint failed: %s", e)
+        finally:
+            db.close()
 
-class HoverLabel(QPushButton):
-    def __init__(self, text, info):
-        super().__init__(text)
-        self.info = info
+    def migrate_json(self, folder):
+        # one-time import of chat_list.json, chat_N.json and chat_N_settings.json; the files are left where they are
+        try:
+            with open(os.path.join(folder, "chat_list.json"), "r") as f:
+                chats = json.load(f).get("chats") or []
+        except (FileNotFoundError, json.JSONDecodeError):
+            chats = []
+        imported = 0
+        used = set()
+        with self.db:
+            for position, chat in enumerate(chats):
+                filename = chat.get("filename", "")
+                try:
+                    chat_id = int(filename.removesuffix(".json").removeprefix("chat_"))
+                except ValueError:
+                    chat_id = None
+                if chat_id in used:
+                    chat_id = None
+                used.add(chat_id)
+                try:
+                    with open(os.path.join(folder, filename), "r") as f:
+                        history = json.load(f).get("history", [])
+                except (FileNotFoundError, json.JSONDecodeError):
+                    history = [{"role": "system", "content": "You are a helpful assistant."}]
+                now = time.time()
+                cursor = self.db.execute("INSERT INTO chats (id, title, position, created, modified) VALUES (?, ?, ?, ?, ?)",
+                                         (chat_id, chat.get("title", "Untitled Chat"), position, now, now))
+                self._insert_messages(self.db, cursor.lastrowid, 0, history)
+                try:
+                    with open(os.path.join(folder, filename.removesuffix(".json") + "_settings.json"), "r") as f:
+                        settings = json.load(f).get("settings", {})
+                    self.db.execute("INSERT INTO chat_settings (chat_id, settings) VALUES (?, ?)", (cursor.lastrowid, json.dumps(settings)))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+                imported += 1
+            self.db.execute("PRAGMA user_version=1")
+        self._written()
+        if imported:
+            logger.info("Migrated %d chats from %s into %s", imported, folder, self.path)
+
+    def _add_chat_metadata(self):
+        # per-chat summary kept next to the title so the list, tooltips and sorting never read messages
+        with self.db:
+            for column in ("message_count INTEGER NOT NULL DEFAULT 0", "last_llm TEXT",
+                           "input_tokens INTEGER NOT NULL DEFAULT 0", "gen_tokens INTEGER NOT NULL DEFAULT 0"):
+                self.db.execute(f"ALTER TABLE chats ADD COLUMN {column}")
+            self.db.execute("""
+                UPDATE chats SET
+                    message_count = (SELECT COUNT(*) FROM messages WHERE chat_id = chats.id),
+                    last_llm = (SELECT llm FROM messages WHERE chat_id = chats.id AND llm IS NOT NULL ORDER BY seq DESC LIMIT 1),
+                    input_tokens = (SELECT COALESCE(SUM(s.input_t), 0) FROM messages m JOIN stats s ON s.message_id = m.id WHERE m.chat_id = chats.id),
+                    gen_tokens = (SELECT COALESCE(SUM(s.gen_t), 0) FROM messages m JOIN stats s ON s.message_id = m.id WHERE m.chat_id = chats.id)""")
+            self.db.execute("PRAGMA user_version=2")
+        self._written()
+
+    def _add_search_index(self):
+        # external-content FTS5 table over messages; the triggers keep it in step with every insert, edit and delete
+        self.db.executescript("""
+            BEGIN;
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, role, llm, content='messages', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts(rowid, content, role, llm) VALUES (new.id, new.content, new.role, new.llm);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content, role, llm) VALUES ('delete', old.id, old.content, old.role, old.llm);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content, role, llm) VALUES ('delete', old.id, old.content, old.role, old.llm);
+                INSERT INTO messages_fts(rowid, content, role, llm) VALUES (new.id, new.content, new.role, new.llm);
+            END;
+            INSERT INTO messages_fts(messages_fts) VALUES ('rebuild');
+            PRAGMA user_version=3;
+            COMMIT;""")
+        self._written()
+
+    def _narrow_search_trigger(self):
+        # token counts are cached in a message's extra column; updating them must not reindex its text
+        self.db.executescript("""
+            BEGIN;
+            DROP TRIGGER IF EXISTS messages_fts_update;
+            CREATE TRIGGER messages_fts_update AFTER UPDATE OF content, role, llm ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content, role, llm) VALUES ('delete', old.id, old.content, old.role, old.llm);
+                INSERT INTO messages_fts(rowid, content, role, llm) VALUES (new.id, new.content, new.role, new.llm);
+            END;
+            PRAGMA user_version=4;
+            COMMIT;""")
+        self._written()
+
+    def search(self, text, limit=50, window=2000):
+        # every word has to match (the last one as a prefix, so results follow typing); best bm25 first.
+        # bm25 is only computed over the newest `window` matches, ranking every hit of a common word is what costs
+        terms = re.findall(r"\w+", text)
+        if not terms:
+            return []
+        query = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        cursor = self.db.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("""
+            SELECT m.chat_id, m.seq, m.role, m.llm, c.title, snippet(messages_fts, -1, '«', '»', '…', 12) AS snippet
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid JOIN chats c ON c.id = m.chat_id
+            WHERE messages_fts MATCH :query AND messages_fts.rowid >= coalesce((
+                SELECT rowid FROM messages_fts WHERE messages_fts MATCH :query ORDER BY rowid DESC LIMIT 1 OFFSET :window), 0)
+            ORDER BY rank LIMIT :limit""", {"query": query.strip(), "window": window, "limit": limit}).fetchall()
+
+    def list_chats(self):
+        self.flush()
+        cursor = self.db.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(f"SELECT {', '.join(self.CHAT_COLUMNS)} FROM chats ORDER BY position, id").fetchall()
+
+    def chat_info(self, chat_id):
+        cursor = self.db.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(f"SELECT {', '.join(self.CHAT_COLUMNS)} FROM chats WHERE id = ?", (chat_id,)).fetchone()
+
+    def create_chat(self, title, history=None):
+        now = time.time()
+        chat_id, position = self._next_id, self._next_position
+        self._next_id += 1
+        self._next_position += 1
+        self._remember(chat_id, history or [])
+        messages = list(self._synced[chat_id])
+        row = (chat_id, title, position, now, now, len(messages), self._last_llm(messages),
+               self._tokens(messages, "input_t"), self._tokens(messages, "gen_t"))
+        def write(db):
+            db.execute("""
+                INSERT INTO chats (id, title, position, created, modified, message_count, last_llm, input_tokens, gen_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", row)
+            self._insert_messages(db, chat_id, 0, messages)
+        self._write(chat_id, write, delay=0)
+        return chat_id
+
+    def update_chat_list(self, chats):
+        rows = [(title, position, chat_id, title, position) for position, (chat_id, title) in enumerate(chats)]
+        self._next_position = max(self._next_position, len(rows))
+        self._write("list", lambda db: db.executemany("UPDATE chats SET title = ?, position = ? WHERE id = ? AND (title != ? OR position != ?)", rows), replace=True)
+
+    def rename_chat(self, chat_id, title):
+        self._write(chat_id, lambda db: db.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id)))
+
+    def delete_chat(self, chat_id):
+        self._write(chat_id, lambda db: db.execute("DELETE FROM chats WHERE id = ?", (chat_id,)))
+        self._synced.pop(chat_id, None)
+        with self._pending_lock:
+            self._settings.pop(chat_id, None)
+
+    def load_history(self, chat_id):
+        self.flush(chat_id)
+        history = []
+        rows = self.db.execute("""
+            SELECT m.role, m.content, m.llm, m.extra, s.message_id, s.input_ms, s.gen_ms, s.total_ms,
+                   s.input_t, s.gen_t, s.total_t, s.t_s, s.extra
+            FROM messages m LEFT JOIN stats s ON s.message_id = m.id
+            WHERE m.chat_id = ? ORDER BY m.seq""", (chat_id,))
+        for role, content, llm, extra, stats_id, *stats_row in rows:
+            message = {"role": role, "content": content}
+            if llm is not None:
+                message["llm"] = llm
+            if stats_id is not None:
+                stats = {name: value for name, value in zip(CHAT_STATS_FIELDS, stats_row) if value is not None}
+                if stats_row[-1]:
+                    stats.update(json.loads(stats_row[-1]))
+                message["stats"] = stats
+            if extra:
+                message.update(json.loads(extra))
+            history.append(message)
+        self._remember(chat_id, history)
+        return history
+
+    def save_history(self, chat_id, history):
+        if chat_id in self._failed:
+            self._failed.discard(chat_id)
+            self._synced.pop(chat_id, None)
+        synced = self._synced.get(chat_id)
+        if synced is None:
+            self.load_history(chat_id)
+            synced = self._synced[chat_id]
+        keep = 0
+        limit = min(len(synced), len(history))
+        while keep < limit and synced[keep] == history[keep]:
+            keep += 1
+        if keep == len(synced) == len(history):
+            return
+        shared = min(len(synced), len(history))
+        tail = self._snapshot(history[keep:])
+        changed = [(seq, tail[seq - keep]) for seq in range(keep, shared) if synced[seq] != history[seq]]
+        truncated = len(synced) > shared
+        appended = tail[shared - keep:]
+        metadata = (time.time(), len(history), self._last_llm(history),
+                    self._tokens(tail, "input_t") - self._tokens(synced[keep:], "input_t"),
+                    self._tokens(tail, "gen_t") - self._tokens(synced[keep:], "gen_t"), chat_id)
+        def write(db):
+            for seq, message in changed:
+                self._update_message(db, chat_id, seq, message)
+            if truncated:
+                db.execute("DELETE FROM messages WHERE chat_id = ? AND seq >= ?", (chat_id, shared))
+            self._insert_messages(db, chat_id, shared, appended)
+            db.execute("""
+                UPDATE chats SET modified = ?, message_count = ?, last_llm = ?,
+                    input_tokens = input_tokens + ?, gen_tokens = gen_tokens + ? WHERE id = ?""", metadata)
+        self._write(chat_id, write)
+        synced[keep:] = tail
+        self._synced.move_to_end(chat_id)
+
+    def load_settings(self, chat_id):
+        self.flush(chat_id)
+        row = self.db.execute("SELECT settings FROM chat_settings WHERE chat_id = ?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_settings(self, chat_id, settings):
+        # a slider saves on every tick; only the newest settings of a chat get written, the ops after it find nothing left
+        with self._pending_lock:
+            self._settings[chat_id] = json.dumps(settings)
+        self._write(chat_id, functools.partial(self._upsert_settings, chat_id=chat_id))
+
+    def _upsert_settings(self, db, chat_id):
+        with self._pending_lock:
+            settings = self._settings.pop(chat_id, None)
+        if settings is not None:
+            db.execute("INSERT INTO chat_settings (chat_id, settings) VALUES (?, ?) ON CONFLICT(chat_id) DO UPDATE SET settings = excluded.settings", (chat_id, settings))
+
+    def _insert_messages(self, db, chat_id, seq, messages):
+        for offset, message in enumerate(messages):
+            message_id = db.execute("INSERT INTO messages (chat_id, seq, role, content, llm, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (chat_id, seq + offset, *self._message_row(message))).lastrowid
+            self._insert_stats(db, message_id, message.get("stats"))
+
+    def _update_message(self, db, chat_id, seq, message):
+        message_id = db.execute("SELECT id FROM messages WHERE chat_id = ? AND seq = ?", (chat_id, seq)).fetchone()[0]
+        db.execute("UPDATE messages SET role = ?, content = ?, llm = ?, extra = ? WHERE id = ?", (*self._message_row(message), message_id))
+        db.execute("DELETE FROM stats WHERE message_id = ?", (message_id,))
+        self._insert_stats(db, message_id, message.get("stats"))
+
+    def _message_row(self, message):
+        extra = {key: value for key, value in message.items() if key not in ("role", "content", "llm", "stats")}
+        return message.get("role", "user"), message.get("content", ""), message.get("llm"), json.dumps(extra) if extra else None
+
+    def _insert_stats(self, db, message_id, stats):
+        if isinstance(stats, dict):
+            extra = {key: value for key, value in stats.items() if key not in CHAT_STATS_FIELDS}
+            db.execute("INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (message_id, *(stats.get(name) for name in CHAT_STATS_FIELDS), json.dumps(extra) if extra else None))
+
+    def _last_llm(self, history):
+        for message in reversed(history):
+            if message.get("llm"):
+                return message["llm"]
+        return None
+
+    def _tokens(self, messages, key):
+        return sum(message["stats"].get(key) or 0 for message in messages if isinstance(message.get("stats"), dict))
+
+    def _snapshot(self, messages):
+        return [{**message, "stats": dict(message["stats"])} if isinstance(message.get("stats"), dict) else dict(message)
+                for message in messages]
+
+    def _remember(self, chat_id, history):
+        self._synced[chat_id] = self._snapshot(history)
+        self._synced.move_to_end(chat_id)
+        while len(self._synced) > self.max_synced:
+            self._synced.popitem(last=False)
+
+class SettingsStore(QObject):
+    # edits are published to the cached layers at once; the files are written behind, on the persistence thread
+    PROFILE, MODEL, CHAT = 0, 1, 2   # same numbering as the use_case of bpSettings
+    TOGGLES = {MODEL: 'model_settings', CHAT: 'chat_settings'}
+    written = pyqtSignal(str, int)
+
+    def __init__(self, defaults, chat_store, writer, parent=None):
+        super().__init__(parent)
+        self.defaults = defaults
+        self.chatStore = chat_store
+        self.writer = writer
+        self.layers = {}        # (kind, key) -> settings dict, None for a chat without own settings
+        self.resolved = {}
+        self.pending = {}       # path -> number of its newest queued write
+        self.stamps = {}        # path -> (mtime, size) of our own last write, so it doesn't invalidate itself
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self._file_changed)
+        self.written.connect(self._written)
+
+    def key(self, kind, key):
+        if kind == self.MODEL:
+            return f"{key[:-5]}.json"
+        return key
+
+    def load(self, kind, key, create=True):
+        key = self.key(kind, key)
+        if (kind, key) not in self.layers:
+            self.layers[kind, key] = self._read(kind, key)
+        settings = self.layers[kind, key]
+        if settings is None:
+            if not create:
+                return None
+            settings = self.layers[kind, key] = {}
+        missing = False
+        for setting in self.defaults:
+            if kind in setting['use_case'] and setting['name'] not in settings:
+                settings[setting['name']] = setting['default']
+                missing = True
+        if missing:
+            try:
+                self.save(kind, key)
+            except (OSError, sqlite3.Error) as e:
+                logger.error("Failed to save default settings to %s: %s", key, e)
+        return settings
+
+    def save(self, kind, key, settings=None):
+        key = self.key(kind, key)
+        if settings is not None:
+            self.layers[kind, key] = dict(settings)
+        settings = self.layers[kind, key]
+        self.resolved.clear()
+        if kind == self.CHAT:
+            self.chatStore.save_settings(key, settings)
+            return
+        self.pending[key] = self.pending.get(key, 0) + 1
+        self.writer.submit(("settings", key), functools.partial(self._write_file, kind, key, dict(settings), self.pending[key]))
+
+    def flush(self):
+        # an editor lost focus or a slider was let go: write what is queued now instead of after the debounce
+        self.writer.flush(wait=False)
+
+    def remove(self, kind, key):
+        # a write still queued for the file would bring it back after the delete
+        key = self.key(kind, key)
+        self.writer.cancel(("settings", key))
+        self.pending.pop(key, None)
+        self.stamps.pop(key, None)
+        if key in self.watcher.files():
+            self.watcher.removePath(key)
+        try:
+            os.remove(key)
+        except FileNotFoundError:
+            pass
+        self.layers.pop((kind, key), None)
+        self.resolved.clear()
 
-    def enterEvent(self, event):
-        if self.info == "":
+    def invalidate(self, kind=None, key=None):
+        if kind is None:
+            self.layers.clear()
+        else:
+            self.layers.pop((kind, self.key(kind, key)), None)
+        self.resolved.clear()
+
+    def resolve(self, chat=None, model=None, profile=None):
+        # Chat > Model > Profile, a chat or model layer only counts while its toggle is on
+        cache_key = (chat, model, profile)
+        if cache_key not in self.resolved:
+            layers = []
+            if chat is not None:
+                layers.append((self.CHAT, self.load(self.CHAT, chat, create=False)))
+            if model is not None:
+                layers.append((self.MODEL, self.load(self.MODEL, model, create=False)))
+            if profile is not None:
+                layers.append((self.PROFILE, self.load(self.PROFILE, profile)))
+            settings = {}
+            for kind, layer in layers:
+                if layer and (kind == self.PROFILE or layer.get(self.TOGGLES[kind], False) == True):
+                    for name, value in layer.items():
+                        settings.setdefault(name, value)
+            self.resolved[cache_key] = settings
+        return dict(self.resolved[cache_key])
+
+    def _read(self, kind, key):
+        if kind == self.CHAT:
+            return self.chatStore.load_settings(key)
+        try:
+            with open(key, "r") as f:
+                settings = json.load(f).get('settings', {})
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, AttributeError):
+            return {}
+        self.watcher.addPath(key)
+        return settings
+
+    def _stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _write_file(self, kind, key, settings, number):
+        if os.path.dirname(key) and not os.path.exists(os.path.dirname(key)):
+            os.makedirs(os.path.dirname(key))
+        write_json_atomic(key, {"settings": settings, "type": kind}, indent=4)
+        self.stamps[key] = self._stamp(key)
+        self.written.emit(key, number)
+
+    def _written(self, path, number):
+        if self.pending.get(path) == number:
+            del self.pending[path]
+        if path not in self.watcher.files():
+            self.watcher.addPath(path)
+
+    def _file_changed(self, path):
+        stamp = self._stamp(path)
+        if stamp is not None and path not in self.watcher.files():
+            self.watcher.addPath(path)      # os.replace() swaps the inode, the old watch is gone
+        if path in self.pending or (stamp is not None and stamp == self.stamps.get(path)):
             return
-        QToolTip.hideText()
-        QToolTip.showText(
-            self.mapToGlobal(QPoint(0, self.height())),
-            self.info,
-            self
-        )
-        super().enterEvent(event)
-    
-    def leaveEvent(self, event):
-        QToolTip.hideText()
-        super().leaveEvent(event)
-
-def is_llama_server_running():
-    result = subprocess.run(
-        ["pgrep", "-f", "llama-server"],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    return result.returncode == 0
-
-def kill_llama_server():
-    subprocess.run(
-        ["pkill", "-f", "llama-server"],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+        self.stamps.pop(path, None)
+        for kind in (self.PROFILE, self.MODEL):
+            self.layers.pop((kind, path), None)
+        self.resolved.clear()
+
 class App(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowFlag(Qt.WindowType.FramelessWindowHint, True)
         self.setMinimumSize(600, 338)
         self.setWindowTitle("Qully Chat")
+        BubbleResources.load()
+        self.backend = GenerationBackend(self)
+        self.persistence = PersistenceService(parent=self)
+        self._shut_down = False
+        self.persistence.error_emit.connect(lambda e: QMessageBox.critical(self, "Error", f"Failed to save: {e}"))
+        self.chatStore = ChatStore(writer=self.persistence)
+        self.ggufCache = GGUFMetadataCache(writer=self.persistence)
 
-        self.chat_ids = []
         self.chatHistory = []
         self.chatLegacyHistory = []
         self.models = []
@@ -670,18 +3019,40 @@ class App(QWidget):
             {'type': 'radiobutton', 'name': 'chat_settings', 'display': 'Use chat settings', 'default': False, 'use_case': [2]},
             {'type': 'text', 'name': 'address', 'display': 'Address', 'default': '127.0.0.1', 'use_case': [0]},
             {'type': 'number', 'name': 'port', 'display': 'Port', 'default': '5175', 'use_case': [0]},
+            {'type': 'text', 'name': 'server_binary', 'display': 'Server binary', 'default': './llama/llama-server', 'use_case': [0]},
+            {'type': 'number', 'name': 'load_timeout', 'display': 'Model load timeout (s)', 'default': "300", 'min': 1, 'max': 86400, 'use_case': [0]},
+            {'type': 'number', 'name': 'parallel_slots', 'display': 'Server slots (share the context)', 'default': "1", 'min': 1, 'max': 64, 'use_case': [0]},
+            {'type': 'number', 'name': 'slot_cache_size', 'display': 'Chat KV cache on disk (MiB, 0: off)', 'default': "4096", 'min': 0, 'max': 10485760, 'use_case': [0]},
+            {'type': 'text', 'name': 'server_log_dir', 'display': 'Server log folder (empty: off)', 'default': '', 'use_case': [0]},
+            {'type': 'number', 'name': 'pool_size', 'display': 'Models kept loaded', 'default': "1", 'min': 1, 'max': 16, 'use_case': [0]},
+            {'type': 'number', 'name': 'pool_memory', 'display': 'Memory for loaded models (MiB, 0: no limit)', 'default': "0", 'min': 0, 'max': 10485760, 'use_case': [0]},
             {'type': 'slider', 'name': 'threads', 'display': 'CPU Threads', 'default': "-1", 'min': 1, 'max': os.cpu_count(), 'use_case': [0, 1, 2]},
             {'type': 'combo', 'name': 'gpu_layers', 'display': 'Layers on GPU', 'default': "All", 'options': ["Auto", "All", "0"], 'use_case': [0, 2]},
             {'type': 'slider', 'name': 'gpu_layers', 'display': 'Layers on GPU', 'default': "-1", 'min': 0, 'max': 0, 'use_case': [1]},
             {'type': 'number', 'name': 'batch_size', 'display': 'Batch size', 'default': "512", 'use_case': [0, 1, 2]},
-            {'type': 'text', 'name': 'system_prompt', 'display': 'System prompt', 'default': 'You are a helpful assistant.', 'use_case': [0, 1, 2]}
+            {'type': 'number', 'name': 'ctx_size', 'display': 'Context size (0: model\'s)', 'default': "4096", 'min': 0, 'max': 10485760, 'use_case': [0, 1, 2]},
+            {'type': 'number', 'name': 'reserve_tokens', 'display': 'Context kept free for the reply', 'default': "1024", 'min': 0, 'max': 10485760, 'use_case': [0, 1, 2]},
+            {'type': 'number', 'name': 'memory_budget', 'display': 'GPU memory for "Auto" layers (MiB)', 'default': "0", 'min': 0, 'max': 10485760, 'use_case': [0]},
+            {'type': 'text', 'name': 'system_prompt', 'display': 'System prompt', 'default': 'You are a helpful assistant.', 'use_case': [0, 1, 2]},
+            {'type': 'slider', 'name': 'stream_latency', 'display': 'Max token delay (ms)', 'default': "30", 'min': 0, 'max': 100, 'use_case': [0]},
+            {'type': 'slider', 'name': 'stream_batch', 'display': 'Max tokens per update', 'default': "32", 'min': 1, 'max': 128, 'use_case': [0]},
+            {'type': 'combo', 'name': 'log_level', 'display': 'Log level', 'default': "Warning", 'options': ["Warning", "Error", "Info", "Debug"], 'use_case': [0]}
         ]   # 0: llm settings tab; 1: llm model-specific settings; 2: chat-specific settings
+        self.settingsStore = SettingsStore(self.bpSettings, self.chatStore, self.persistence, self)
+        self.serverRegistry = ServerRegistry()
+        threading.Thread(target=self.serverRegistry.reclaim, daemon=True).start()
+        self.modelPool = ModelPool(self.backend, self, registry=self.serverRegistry)
+        self.serverKey = None
         self.currentAddress = "http://127.0.0.1:5175/v1/chat/completions"
+        self.contextBudget = None
+        self.budgetOptions = None       # (options, reserve) the context budget of the loaded model was worked out with
+        self.tokenizer = None
+        self.tokenizerPath = None
+        self.streamOptions = {'max_latency': 0.03, 'max_batch': 32}
         self.last_stats = {}
 
-        self._suppress_bubble_pop = False
         self._suppress_input = False
-        self._suppress_scroll_down = True
+        self._stick_bottom = True
 
         self.mainLayout = QVBoxLayout()
         self.mainLayout.setContentsMargins(0, 0, 0, 0)
@@ -691,6 +3062,10 @@ class App(QWidget):
         self.initChat()
         self.initModels()
         self.initLLMSettings()
+        self.modelPool.state_changed.connect(self.server_state_changed)
+        self.modelPool.metrics_changed.connect(lambda key, _metrics: self.update_server_tooltip() if key == self.serverKey else None)
+        self.profileSelect.currentIndexChanged.connect(lambda _: self.estimateTimer.start())
+        self.update_model_estimates()
         self.mainLayout.addWidget(self.tabs)
         self.setLayout(self.mainLayout)
 
@@ -727,6 +3102,12 @@ class App(QWidget):
         modelStopBtn.clicked.connect(self.stop_llama_server)
         centerPart.addWidget(modelStopBtn)
 
+        self.serverStatus = QPushButton("")
+        self.serverStatus.setFlat(True)
+        self.serverStatus.setFixedHeight(24)
+        self.serverStatus.clicked.connect(self.show_server_log)
+        centerPart.addWidget(self.serverStatus)
+
         self.profileSelect = QComboBox(self.topBar)
         self.profileSelect.setToolTip("Select Profile")
         self.profileSelect.setFixedHeight(24)
@@ -769,6 +3150,15 @@ class App(QWidget):
             elif isinstance(c, QComboBox) and c is getattr(self, "profileSelect", None):
                 obj.move(c.mapToGlobal(QPoint(0, c.height()))); obj.setMinimumWidth(c.width())
         
+        if event.type() == QEvent.Type.ToolTip and hasattr(self, "chatList") and obj is self.chatList.viewport():
+            item = self.chatList.itemAt(event.pos())
+            info = self.chatStore.chat_info(item.data(Qt.ItemDataRole.UserRole)) if item else None
+            if info:
+                QToolTip.showText(event.globalPos(), chat_tooltip(info), self.chatList)
+            else:
+                QToolTip.hideText()
+            return True
+
         if obj is self.topBar:
             if event.type() == QEvent.Type.MouseButtonPress and event.button() == Qt.MouseButton.LeftButton:
                 pos_in_win = self.topBar.mapTo(self, event.position().toPoint())
@@ -838,45 +3228,15 @@ class App(QWidget):
         return edges
     
     def model_changed(self, index):
-        settings_build = {}
-        settings_set = 0
-        ### if chat has settings
         chat = self.chatList.currentItem()
-        if chat:
-            filename = chat.data(Qt.ItemDataRole.UserRole)
-            filename = filename[:-5]
-            if os.path.exists(f"chats/{filename}_settings.json"):
-                self.loadLLMSettings(path=f"chats/{filename}_settings.json", type=2, display=0)
-                if self.LLMSettings.get('chat_settings', False) == True:
-                    if settings_set == 0:
-                        settings_set = 1
-                        settings_build = self.LLMSettings.copy()
-                    else:
-                        for key, value in self.LLMSettings.items():
-                            if key not in settings_build:
-                                settings_build[key] = value
-        ### if model has settings
         idx = self.modelSelect.itemData(index)['row']
-        self.loadLLMSettings(path=self.models[int(idx)].get("path", ""), type=1, display=0)
-        if self.LLMSettings.get('model_settings', False) == True:
-            if settings_set == 0:
-                settings_set = 1
-                settings_build = self.LLMSettings.copy()
-            else:
-                for key, value in self.LLMSettings.items():
-                    if key not in settings_build:
-                        settings_build[key] = value
-        ### else use profile settings
-        self.loadLLMSettings(path=f"settings/{self.profileSelect.currentData()}", type=0, display=0)
-        if settings_set == 0:
-            settings_build = self.LLMSettings.copy()
-        else:
-            for key, value in self.LLMSettings.items():
-                if key not in settings_build:
-                    settings_build[key] = value
+        settings_build = self.settingsStore.resolve(
+            chat=chat.data(Qt.ItemDataRole.UserRole) if chat else None,
+            model=self.models[int(idx)].get("path", ""),
+            profile=f"settings/{self.profileSelect.currentData()}")
         gpu_layers = settings_build.get('gpu_layers')
         if gpu_layers == "Auto":
-            gpu_layers = int(self.models[int(idx)]['layers'])+1
+            gpu_layers = self.auto_gpu_layers(self.models[int(idx)], settings_build)
         elif gpu_layers == "All":
             gpu_layers = int(self.models[int(idx)]['layers'])+1
         elif gpu_layers == "0":
@@ -887,26 +3247,141 @@ class App(QWidget):
             'port': settings_build['port'],
             'threads': int(settings_build['threads']),
             'gpu_layers': int(gpu_layers),
-            'batch_size': int(settings_build['batch_size'])
+            'batch_size': int(settings_build['batch_size']),
+            'ctx_size': int(settings_build.get('ctx_size') or 0),
+            'parallel': int(settings_build.get('parallel_slots') or 1),
+            'slot_cache_size': int(settings_build.get('slot_cache_size') or 0) * 1024 * 1024
         }
-        self.currentAddress = f"http://{settings_build['address']}:{settings_build['port']}/v1/chat/completions"
-        if hasattr(self, 'llama_thread') and self.llama_thread._is_running:
-            self.llama_thread.stop()
-            self.llama_thread.wait()
-        else:
-            while is_llama_server_running():
-                kill_llama_server()
-                time.sleep(0.1)
-        self.llama_thread = Llama_cpp(options)
-        self.llama_thread.start()
-        self.llama_thread.exec()
-        self.llama_thread.run()
+        if options['slot_cache_size'] > 0:
+            options['slot_save_path'] = os.path.join("models", "slots", hashlib.sha1(options['model_path'].encode("utf-8")).hexdigest()[:16])
+        self.streamOptions = {'max_latency': int(settings_build.get('stream_latency', 30)) / 1000, 'max_batch': int(settings_build.get('stream_batch', 32))}
+        if settings_build.get('log_level') in LOG_LEVELS:
+            # the profile can make the log more verbose than QULLYCHAT_LOG_LEVEL, never quieter
+            logger.setLevel(min(ENV_LOG_LEVEL, LOG_LEVELS[settings_build['log_level']]))
+        self.modelPool.configure(int(settings_build.get('pool_size') or 1), int(settings_build.get('pool_memory') or 0) * 1024 * 1024)
+        self.serverKey = options['model_path']
+        supervisor = self.modelPool.acquire(self.serverKey, options, binary=settings_build.get('server_binary') or "./llama/llama-server",
+                                            timeout=int(settings_build.get('load_timeout') or 300),
+                                            estimate=self.model_memory(self.models[int(idx)], options),
+                                            log_dir=settings_build.get('server_log_dir') or "")
+        self.currentAddress = f"{self.modelPool.address(self.serverKey, settings_build['address'])}/v1/chat/completions"
+        self.budgetOptions = (options, int(settings_build.get('reserve_tokens') or 0))
+        self.contextBudget = self.context_budget(*self.budgetOptions)
+        self.load_tokenizer(self.serverKey)
+        if supervisor.state in (SERVER_LOADING, SERVER_READY):
+            self.server_state_changed(self.serverKey, supervisor.state, supervisor.message)
+
+    def model_memory(self, model, options):
+        metadata = self.cached_metadata(model.get("path", ""))
+        if metadata is None:
+            # not read yet: the weights are most of it, so the file size stands in
+            try:
+                return os.path.getsize(model.get("path", ""))
+            except OSError:
+                return 0
+        estimate = estimate_memory(metadata, options['gpu_layers'], options['ctx_size'], options['batch_size'] or 512)
+        return estimate['ram'] + estimate['vram']
+
+    def context_budget(self, options, reserve):
+        # tokens a request may use: the slot's share of the context (the model's own size when none is set) minus the reply's reserve
+        ctx_size = options['ctx_size']
+        if ctx_size <= 0:
+            metadata = self.cached_metadata(options['model_path'])
+            if metadata is None:
+                return None
+            ctx_size = metadata.get(f"{metadata.get('general.architecture')}.context_length") or 0
+        if ctx_size <= 0:
+            return None
+        return max(ctx_size // max(1, options['parallel']) - reserve, 0)
+
+    def load_tokenizer(self, path):
+        # read off the UI thread; counts fall back to /tokenize until (or unless) the vocabulary is loaded
+        if path == self.tokenizerPath:
+            return
+        self.tokenizer = None
+        self.tokenizerPath = path
+        worker = GGUFTokenizerWorker(path, self)
+        worker.tokenizer_ready.connect(self.tokenizer_ready)
+        worker.start()
+        self.update_token_count()
+
+    def tokenizer_ready(self, path, tokenizer):
+        if path == self.tokenizerPath:
+            self.tokenizer = tokenizer
+            self.update_token_count()
+
+    def update_token_count(self):
+        text = self.chatInput.text()
+        if self.tokenizer is None or not text:
+            self.tokenCount.clear()
+            return
+        tokens = self.tokenizer.count(text)
+        self.tokenCount.setText(f"{tokens} tokens")
+        self.tokenCount.setToolTip(f"Prompt: {tokens} tokens" + (f"\nContext budget: {self.contextBudget} tokens" if self.contextBudget is not None else ""))
+
+    def token_key(self):
+        return os.path.basename(self.serverKey or "")
+
+    def cache_tokens(self, counted, key):
+        # a new dict, not an update in place: the chat store compares against a shallow snapshot
+        for message, tokens in counted:
+            message["tokens"] = {**(message.get("tokens") or {}), key: tokens}
+
+    def route_chat_model(self, history):
+        # a chat goes back to the model that last answered in it, as long as that one is still loaded;
+        # the history was just loaded, so it answers this without another query
+        last_llm = next((message['llm'] for message in reversed(history) if message.get('llm')), None)
+        index = self.modelSelect.findText(last_llm) if last_llm else -1
+        if index < 0 or index == self.modelSelect.currentIndex() or self.modelPool.get(self.modelSelect.itemData(index)['path']) is None:
+            return
+        self.modelSelect.setCurrentIndex(index)
+        self.model_changed(index)
 
     def stop_llama_server(self):
-        if hasattr(self, 'llama_thread') and self.llama_thread._is_running:
-            self.llama_thread.stop()
-            self.llama_thread.wait()
+        if self.serverKey in self.modelPool.servers:
+            self.modelPool.release(self.serverKey)
+            self.serverKey = None
+            self.modelSelect.setCurrentIndex(-1)
+            self.server_state_changed(None, SERVER_STOPPED, "")
+
+    def server_state_changed(self, key, state, message):
+        supervisor = self.modelPool.servers.get(key)
+        if state == SERVER_FAILED and supervisor is not None and supervisor.state == SERVER_FAILED:
+            self.modelPool.release(key)
+        if key != self.serverKey:
+            return
+        self.sendBtn.setEnabled(state != SERVER_LOADING)
+        self.serverStatus.setText({SERVER_LOADING: "Loading…", SERVER_READY: "Ready", SERVER_FAILED: "Failed"}.get(state, ""))
+        self.update_server_tooltip(message)
+        if state == SERVER_FAILED:
+            self.serverKey = None
             self.modelSelect.setCurrentIndex(-1)
+            QMessageBox.warning(self, "Error", f"The LLM server failed: {message}")
+
+    def update_server_tooltip(self, message=None):
+        supervisor = self.modelPool.servers.get(self.serverKey)
+        if supervisor is None:
+            self.serverStatus.setToolTip(message or "")
+            return
+        message = supervisor.message if message is None else message
+        summary = supervisor.summary()
+        self.serverStatus.setToolTip(summary if supervisor.state == SERVER_READY else "\n".join(filter(None, [message, summary])))
+
+    def show_server_log(self):
+        supervisor = self.modelPool.servers.get(self.serverKey)
+        if supervisor is None:
+            return
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"llama-server log: {os.path.basename(self.serverKey)}")
+        dialog.resize(800, 500)
+        layout = QVBoxLayout(dialog)
+        log = QTextEdit()
+        log.setReadOnly(True)
+        log.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        log.setPlainText("\n".join(supervisor.output))
+        log.moveCursor(QTextCursor.MoveOperation.End)
+        layout.addWidget(log)
+        dialog.exec()
 
     def minimize(self):
         self.showMinimized()
@@ -925,14 +3400,29 @@ class App(QWidget):
         try:
             self.save_chat()
             self.save_chat_list()
-            self.stop_llama_server()
+            self.renderCache.save()
+            self.backend.shutdown()
+            self.modelPool.stop(wait=5)
         finally:
             self.close()
 
     def closeEvent(self, event):
+        if self._shut_down:
+            # the stores are closed already, a second close only hides the window
+            return super().closeEvent(event)
+        self._shut_down = True
         try:
+            # background readers are parented to the window and must not outlive it
+            for worker in self.findChildren(QThread):
+                if isinstance(worker, GGUFScanWorker):
+                    worker.stop()
+                worker.wait()
             self.save_chat()
             self.save_chat_list()
+            self.renderCache.save()
+            self.backend.shutdown()
+            self.chatStore.close()
+            self.persistence.close()
         finally:
             super().closeEvent(event)
 
@@ -967,17 +3457,52 @@ class App(QWidget):
         exportChatBtn.clicked.connect(lambda _: exportMenu.exec(exportChatBtn.mapToGlobal(QPoint(0, exportChatBtn.height()))))
         chatLButtons.addWidget(exportChatBtn)
 
+        sortChatsBtn = QPushButton("⇅")
+        sortChatsBtn.setToolTip("Sort chat sessions")
+        sortMenu = QMenu()
+        sortMenu.addAction("Sort by last modified", lambda: self.sort_chats("modified", True))
+        sortMenu.addAction("Sort by title", lambda: self.sort_chats("title"))
+        sortMenu.addAction("Sort by message count", lambda: self.sort_chats("message_count", True))
+        sortMenu.addAction("Sort by tokens used", lambda: self.sort_chats("tokens", True))
+        sortChatsBtn.clicked.connect(lambda _: sortMenu.exec(sortChatsBtn.mapToGlobal(QPoint(0, sortChatsBtn.height()))))
+        chatLButtons.addWidget(sortChatsBtn)
+
         chatLLayout.addLayout(chatLButtons)
 
+        self.chatSearch = QLineEdit()
+        self.chatSearch.setPlaceholderText("Search all chats…")
+        self.chatSearch.setClearButtonEnabled(True)
+        self.chatSearchTimer = QTimer(self)
+        self.chatSearchTimer.setSingleShot(True)
+        self.chatSearchTimer.setInterval(150)
+        self.chatSearchTimer.timeout.connect(self.search_chats)
+        self.chatSearch.textChanged.connect(lambda _: self.chatSearchTimer.start())
+        self.chatSearch.returnPressed.connect(lambda: self.open_search_result(self.searchResults.item(0)))
+        chatLLayout.addWidget(self.chatSearch)
+
+        self.searchResults = QListWidget()
+        self.searchResults.setUniformItemSizes(True)
+        self.searchResults.setWordWrap(False)
+        self.searchResults.itemClicked.connect(self.open_search_result)
+        self.searchResults.itemActivated.connect(self.open_search_result)
+        self.searchResults.hide()
+        chatLLayout.addWidget(self.searchResults)
+
         self.chatList = QListWidget()
+        self.chatList.setUniformItemSizes(True)
+        self._chat_item_flags = None
         self.chatList.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)
-        self.chatList.itemChanged.connect(self.save_chat_list)
+        self.chatList.itemChanged.connect(self.rename_chat)
         self.chatList.currentItemChanged.connect(self.load_chat)
         self.chatList.setDragEnabled(True)
         self.chatList.setAcceptDrops(True)
         self.chatList.setDropIndicatorShown(True)
         self.chatList.setDragDropMode(self.chatList.DragDropMode.InternalMove)
-        self.chatList.model().rowsMoved.connect(self.save_chat_list)
+        self.chatListTimer = QTimer(self)
+        self.chatListTimer.setSingleShot(True)
+        self.chatListTimer.setInterval(250)
+        self.chatListTimer.timeout.connect(self.save_chat_list)
+        self.chatList.model().rowsMoved.connect(lambda *_: self.chatListTimer.start())
 
         chatLLayout.addWidget(self.chatList)
         layout.addLayout(chatLLayout, 20)
@@ -1001,38 +3526,48 @@ class App(QWidget):
         chatWLayout2 = QHBoxLayout()
         chatWLayout2S = QVBoxLayout()
 
-        self.chatDisplayScroll = QScrollArea()
-        self.chatDisplayScroll.setWidgetResizable(True)
-        self.chatDisplayWidget = QWidget()
-        self.chatDisplay = QVBoxLayout()
-        self.chatDisplay.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.chatDisplay.setContentsMargins(0, 0, 0, 0)
-
-        def _bubbles_change_event(w, ev):
-            if not self._suppress_scroll_down:
-                self.chatDisplayScroll.verticalScrollBar().setValue(self.chatDisplayScroll.verticalScrollBar().maximum())
-            if ev.type() == QEvent.Type.ChildAdded:
-                if isinstance(ev.child(), ChatBubble):
-                    QTimer.singleShot(0, lambda: self.bubbles_change(atype = "add"))
-            if ev.type() == QEvent.Type.ChildRemoved:
-                QTimer.singleShot(0, lambda: self.bubbles_change(atype = "rem"))
-            return QWidget.event(w, ev)
-        self.chatDisplayWidget.event = _bubbles_change_event.__get__(self.chatDisplayWidget, QWidget)
-
-        self.chatDisplayWidget.setLayout(self.chatDisplay)
-        self.chatDisplayScroll.setWidget(self.chatDisplayWidget)
-        chatWLayout2S.addWidget(self.chatDisplayScroll)
+        self.renderCache = MarkdownRenderCache()
+        self.streamer = StreamingMarkdown(self.renderCache)
+        self.streamTimer = QTimer(self)
+        self.streamTimer.setInterval(33)
+        self.streamTimer.timeout.connect(self.flush_stream)
+        self.chatModel = ChatHistoryModel(self.renderCache, self)
+        self.chatView = QListView()
+        self.chatView.setModel(self.chatModel)
+        self.chatDelegate = ChatBubbleDelegate(self.chatView)
+        self.chatView.setItemDelegate(self.chatDelegate)
+        self.chatView.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.chatView.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.chatView.setResizeMode(QListView.ResizeMode.Adjust)
+        self.chatView.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.chatView.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.chatView.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.chatView.setMouseTracking(True)
+        self.chatDelegate.action_triggered.connect(self.bubble_action)
+        self.chatDelegate.edit_triggered.connect(self.bubble_edit_action)
+        self.chatModel.modelReset.connect(self.chatDelegate.clear_edits)
+        scrollBar = self.chatView.verticalScrollBar()
+        scrollBar.rangeChanged.connect(lambda _min, _max: self.scroll_chat_down() if self._stick_bottom else None)
+        scrollBar.valueChanged.connect(lambda value: setattr(self, "_stick_bottom", value >= scrollBar.maximum() - 2))
+        chatWLayout2S.addWidget(self.chatView)
 
         inputLayout = QHBoxLayout()
         self.chatInput = QLineEdit()
         self.chatInput.returnPressed.connect(self.send_prompt)
         self.chatInput.setPlaceholderText("Type your prompt here...")
+        self.tokenCount = QLabel()
+        self.tokenTimer = QTimer(self)
+        self.tokenTimer.setSingleShot(True)
+        self.tokenTimer.setInterval(150)
+        self.tokenTimer.timeout.connect(self.update_token_count)
+        self.chatInput.textChanged.connect(lambda _text: self.tokenTimer.start())
 
-        sendBtn = QPushButton("Send")
-        sendBtn.clicked.connect(lambda _C: self.send_prompt(prompt_t="input"))
+        self.sendBtn = QPushButton("Send")
+        self.sendBtn.clicked.connect(lambda _C: self.send_prompt(prompt_t="input"))
 
         inputLayout.addWidget(self.chatInput)
-        inputLayout.addWidget(sendBtn)
+        inputLayout.addWidget(self.tokenCount)
+        inputLayout.addWidget(self.sendBtn)
 
         chatWLayout2S.addLayout(inputLayout)
         chatWLayout2.addLayout(chatWLayout2S, 65)
@@ -1067,78 +3602,133 @@ class App(QWidget):
                 self.chatHistory = [{"role": "system", "content": self.LLMSettings['system_prompt']}]
             else:
                 self.chatHistory = history
-            chat = QListWidgetItem(title.strip())
-            number = self.chatList.count()
-            while number in self.chat_ids:
-                number += 1
-            self.chat_ids.append(number)
-            chat.setData(Qt.ItemDataRole.UserRole, f"chat_{number}.json")
-            chat.setFlags(chat.flags() | Qt.ItemFlag.ItemIsEditable)
-            self.chatList.addItem(chat)
-            self.save_chat(chat)
+            try:
+                info = {'id': self.chatStore.create_chat(title.strip(), self.chatHistory), 'title': title.strip()}
+            except sqlite3.Error as e:
+                QMessageBox.critical(self, "Error", f"Failed to create chat: {e}")
+                return
+            chat = self.add_chat_item(info)
             self.chatList.setCurrentItem(chat, QItemSelectionModel.SelectionFlag.ClearAndSelect)
             self.update_chat_display()
             self.save_chat_list()
     
     def load_chat_list(self):
         try:
-            with open("chats/chat_list.json", "r") as f:
-                chats = json.load(f)
-                if chats.get("chats") is None:
-                    self.create_new_chat("Default Chat")
-                    return
-                self.chat_ids.clear()
-                for chat in chats.get("chats", []):
-                    item = QListWidgetItem(chat.get("title", "Untitled Chat"))
-                    item.setData(Qt.ItemDataRole.UserRole, chat.get("filename", ""))
-                    item.setFlags(item.flags() | Qt.ItemFlag.ItemIsEditable)
-                    self.chatList.addItem(item)
-                    self.chat_ids.append(int(chat.get("filename", "").removesuffix(".json").removeprefix("chat_")))
-        except (FileNotFoundError, json.JSONDecodeError):
+            chats = self.chatStore.list_chats()
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Error", f"Failed to load chat list: {e}")
+            return
+        if not chats:
             self.create_new_chat("Default Chat")
+            return
+        for info in chats:
+            self.add_chat_item(info)
+
+    def add_chat_item(self, info):
+        item = QListWidgetItem(info['title'])
+        if self._chat_item_flags is None:
+            self._chat_item_flags = item.flags() | Qt.ItemFlag.ItemIsEditable
+        item.setData(Qt.ItemDataRole.UserRole, info['id'])
+        item.setFlags(self._chat_item_flags)
+        self.chatList.addItem(item)
+        return item
+
+    def sort_chats(self, key, descending=False):
+        try:
+            chats = self.chatStore.list_chats()
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Error", f"Failed to sort chats: {e}")
+            return
+        if key == "title":
+            chats.sort(key=lambda info: info['title'].casefold())
+        elif key == "tokens":
+            chats.sort(key=lambda info: info['input_tokens'] + info['gen_tokens'], reverse=descending)
+        else:
+            chats.sort(key=lambda info: info[key], reverse=descending)
+        current = self.chatList.currentItem()
+        current_id = current.data(Qt.ItemDataRole.UserRole) if current else None
+        self.chatList.blockSignals(True)
+        self.chatList.clear()
+        for info in chats:
+            item = self.add_chat_item(info)
+            if info['id'] == current_id:
+                self.chatList.setCurrentItem(item)
+        self.chatList.blockSignals(False)
+        self.save_chat_list()
 
     def load_chat(self):
         chat = self.chatList.currentItem()
         if chat:
-            if not os.path.exists("chats"):
-                os.makedirs("chats")
-            filename = chat.data(Qt.ItemDataRole.UserRole)
             try:
-                with open("chats/" + filename, "r") as f:
-                    self.chatHistory = json.load(f).get("history", [{"role": "system", "content": "You are a helpful assistant."}])
-            except (FileNotFoundError, json.JSONDecodeError):
+                self.chatHistory = self.chatStore.load_history(chat.data(Qt.ItemDataRole.UserRole))
+            except sqlite3.Error as e:
+                logger.error("Failed to load chat: %s", e)
+                self.chatHistory = []
+            if not self.chatHistory:
                 self.chatHistory = [{"role": "system", "content": "You are a helpful assistant."}]
             self.update_chat_display()
-            QTimer.singleShot(0, lambda: self.chatDisplayScroll.verticalScrollBar().setValue(self.chatDisplayScroll.verticalScrollBar().maximum()))
+            QTimer.singleShot(0, self.scroll_chat_down)
+            self.route_chat_model(self.chatHistory)
     
+    def search_chats(self):
+        self.searchResults.clear()
+        try:
+            results = self.chatStore.search(self.chatSearch.text())
+        except sqlite3.Error as e:
+            logger.error("Chat search failed: %s", e)
+            results = []
+        for result in results:
+            snippet = " ".join(result['snippet'].split())
+            item = QListWidgetItem(f"{result['title']} — {snippet}")
+            item.setToolTip(f"{result['title']} ({result['llm'] or result['role']})\n{snippet}")
+            item.setData(Qt.ItemDataRole.UserRole, (result['chat_id'], result['seq']))
+            self.searchResults.addItem(item)
+        self.searchResults.setVisible(bool(results))
+
+    def open_search_result(self, result):
+        if result is None:
+            return
+        chat_id, seq = result.data(Qt.ItemDataRole.UserRole)
+        for row in range(self.chatList.count()):
+            item = self.chatList.item(row)
+            if item.data(Qt.ItemDataRole.UserRole) == chat_id:
+                self.chatList.setCurrentItem(item, QItemSelectionModel.SelectionFlag.ClearAndSelect)
+                QTimer.singleShot(0, lambda: self.scroll_chat_to(seq))
+                return
+
+    def scroll_chat_to(self, row):
+        if row < self.chatModel.rowCount():
+            self._stick_bottom = False
+            self.chatView.scrollTo(self.chatModel.index(row), QAbstractItemView.ScrollHint.PositionAtCenter)
+
     def save_chat(self, chat = None):
         if chat is None:
             chat = self.chatList.currentItem()
         if chat:
-            if not os.path.exists("chats"):
-                os.makedirs("chats")
-            filename = chat.data(Qt.ItemDataRole.UserRole)
             try:
-                with open("chats/" + filename, "w") as f:
-                    json.dump({"title": chat.text(), "history": self.chatHistory}, f, indent=4)
-            except Exception as e:
+                self.chatStore.save_history(chat.data(Qt.ItemDataRole.UserRole), self.chatHistory)
+            except sqlite3.Error as e:
                 QMessageBox.critical(self, "Error", f"Failed to save chat: {e}")
                 return
     
+    def rename_chat(self, item):
+        try:
+            self.chatStore.rename_chat(item.data(Qt.ItemDataRole.UserRole), item.text())
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Error", f"Failed to rename chat: {e}")
+
     def save_chat_list(self):
-        if not os.path.exists("chats"):
-            os.makedirs("chats")
+        self.chatListTimer.stop()
         chats = []
         for i in range(self.chatList.count()):
             item = self.chatList.item(i)
-            chats.append({"title": item.text(), "filename": item.data(Qt.ItemDataRole.UserRole)})
+            chats.append((item.data(Qt.ItemDataRole.UserRole), item.text()))
         if not chats:
             self.chatHistory = []
             self.update_chat_display()
         try:
-            with open("chats/chat_list.json", "w") as f:
-                json.dump({"chats": chats}, f, indent=4)
-        except Exception as e:
+            self.chatStore.update_chat_list(chats)
+        except sqlite3.Error as e:
             QMessageBox.critical(self, "Error", f"Failed to save chat list: {e}")
             return
         
@@ -1149,12 +3739,15 @@ class App(QWidget):
         
         for chat in selected_items:
             self.chatList.takeItem(self.chatList.row(chat))
-            filename = chat.data(Qt.ItemDataRole.UserRole)
+            chat_id = chat.data(Qt.ItemDataRole.UserRole)
             try:
-                os.remove("chats/" + filename)
+                self.evict_rendered(self.chatStore.load_history(chat_id))
+                self.chatStore.delete_chat(chat_id)
+                self.settingsStore.invalidate(SettingsStore.CHAT, chat_id)
+                self.forget_chat_slots(chat_id)
                 self.save_chat_list()
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to delete chat file: {e}")
+            except sqlite3.Error as e:
+                QMessageBox.critical(self, "Error", f"Failed to delete chat: {e}")
                 return
             
     def settings_chat(self, change = False):
@@ -1171,8 +3764,7 @@ class App(QWidget):
             QMessageBox.information(self, "No Chat Selected", "Please select a chat to edit its settings.")
             return
         chat = selected_chats[0]
-        filename = chat.data(Qt.ItemDataRole.UserRole)
-        self.loadLLMSettings(path=f"chats/{filename}", type=2)
+        self.loadLLMSettings(path=chat.data(Qt.ItemDataRole.UserRole), type=2)
 
     def chat_settings_switcher(self, checked):
         if not checked:
@@ -1214,7 +3806,8 @@ class App(QWidget):
         return self.LLMSettings['system_prompt']
 
     def send_prompt(self, prompt_t="input"):
-        if self._suppress_input:
+        supervisor = self.modelPool.get(self.serverKey)
+        if self._suppress_input or (supervisor is not None and supervisor.state == SERVER_LOADING):
             return
         if prompt_t == "input":
             prompt = self.chatInput.text().strip()
@@ -1223,24 +3816,31 @@ class App(QWidget):
             if self.chatList.count() == 0:
                 self.create_new_chat("Default Chat")
             self.chatHistory.append({"role": "user", "content": prompt})
-            bubble_u = ChatBubble(prompt, "user")
-            self.chatDisplay.addWidget(bubble_u)
+            self._stick_bottom = True
+            self.chatModel.append_message(self.chatHistory[-1])
             self.chatInput.clear()
         if self.modelSelect.currentIndex() >= 0:
             self._suppress_input = True
-            self._suppress_scroll_down = False
+            self._stick_bottom = True
+            self.last_stats = {}
             self.convert_chat_toLegacy()
             QApplication.processEvents()
-            bubble_a = ChatBubble("", "assistant")
-            self.chatDisplay.addWidget(bubble_a)
-            request = {"messages": self.chatLegacyHistory, "max_tokens": -1, "n_predict": -1, "stream": True}
-            self.worker = LLMWorker(request, self.currentAddress)
-            self.worker.token_emit.connect(lambda token: bubble_a.textbox.insertPlainText(token))
+            self.chatModel.append_stream({"role": "assistant", "content": "", "llm": self.modelSelect.currentText()})
+            self.streamer = StreamingMarkdown(self.renderCache)
+            request = {"messages": self.chatLegacyHistory, "max_tokens": -1, "n_predict": -1, "stream": True, "cache_prompt": True}
+            key = self.token_key()
+            slot_options = {'context': ContextBuilder(self.chatLegacyHistory, key, self.contextBudget), 'tokenizer': self.tokenizer}
+            chat = self.chatList.currentItem()
+            if supervisor is not None and chat is not None:
+                request["id_slot"], slot_actions = supervisor.slots.assign(chat.data(Qt.ItemDataRole.UserRole))
+                slot_options.update(slot_actions=slot_actions, slot_cache=supervisor.slots)
+            self.worker = self.backend.submit(request, self.currentAddress, **self.streamOptions, **slot_options)
+            self.worker.token_emit.connect(self.streamer.feed)
+            self.streamTimer.start()
             self.worker.result_ready.connect(self.handle_reply)
             self.worker.error_emit.connect(lambda e: self.error_returned(e))
             self.worker.stats_emit.connect(lambda s: self.connect_stats(s))
-            self.worker.start()
-            self.worker.exec()
+            self.worker.tokens_emit.connect(lambda counted: self.cache_tokens(counted, key))
         else:
             QTest.mouseClick(self.modelSelect, Qt.MouseButton.LeftButton)
             
@@ -1262,142 +3862,121 @@ class App(QWidget):
             return chatLegacy
 
     def handle_reply(self, reply):
-        print(f'Reply: {reply}')
+        logger.debug("Reply: %s", reply)
+        message = {"role": "assistant", "content": reply, "llm": self.modelSelect.currentText(), "stats": self.last_stats}
         if reply.startswith("<think>") and "</think>" in reply:
-            reply = reply.split("</think>")[1]
+            reply = message["content"] = reply.split("</think>")[1]
+        elif self.last_stats.get('gen_t') is not None:
+            message["tokens"] = {self.token_key(): self.last_stats['gen_t']}
         QApplication.processEvents()
-        self.chatHistory.append({"role": "assistant", "content": reply, "llm": self.modelSelect.currentText(), "stats": self.last_stats})
+        self.streamTimer.stop()
+        self.flush_stream()
+        self.streamer.finish(reply)
+        self.chatHistory.append(message)
         self.update_chat_display()
         self._suppress_input = False
     
     def error_returned(self, error):
-        QMessageBox.warning(self, "Error", f"A server error occurred: {error}")
+        self.streamTimer.stop()
+        # the placeholder bubble has no message behind it; the view goes back to the history
+        self.chatModel.reconcile(self.chatHistory)
         self._suppress_input = False
-        self._suppress_scroll_down = True
+        QMessageBox.warning(self, "Error", f"A server error occurred: {error}")
+
+    def flush_stream(self):
+        if self.streamer.flush():
+            self.chatModel.update_stream(self.streamer.text, self.streamer.html())
 
     def update_chat_display(self):
-        self.chatDisplayWidget.setVisible(False)
-        self._suppress_bubble_pop = True
-        self._suppress_scroll_down = False
-        while self.chatDisplay.count():
-            item = self.chatDisplay.takeAt(0)
-            w = item.widget()
-            if w is not None:
-                w.setParent(None)
-                w.deleteLater()
-            
-        QApplication.processEvents()
-        self._suppress_bubble_pop = False
-        for message in self.chatHistory:
-            role = message['role']
-            content = message['content']
-            while content.startswith("\n"):
-                content = content[1:]
-            if role == 'user':
-                bubble = ChatBubble(content, "user")
-                bubble.editBranchBtn.clicked.connect(lambda _checked, b=bubble: self.branch_edit_bubble(bubble=b))
-                bubble.saveBtn.clicked.connect(lambda _checked, b=bubble: self.save_edit_bubble(bubble=b))
-            elif role == 'assistant':
-                content = md_to_html(content, extensions=["extra", "fenced_code", "sane_lists", "nl2br"])
-                bubble = ChatBubble(content, "assistant", llm=message.get('llm', None))
-                stats = message.get('stats', {})
-                stats_html = f'''
-                    <b>Time</b>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Input (ms):</b> {stats.get('input_ms', "Unavailable")}</div>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Generation (ms):</b> {stats.get('gen_ms', "Unavailable")}</div>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Total (ms):</b> {stats.get('total_ms', "Unavailable")}</div>
-                    <b>Tokens</b>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Input:</b> {stats.get('input_t', "Unavailable")}</div>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Generated:</b> {stats.get('gen_t', "Unavailable")}</div>
-                    <div style="display: block; margin: 0 0 0 1em; padding: 0;"><b>Total:</b> {stats.get('total_t', "Unavailable")}</div>
-                    <b>Tokens per second:</b> {stats.get('t_s', "Unavailable")}
-                '''
-                bubble.statsBtn.info = stats_html
-            elif role == 'system':
-                bubble = ChatBubble(content, "system")
-            else:
-                bubble = ChatBubble(content, role)
-            bubble.deleteDownBtn.clicked.connect(lambda _checked, b=bubble: self.delete_down_bubble(bubble=b))
-            bubble.branchBtn.clicked.connect(lambda _checked, b=bubble: self.branch_bubble(bubble=b))
-            self.chatDisplay.addWidget(bubble)
-
-        #if hasattr(self, "chatDisplayWidget"):
-        #    self.chatDisplayWidget.adjustSize()
-        #    self.chatDisplayWidget.update()
-        #if hasattr(self, "chatDisplayScroll"):
-        #    self.chatDisplayScroll.viewport().update()
+        self._stick_bottom = True
+        self.chatModel.reconcile(self.chatHistory)
         self.save_chat()
-        self.chatDisplayWidget.setVisible(True)
-        QApplication.processEvents()
-        self._suppress_scroll_down = True
 
-    def bubbles_change(self, atype):
-        vlast = None
-        count = self.chatDisplay.count()
-        if count == 0:
+    def scroll_chat_down(self):
+        scrollBar = self.chatView.verticalScrollBar()
+        scrollBar.setValue(scrollBar.maximum())
+        self._stick_bottom = True
+
+    def bubble_action(self, action, row):
+        if self._suppress_input or row >= len(self.chatHistory):
             return
-        last = self.chatDisplay.itemAt(count-1).widget()
-        if count > 1:
-            vlast = self.chatDisplay.itemAt(count-2).widget()
-        try:
-            if atype == "add":
-                if vlast is not None:
-                    vlast.deleteBtn.setVisible(False)
-                    vlast.generateBtn.setVisible(False)
-                    vlast.deleteDownBtn.setVisible(True)
-                last.deleteBtn.setVisible(True)
-                last.deleteDownBtn.setVisible(False)
-                if last.speaker == 'User':
-                    last.generateBtn.setVisible(True)
-                    last.generateBtn.clicked.connect(lambda _c: self.send_prompt(prompt_t="manual"))
-            elif atype == "rem":
-                last.deleteBtn.setVisible(True)
-                last.deleteDownBtn.setVisible(False)
-                if last.speaker == 'User':
-                    last.generateBtn.setVisible(True)
-                    last.generateBtn.clicked.connect(lambda _c: self.send_prompt(prompt_t="manual"))
-                if not self._suppress_bubble_pop:
-                    self.chatHistory.pop()
-        except:
-            pass
+        if action == "copy":
+            QApplication.clipboard().setText(self.chatModel.plain_text(row))
+        elif action == "edit":
+            self.chatDelegate.begin_edit(row)
+            self.chatView.openPersistentEditor(self.chatModel.index(row))
+        elif action == "branch":
+            self.branch_bubble(row)
+        elif action == "delete":
+            self.evict_rendered(self.chatHistory[row:])
+            del self.chatHistory[row:]
+            self.chatModel.remove_from(row)
+            self.save_chat()
+        elif action == "delete_down":
+            self.delete_down_bubble(row)
+        elif action == "regenerate":
+            self.send_prompt(prompt_t="manual")
+
+    def bubble_edit_action(self, action, row, text):
+        if action == "save" and text:
+            self.save_edit_bubble(row, text)
+        elif action == "branch" and text:
+            self.branch_edit_bubble(row, text)
+        else:
+            self.close_bubble_editor(row)
+
+    def close_bubble_editor(self, row):
+        self.chatView.closePersistentEditor(self.chatModel.index(row))
+        self.chatDelegate.end_edit(row)
 
     def connect_stats(self, stats_d):
         self.last_stats = {'input_ms': round(stats_d['timings']['prompt_ms'], 2), 'gen_ms': round(stats_d['timings']['predicted_ms'], 2),
                            'total_ms': round(stats_d['timings']['prompt_ms'] + stats_d['timings']['predicted_ms'], 2),
                            'input_t': stats_d['usage']['prompt_tokens'], 'gen_t': stats_d['usage']['completion_tokens'],
                            'total_t': stats_d['usage']['total_tokens'], 't_s': round(stats_d['timings']['predicted_per_second'], 2)}
+        if stats_d['timings'].get('cache_n') is not None:
+            self.last_stats['cached_t'] = stats_d['timings']['cache_n']
+        self.last_stats.update({key: value for key, value in stats_d.get('slot', {}).items() if value is not None})
         
-    def delete_down_bubble(self, bubble):
-        index = self.chatDisplay.indexOf(bubble)
-        if index >= 0:
-            for i in range(self.chatDisplay.count()-1, index, -1):
-                item = self.chatDisplay.takeAt(i)
-                w = item.widget()
-                if w is not None:
-                    w.setParent(None)
-                    w.deleteLater()
-
-    def branch_bubble(self, bubble):
-        index = self.chatDisplay.indexOf(bubble)
-        history = []
-        if index >= 0:
-            history = copy.deepcopy(self.chatHistory[:index+1])
+    def forget_chat_slots(self, chat_id):
+        for supervisor in self.modelPool.servers.values():
+            supervisor.slots.forget(chat_id)
+        for path in glob.glob(os.path.join("models", "slots", "*", f"chat_{chat_id}.bin")):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not remove %s: %s", path, e)
+
+    def delete_down_bubble(self, row):
+        if 0 <= row < len(self.chatHistory):
+            self.evict_rendered(self.chatHistory[row+1:])
+            del self.chatHistory[row+1:]
+            self.chatModel.remove_from(row+1)
+            self.save_chat()
+
+    def evict_rendered(self, messages):
+        for message in messages:
+            if message['role'] == 'assistant':
+                self.renderCache.discard(message['content'].lstrip("\n"))
+
+    def branch_bubble(self, row):
+        if 0 <= row < len(self.chatHistory):
+            history = copy.deepcopy(self.chatHistory[:row+1])
             self.create_new_chat(title=self.chatList.currentItem().text()+" - Branch", history=history)
 
-    def branch_edit_bubble(self, bubble):
-        index = self.chatDisplay.indexOf(bubble)
-        history = []
-        if index >= 0:
-            history = copy.deepcopy(self.chatHistory[:index+1])
-            history[-1]['content'] = bubble.editbox.toPlainText().strip()
+    def branch_edit_bubble(self, row, text):
+        if 0 <= row < len(self.chatHistory):
+            self.close_bubble_editor(row)
+            history = copy.deepcopy(self.chatHistory[:row+1])
+            history[-1]['content'] = text
+            history[-1].pop('tokens', None)
             self.create_new_chat(title=self.chatList.currentItem().text()+" - Edit Branch", history=history)
 
-    def save_edit_bubble(self, bubble):
-        self.delete_down_bubble(bubble)
-        QApplication.processEvents()
-        self.chatHistory[-1]['content'] = bubble.editbox.toPlainText().strip()
-        bubble.text = bubble.editbox.toPlainText().strip()
-        bubble.layout().setCurrentIndex(0)
+    def save_edit_bubble(self, row, text):
+        self.close_bubble_editor(row)
+        self.delete_down_bubble(row)
+        self.chatHistory[-1]['content'] = text
+        self.chatHistory[-1].pop('tokens', None)
         self.update_chat_display()
 
     def export_chat_json(self):
@@ -1407,11 +3986,9 @@ class App(QWidget):
             return
         chat = selected_chats[0]
         chat_data = {}
-        filename = chat.data(Qt.ItemDataRole.UserRole)
         try:
-            with open("chats/" + filename, "r") as f:
-                chat_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            chat_data = {"title": chat.text(), "history": self.chatStore.load_history(chat.data(Qt.ItemDataRole.UserRole))}
+        except sqlite3.Error:
             QMessageBox.critical(self, "Error", "Failed to load the selected chat.")
             return
         chat_data_legacy = self.convert_chat_toLegacy(chat_data['history'])
@@ -1441,11 +4018,15 @@ class App(QWidget):
         buttonsSec = QHBoxLayout()
         addModelBtn = QPushButton("Add Model")
         addModelBtn.clicked.connect(self.add_model)
+        scanModelsBtn = QPushButton("Scan Folder")
+        scanModelsBtn.setToolTip("Add every GGUF model found in a folder and its subfolders")
+        scanModelsBtn.clicked.connect(self.scan_models)
         removeModelBtn = QPushButton("Remove Model")
         removeModelBtn.clicked.connect(self.remove_model)
         settingsModelBtn = QPushButton("Model Settings")
         settingsModelBtn.clicked.connect(self.settings_model)
         buttonsSec.addWidget(addModelBtn)
+        buttonsSec.addWidget(scanModelsBtn)
         buttonsSec.addWidget(removeModelBtn)
         buttonsSec.addWidget(settingsModelBtn)
         layout.addLayout(buttonsSec)
@@ -1463,8 +4044,14 @@ class App(QWidget):
         modelsLayout = QHBoxLayout()
 
         self.modelsTable = QTableWidget()
-        self.modelsTable.setColumnCount(5)
-        self.modelsTable.setHorizontalHeaderLabels(["Path", "Name", "Parameters","Weights", "Layers"])
+        self.modelsTable.setColumnCount(6)
+        self.modelsTable.setHorizontalHeaderLabels(["Path", "Name", "Parameters","Weights", "Layers", "Memory (est.)"])
+        self._estimating = set()
+        self._estimate_failed = {}     # path -> stamp of a file whose metadata could not be read
+        self.estimateTimer = QTimer(self)
+        self.estimateTimer.setSingleShot(True)
+        self.estimateTimer.setInterval(150)
+        self.estimateTimer.timeout.connect(self.update_model_estimates)
         self.modelsTable.horizontalHeader().setStretchLastSection(True)
         self.modelsTable.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.modelsTable.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
@@ -1506,7 +4093,7 @@ class App(QWidget):
         file_dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
         if file_dialog.exec():
             file_path = file_dialog.selectedFiles()[0]
-            ggufRead = GGUFInfoWoker(file_path)
+            ggufRead = GGUFInfoWoker(file_path, self.ggufCache)
             ggufRead.info_ready.connect(self.add_model_postworker)
             ggufRead.start()
             ggufRead.exec()
@@ -1528,6 +4115,32 @@ class App(QWidget):
 
         self.refresh_models_table()
 
+    def scan_models(self, folder=None):
+        if not folder:
+            folder = QFileDialog.getExistingDirectory(self, "Scan Folder for Models")
+        if not folder:
+            return
+        known = {model.get("path") for model in self.models}
+        paths = [path for path in find_gguf_models(folder) if path not in known]
+        if not paths:
+            QMessageBox.information(self, "Scan Folder", "No new GGUF models found.")
+            return
+        progress = self.scanProgress = QProgressDialog("Reading model metadata…", "Cancel", 0, len(paths), self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        # parented like the estimate scans: a cancelled scan may still be winding down when the next one starts
+        self.scanWorker = GGUFScanWorker(paths, self.ggufCache, parent=self)
+        self.scanWorker.progress.connect(lambda done, total: progress.setValue(done))
+        self.scanWorker.scan_ready.connect(self.scan_models_postworker)
+        self.scanWorker.finished.connect(self.scanWorker.deleteLater)
+        progress.canceled.connect(self.scanWorker.stop)
+        self.scanWorker.start()
+
+    def scan_models_postworker(self, infos):
+        self.scanProgress.reset()
+        known = {model.get("path") for model in self.models}
+        self.models.extend(info for info in infos if info["path"] not in known)
+        self.refresh_models_table()
+
     def remove_model(self):
         selected_rows = self.modelsTable.selectionModel().selectedRows()
         if not selected_rows:
@@ -1583,8 +4196,7 @@ class App(QWidget):
         if not os.path.exists("models"):
             os.makedirs("models")
         if not self.models:
-            with open("models/models.json", "w") as f:
-                json.dump({"models": []}, f, indent=4)
+            write_json_atomic("models/models.json", {"models": []}, indent=4)
             return
         for model in self.models:
             row = self.modelsTable.rowCount()
@@ -1596,8 +4208,100 @@ class App(QWidget):
             self.modelsTable.setItem(row, 4, QTableWidgetItem(str(model.get("layers", ""))))
 
             self.modelSelect.addItem(model.get("name", "Unknown") + " (" + model.get("weights", "Unknown") + ")", {"row": str(row), "path": model.get("path", "")})
-        with open("models/models.json", "w") as f:
-            json.dump({"models": self.models}, f, indent=4)
+        write_json_atomic("models/models.json", {"models": self.models}, indent=4)
+        self.update_model_estimates()
+
+    def auto_gpu_layers(self, model, settings):
+        # "Auto": as many layers as the estimate fits into the memory budget; without a budget it stays "All",
+        # and while the metadata is not read yet nothing goes to the GPU rather than risk overrunning the budget
+        budget = int(settings.get('memory_budget') or 0) * 1024 * 1024
+        if budget <= 0:
+            return int(model['layers']) + 1
+        metadata = self.cached_metadata(model.get("path", ""))
+        if metadata is None:
+            logger.warning("No memory estimate for %s yet, Auto keeps it on the CPU", model.get("path", ""))
+            return 0
+        gpu_layers = fit_gpu_layers(metadata, budget, int(settings.get('ctx_size') or 0), int(settings.get('batch_size') or 512))
+        logger.info("Auto: %d of %d layers fit in %d MiB", gpu_layers, len(metadata["GGUF.layer_bytes"]) + 1, budget // (1024 * 1024))
+        return gpu_layers
+
+    def update_model_estimates(self):
+        # the estimate uses profile + model settings (a chat may still override them when the model is loaded);
+        # models without cached metadata get it read in the background
+        profile = self.profileSelect.currentData()
+        missing = []
+        for row, model in enumerate(self.models[:self.modelsTable.rowCount()]):
+            path = model.get("path", "")
+            try:
+                metadata = self.ggufCache.get(path)
+            except OSError:
+                self.modelsTable.setItem(row, 5, QTableWidgetItem("File missing"))
+                continue
+            if metadata is None:
+                try:
+                    failed = self._estimate_failed.get(path) == self.ggufCache.stamp(path)
+                except OSError:
+                    failed = False
+                if failed:
+                    self.modelsTable.setItem(row, 5, QTableWidgetItem("Unreadable"))
+                    continue
+                missing.append(path)
+                self.modelsTable.setItem(row, 5, QTableWidgetItem("…"))
+                continue
+            settings = self.settingsStore.resolve(model=path, profile=f"settings/{profile}" if profile else None)
+            blocks = len(metadata.get("GGUF.layer_bytes", []))
+            gpu_layers = settings.get('gpu_layers', "All")
+            if gpu_layers == "Auto":
+                gpu_layers = self.auto_gpu_layers(model, settings)
+            elif gpu_layers in ("All", "-1"):
+                gpu_layers = blocks + 1
+            estimate = estimate_memory(metadata, int(gpu_layers), int(settings.get('ctx_size') or 0), int(settings.get('batch_size') or 512))
+            item = QTableWidgetItem(f"VRAM {format_bytes(estimate['vram'])}, RAM {format_bytes(estimate['ram'])}")
+            item.setToolTip(f"{estimate['gpu_layers']} of {blocks + 1} layers on GPU, context {estimate['ctx_size']}")
+            self.modelsTable.setItem(row, 5, item)
+        self.read_metadata_later(missing)
+
+    def read_metadata_later(self, paths):
+        # GGUF headers are parsed off the GUI thread; model_estimates_ready picks the results up
+        missing = [path for path in paths if path not in self._estimating]
+        if missing:
+            # parented, so a newer scan never drops the last reference to one that is still running
+            self._estimating.update(missing)
+            worker = GGUFScanWorker(missing, self.ggufCache, processes=False, parent=self)
+            worker.scan_ready.connect(self.model_estimates_ready)
+            worker.finished.connect(worker.deleteLater)
+            worker.start()
+
+    def cached_metadata(self, path):
+        # the GUI thread only looks metadata up; a miss returns None and is read in the background, unless the file
+        # already failed to read in its current state
+        try:
+            stamp = self.ggufCache.stamp(path)
+        except OSError:
+            return None
+        metadata = self.ggufCache.get(path, stamp)
+        if metadata is None and self._estimate_failed.get(path) != stamp:
+            self.read_metadata_later([path])
+        return metadata
+
+    def model_estimates_ready(self, infos):
+        # a file that failed is retried only once it changes on disk; a bound slot, so a reply that
+        # is still queued when the window goes away is dropped with it
+        read = {info["path"] for info in infos}
+        for path in self.sender().paths:
+            self._estimating.discard(path)
+            if path in read:
+                self._estimate_failed.pop(path, None)
+                continue
+            try:
+                self._estimate_failed[path] = self.ggufCache.stamp(path)
+            except OSError:
+                self._estimate_failed.pop(path, None)
+        if self.serverKey in read and self.budgetOptions is not None:
+            # the loaded model was started before its metadata was read; its context size comes from it
+            self.contextBudget = self.context_budget(*self.budgetOptions)
+            self.update_token_count()
+        self.update_model_estimates()
 
     def initLLMSettings(self):
         widget = QWidget()
@@ -1686,10 +4390,11 @@ class App(QWidget):
             self.LLMSettings[item['name']] = item['value']
         else:
             data = item.data(Qt.ItemDataRole.UserRole)
-            if data:
-                self.LLMSettings[data['name']] = item.text()
-                path = data['path']
-                type = data['type']
+            if not data:
+                return
+            self.LLMSettings[data['name']] = item.text()
+            path = data['path']
+            type = data['type']
         self.saveLLMSettings(path=path, type=type)
 
 
@@ -1733,8 +4438,7 @@ class App(QWidget):
             self.create_new_settings("Default Settings")
             return
         try:
-            with open("settings/settings_list.json", "w") as f:
-                json.dump({"settings": settings}, f, indent=4)
+            write_json_atomic("settings/settings_list.json", {"settings": settings}, indent=4)
         except Exception as e:
             print(f"Error saving settings list: {e}")
 
@@ -1745,38 +4449,19 @@ class App(QWidget):
             self.chatSettingsTable.setRowCount(0)
         if type == 0 and self.llmSettingsList.currentItem() is None:
             return
+        if type == 0 and path is None:
+            filename = self.llmSettingsList.currentItem().data(Qt.ItemDataRole.UserRole)
+            path = f"settings/{filename}"
+        if type == -1:
+            self.LLMSettings = dict(self.settingsStore.load(0, "settings/settings_llm_default.json"))
+            return
         try:
-            if type == 0 and path is None:
-                filename = self.llmSettingsList.currentItem().data(Qt.ItemDataRole.UserRole)
-                path = f"settings/{filename}"
-            if type == -1:
-                path = f"settings/settings_llm_default.json"
-            if type == 1:
-                path = path[:-5]
-                path = f"{path}.json"
-            if type == 2:
-                if not path.endswith("_settings.json"):
-                    path = path[:-5]
-                    path = f"{path}_settings.json"
-            with open(f"{path}", "r") as f:
-                settings_json = json.load(f)
-                self.LLMSettings = settings_json.get('settings', {})
-                for setting in self.bpSettings:
-                    if setting['name'] not in self.LLMSettings and type in setting['use_case']:
-                        self.LLMSettings[setting['name']] = setting['default']
-                        self.saveLLMSettings(path=path, type=type)
-        except Exception as e:
+            self.LLMSettings = self.settingsStore.load(type, path)
+        except sqlite3.Error as e:
+            logger.error("Failed to load settings: %s", e)
             self.LLMSettings = {}
-        
-        if not self.LLMSettings:
-            for setting in self.bpSettings:
-                if type in setting['use_case']:
-                    self.LLMSettings[setting['name']] = setting['default']
-            if type == -1:
-                return
-            self.saveLLMSettings(path=path, type=type)
 
-        if type == -1 or display == 0:
+        if display == 0:
             return
 
         target = None
@@ -1800,9 +4485,10 @@ class App(QWidget):
                     value.setData(Qt.ItemDataRole.UserRole, {"row": row, "name": setting['name'], "path": path, "type": type})
                 elif setting['type'] == 'number':
                     value = QLineEdit()
-                    value.setValidator(QIntValidator(1024, 65535, value))
+                    value.setValidator(QIntValidator(setting.get('min', 1024), setting.get('max', 65535), value))
                     value.setText(str(self.LLMSettings[setting['name']]))
                     value.textChanged.connect(lambda text, name=setting['name']: self.llm_setting_changed({'value': text, "name": name}, native=False, path=path, type=type))
+                    value.editingFinished.connect(self.settingsStore.flush)
                 elif setting['type'] == 'slider':
                     value = QFrame()
                     value_layout = QVBoxLayout()
@@ -1822,9 +4508,10 @@ class App(QWidget):
                     value_layout.addWidget(slider)
                     curr_label = QLabel(self.LLMSettings[setting['name']])
                     slider.valueChanged.connect(lambda curr_value, slider_el = slider, label=curr_label: self.update_slider(slider_el,label, curr_value, path=path, type=type))
+                    slider.sliderReleased.connect(self.settingsStore.flush)
                     value_layout.addWidget(curr_label)
                     value.setLayout(value_layout)
-                    self.update_slider(slider, curr_label, slider.value())
+                    self.update_slider(slider, curr_label, slider.value(), path=path, type=type)
                     value.adjustSize()
                 elif setting['type'] == 'combo':
                     value = QComboBox()
@@ -1865,18 +4552,12 @@ class App(QWidget):
         if type == 0 and path is None:
             filename = self.llmSettingsList.currentItem().data(Qt.ItemDataRole.UserRole)
             path = f"settings/{filename}"
-        if type == 1:
-            path = path[:-5]
-            path = f"{path}.json"
-        if type == 2:
-            if not path.endswith("_settings.json"):
-                path = path[:-5]
-                path = f"{path}_settings.json"
         try:
-            with open(f"{path}", "w") as f:
-                json.dump({"settings": self.LLMSettings, "type": type}, f, indent=4)
+            self.settingsStore.save(type, path, self.LLMSettings)
         except Exception as e:
             print(f"Error saving LLM settings: {e}")
+        if type in (0, 1):
+            self.estimateTimer.start()
 
     def removeLLMSettings(self):
         selected_items = self.llmSettingsList.selectedItems()
@@ -1888,7 +4569,7 @@ class App(QWidget):
             self.profileSelect.removeItem(self.profileSelect.findData(settings.data(Qt.ItemDataRole.UserRole)))
             filename = settings.data(Qt.ItemDataRole.UserRole)
             try:
-                os.remove("settings/" + filename)
+                self.settingsStore.remove(SettingsStore.PROFILE, "settings/" + filename)
                 self.save_settings_list()
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to delete settings file: {e}")
@@ -1908,8 +4589,9 @@ class App(QWidget):
 
         label.setContentsMargins(x_offset, 0, 0, 0)
 
-        self.LLMSettings[slider.whatsThis()] = str(value)
-        self.saveLLMSettings(path=path, type=type)
+        if self.LLMSettings.get(slider.whatsThis()) != str(value):
+            self.LLMSettings[slider.whatsThis()] = str(value)
+            self.saveLLMSettings(path=path, type=type)
 
 if __name__ == "__main__":
 	app = QApplication(sys.argv)
@@ -0,0 +1,53 @@
+import os
+import shutil
+import socket
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+@pytest.fixture(scope="session")
+def qapp():
+    from main import QApplication
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def window(qapp, tmp_path, monkeypatch):
+    # the app keeps chats, settings and caches in the working directory
+    from main import App, QEvent
+    shutil.copy(os.path.join(ROOT, "FiraCodeNerdFont-Regular.ttf"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    # the CPU threads slider spans 1..cpu_count and cannot be laid out on a single-CPU machine
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    app = App()
+    yield app
+    # deleted now rather than at interpreter exit, where Qt and Python tear down in no particular order
+    app.close()
+    app.deleteLater()
+    qapp.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+
+def wait_until(qapp, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not met")
+        qapp.processEvents()
+        time.sleep(0.01)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def stub_binary(tmp_path):
+    # llama-server is started by path; a wrapper runs the stub with this interpreter
+    path = tmp_path / "llama-server"
+    path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(os.path.dirname(os.path.abspath(__file__)), "llama_server_stub.py")}" "$@"\n')
+    path.chmod(0o755)
+    return str(path)
@@ -0,0 +1,123 @@
+# synthetic GGUF files: the header of a llama-shaped model (tensor infos without tensor data) and small tokenizers
+import re
+from collections import Counter
+
+import numpy as np
+from gguf import GGUFWriter, GGMLQuantizationType, TokenType
+from gguf.constants import GGML_QUANT_SIZES
+
+def write_model(path, blocks=4, embd=256, ff=512, heads=8, kv_heads=2, vocab=1000, ctx=8192):
+    # returns the bytes of each block, of the input embedding and of the output head
+    writer = GGUFWriter(path, "llama")
+    writer.add_name("Synthetic")
+    writer.add_block_count(blocks)
+    writer.add_context_length(ctx)
+    writer.add_embedding_length(embd)
+    writer.add_head_count(heads)
+    writer.add_head_count_kv(kv_heads)
+    writer.add_file_type(15)
+    writer.add_token_list([f"t{i}" for i in range(vocab)])
+    def tensor(name, shape, quant):
+        block_size, type_size = GGML_QUANT_SIZES[quant]
+        size = int(np.prod(shape)) // block_size * type_size
+        if quant == GGMLQuantizationType.F32:
+            writer.add_tensor_info(name, shape, np.dtype(np.float32), size, raw_dtype=quant)
+        else:
+            writer.add_tensor_info(name, tuple(shape[:-1]) + (shape[-1] // block_size * type_size,), np.dtype(np.uint8), size, raw_dtype=quant)
+        return size
+    q4, q6, f32 = GGMLQuantizationType.Q4_K, GGMLQuantizationType.Q6_K, GGMLQuantizationType.F32
+    sizes = {"input": tensor("token_embd.weight", (vocab, embd), q4), "layers": []}
+    kv = embd // heads * kv_heads
+    for block in range(blocks):
+        sizes["layers"].append(sum(tensor(f"blk.{block}.{name}.weight", shape, quant) for name, shape, quant in [
+            ("attn_norm", (embd,), f32), ("attn_q", (embd, embd), q4), ("attn_k", (kv, embd), q4), ("attn_v", (kv, embd), q6),
+            ("attn_output", (embd, embd), q4), ("ffn_norm", (embd,), f32), ("ffn_gate", (ff, embd), q4),
+            ("ffn_up", (ff, embd), q4), ("ffn_down", (embd, ff), q6)]))
+    sizes["output"] = tensor("output_norm.weight", (embd,), f32) + tensor("output.weight", (vocab, embd), q6)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    writer.close()
+    return sizes
+
+CORPUS = """The quick brown fox jumps over the lazy dog. It's a well-known pangram; we'll use it, they've said, and I'm sure you'd agree.
+Tokenizers split text into pieces: words, numbers like 12345 or 3.14159, punctuation!!! and    spaces.
+def count_tokens(text: str) -> int:
+    return len(tokenizer.encode(text))  # comment with_underscores
+Ünïcödé text: café, naïve, Straße, Ωμέγα, Привет мир. 日本語のテキスト。 Emoji 🙂🚀 too.
+Numbers 2024-10-17, 1,000,000 and 0x1F. URLs https://example.com/path?query=1&b=2.
+Line one
+Line two\r\nWindows line\n\n\tTabbed line
+""" * 3 + " ".join(f"word{i} token{i * 7} the and of to in is for on that with as by" for i in range(200))
+
+BPE_SPECIALS = ["<|begin_of_text|>", "<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"]
+
+def train_merges(words, count):
+    # most frequent adjacent pair first, like BPE training
+    words = Counter(tuple(word) for word in words)
+    merges = []
+    for _ in range(count):
+        pairs = Counter()
+        for word, n in words.items():
+            for pair in zip(word, word[1:]):
+                pairs[pair] += n
+        if not pairs:
+            break
+        (a, b), _n = pairs.most_common(1)[0]
+        merges.append((a, b))
+        merged = Counter()
+        for word, n in words.items():
+            out = []
+            i = 0
+            while i < len(word):
+                if i + 1 < len(word) and word[i] == a and word[i + 1] == b:
+                    out.append(a + b)
+                    i += 2
+                else:
+                    out.append(word[i])
+                    i += 1
+            merged[tuple(out)] += n
+        words = merged
+    return merges
+
+def write_vocab(path, model, tokens, types, **fields):
+    writer = GGUFWriter(path, "llama")
+    writer.add_context_length(4096)
+    writer.add_block_count(1)
+    writer.add_tokenizer_model(model)
+    writer.add_token_list(tokens)
+    writer.add_token_types(types)
+    if "pre" in fields:
+        writer.add_tokenizer_pre(fields["pre"])
+    if "merges" in fields:
+        writer.add_token_merges(fields["merges"])
+    if "scores" in fields:
+        writer.add_token_scores(fields["scores"])
+    if "add_space_prefix" in fields:
+        writer.add_add_space_prefix(fields["add_space_prefix"])
+    writer.add_tensor("blk.0.w", np.zeros((4, 4), dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+def write_bpe_vocab(path, pre="llama-bpe", merges=500):
+    # byte-level BPE ("gpt2") trained on CORPUS, with control tokens
+    from reference_tokenizer import bytes_to_unicode
+    byte_chars = bytes_to_unicode()
+    words = ["".join(byte_chars[byte] for byte in word.encode()) for word in re.findall(r"\S+|\s+", CORPUS)]
+    pairs = train_merges(words, merges)
+    tokens = list(dict.fromkeys([byte_chars[byte] for byte in range(256)] + [a + b for a, b in pairs]))
+    types = [TokenType.NORMAL] * len(tokens) + [TokenType.CONTROL] * len(BPE_SPECIALS)
+    write_vocab(path, "gpt2", tokens + BPE_SPECIALS, types, pre=pre, merges=[f"{a} {b}" for a, b in pairs])
+
+def write_spm_vocab(path, merges=600):
+    # sentencepiece ("llama") with <0xXX> byte tokens; CJK and emoji are left out so they fall back to bytes
+    text = CORPUS.replace(" ", "▁")
+    chars = sorted({char for char in text if ord(char) < 0x3000})
+    pieces = [a + b for a, b in train_merges(re.findall(r"▁?[^▁]+|▁+", text), merges)]
+    pieces = [piece for piece in dict.fromkeys(pieces) if piece not in chars]
+    tokens = ["<unk>", "<s>", "</s>"] + [f"<0x{byte:02X}>" for byte in range(256)] + chars + pieces
+    types = [TokenType.UNKNOWN, TokenType.CONTROL, TokenType.CONTROL] + [TokenType.BYTE] * 256 + [TokenType.NORMAL] * (len(chars) + len(pieces))
+    scores = [0.0] * 259 + [-1000.0 - i for i in range(len(chars))] + [-float(i) for i in range(len(pieces))]
+    write_vocab(path, "llama", tokens, types, scores=scores, add_space_prefix=True)
@@ -0,0 +1,95 @@
+# stand-in for llama-server: takes its command line, answers /health with 503 while "loading" for STUB_LOAD
+# seconds, prints llama.cpp-style load output and streams a short reply from /v1/chat/completions.
+# /tokenize uses the reference tokenizer on the vocabulary of the -m model.
+# STUB_FAIL exits at once, STUB_IGNORE_INT ignores SIGINT, STUB_LOG appends every command line to a file.
+# STUB_CHAT=status answers chats with a 400, STUB_CHAT=error breaks off the stream with an error event
+import json
+import os
+import signal
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reference_tokenizer import ReferenceTokenizer
+
+LOAD_LOG = """llama_model_load_from_file_impl: using device CUDA0 (NVIDIA GeForce RTX 3090) - 23851 MiB free
+print_info: model size       = 4.58 GiB (4.89 BPW)
+load_tensors: offloading 32 repeating layers to GPU
+load_tensors: offloaded 33/33 layers to GPU
+load_tensors:        CUDA0 model buffer size =  4403.49 MiB
+load_tensors:   CPU_Mapped model buffer size =   281.81 MiB
+llama_context: n_ctx         = 4096
+llama_kv_cache_unified:      CUDA0 KV buffer size =   512.00 MiB
+llama_context:      CUDA0 compute buffer size =   296.00 MiB"""
+
+def option(name, default=None):
+    args = sys.argv[1:]
+    return args[args.index(name) + 1] if name in args else default
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    started = time.monotonic()
+    load = float(os.environ.get("STUB_LOAD", "0.5"))
+    tokenizer = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chunk(self, data, field=b"data"):
+        event = field + b": " + (data if isinstance(data, bytes) else json.dumps(data).encode()) + b"\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+
+    def do_GET(self):
+        if time.monotonic() - self.started < self.load:
+            return self.reply(503, {"error": {"code": 503, "message": "Loading model"}})
+        self.reply(200, {"status": "ok"})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/tokenize":
+            # like llama-server: no BOS, special tokens are parsed
+            if Handler.tokenizer is None:
+                Handler.tokenizer = ReferenceTokenizer(option("-m"))
+            return self.reply(200, {"tokens": Handler.tokenizer.encode(request["content"])})
+        if self.path != "/v1/chat/completions":
+            return self.reply(404, {"error": {"code": 404, "message": "File Not Found"}})
+        chat = os.environ.get("STUB_CHAT")
+        if chat == "status":
+            return self.reply(400, {"error": {"code": 400, "message": "the request exceeds the available context size", "type": "exceed_context_size_error"}})
+        words = " ".join(message["content"] for message in request.get("messages", [])).split()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in ("Hello", " from", " the", " stub."):
+            self.chunk({"choices": [{"index": 0, "delta": {"content": token}}]})
+            if chat == "error" and token == " from":
+                # llama-server reports a failure inside a stream on an "error:" line, not as a data event
+                self.chunk({"code": 500, "message": "slot unavailable", "type": "server_error"}, field=b"error")
+                self.wfile.write(b"0\r\n\r\n")
+                return
+        self.chunk({"choices": [], "usage": {"prompt_tokens": len(words), "completion_tokens": 4, "total_tokens": len(words) + 4},
+                    "timings": {"prompt_n": len(words), "prompt_ms": 1.0, "predicted_n": 4, "predicted_ms": 2.0, "predicted_per_second": 2000.0}})
+        self.chunk(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+if __name__ == "__main__":
+    if os.environ.get("STUB_LOG"):
+        with open(os.environ["STUB_LOG"], "a") as f:
+            f.write(" ".join(sys.argv[1:]) + "\n")
+    if os.environ.get("STUB_FAIL"):
+        print("error: failed to load model", flush=True)
+        sys.exit(3)
+    if os.environ.get("STUB_IGNORE_INT"):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print(LOAD_LOG, flush=True)
+    ThreadingHTTPServer(("127.0.0.1", int(option("--port"))), Handler).serve_forever()
@@ -0,0 +1,137 @@
+# slow, independent tokenizer for checking GGUFTokenizer: reads the vocabulary with gguf.GGUFReader,
+# splits special tokens like llama.cpp's tokenizer_st_partition, pre-tokenizes with exact \p{L}/\p{N}
+# classes built from unicodedata, merges BPE like openai's encoder.py and SPM by rescanning all pairs
+import functools
+import re
+import sys
+import unicodedata
+
+from gguf import GGUFReader
+
+def field(reader, key, default=None):
+    found = reader.fields.get(key)
+    return default if found is None else found.contents()
+
+@functools.lru_cache(maxsize=None)
+def unicode_class(prefix):
+    ranges = []
+    start = None
+    for cp in range(sys.maxunicode + 2):
+        inside = cp <= sys.maxunicode and unicodedata.category(chr(cp)).startswith(prefix)
+        if inside and start is None:
+            start = cp
+        elif not inside and start is not None:
+            ranges.append(re.escape(chr(start)) + ("-" + re.escape(chr(cp - 1)) if cp - 1 > start else ""))
+            start = None
+    return "".join(ranges)
+
+def pretokenizer(pre):
+    letters, numbers = unicode_class("L"), unicode_class("N")
+    if pre in ("llama-bpe", "llama3"):
+        return rf"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n{letters}{numbers}]?[{letters}]+|[{numbers}]{{1,3}}| ?[^\s{letters}{numbers}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+    return rf"'s|'t|'re|'ve|'m|'ll|'d| ?[{letters}]+| ?[{numbers}]+| ?[^\s{letters}{numbers}]+|\s+(?!\S)|\s+"
+
+def bytes_to_unicode():
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    codes = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            codes.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, map(chr, codes)))
+
+class ReferenceTokenizer:
+    def __init__(self, path):
+        reader = GGUFReader(path)
+        self.model = field(reader, "tokenizer.ggml.model")
+        tokens = field(reader, "tokenizer.ggml.tokens")
+        self.vocab = {token: id for id, token in enumerate(tokens)}
+        types = field(reader, "tokenizer.ggml.token_type")
+        self.specials = sorted((token for token, kind in zip(tokens, types) if kind in (2, 3, 4)), key=len, reverse=True)
+        if self.model == "gpt2":
+            self.pre = field(reader, "tokenizer.ggml.pre", "default")
+            self.pattern = re.compile(pretokenizer(self.pre))
+            self.ranks = {tuple(merge.split(" ")): rank for rank, merge in enumerate(field(reader, "tokenizer.ggml.merges"))}
+            self.byte_chars = bytes_to_unicode()
+        else:
+            self.scores = field(reader, "tokenizer.ggml.scores")
+            self.space = field(reader, "tokenizer.ggml.add_space_prefix", True)
+
+    def fragments(self, text):
+        fragments = [text]
+        for special in self.specials:
+            split = []
+            for fragment in fragments:
+                if isinstance(fragment, int):
+                    split.append(fragment)
+                    continue
+                for i, part in enumerate(fragment.split(special)):
+                    if i:
+                        split.append(self.vocab[special])
+                    if part:
+                        split.append(part)
+            fragments = split
+        return fragments
+
+    def encode(self, text):
+        ids = []
+        previous_special = True
+        for fragment in self.fragments(text):
+            if isinstance(fragment, int):
+                ids.append(fragment)
+                previous_special = True
+                continue
+            if self.model == "gpt2":
+                for word in self.pattern.findall(fragment):
+                    word = "".join(self.byte_chars[byte] for byte in word.encode())
+                    if self.pre in ("llama-bpe", "llama3") and word in self.vocab:
+                        ids.append(self.vocab[word])
+                        continue
+                    for piece in self.bpe(word):
+                        ids.extend([self.vocab[piece]] if piece in self.vocab else [self.vocab.get(char, 0) for char in piece])
+            else:
+                if self.space and previous_special:
+                    fragment = " " + fragment
+                ids.extend(self.spm(fragment.replace(" ", "▁")))
+            previous_special = False
+        return ids
+
+    def bpe(self, word):
+        word = tuple(word)
+        while len(word) > 1:
+            best = min(set(zip(word, word[1:])), key=lambda pair: self.ranks.get(pair, float("inf")))
+            if best not in self.ranks:
+                break
+            merged = []
+            i = 0
+            while i < len(word):
+                if i < len(word) - 1 and (word[i], word[i + 1]) == best:
+                    merged.append(word[i] + word[i + 1])
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            word = tuple(merged)
+        return word
+
+    def spm(self, text):
+        symbols = list(text)
+        while True:
+            best = None
+            for i in range(len(symbols) - 1):
+                id = self.vocab.get(symbols[i] + symbols[i + 1])
+                if id is not None and (best is None or self.scores[id] > best[0]):
+                    best = (self.scores[id], i)
+            if best is None:
+                break
+            i = best[1]
+            symbols[i:i + 2] = [symbols[i] + symbols[i + 1]]
+        ids = []
+        for symbol in symbols:
+            if symbol in self.vocab:
+                ids.append(self.vocab[symbol])
+            else:
+                ids.extend(self.vocab[f"<0x{byte:02X}>"] for byte in symbol.encode())
+        return ids
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+
+import pytest
+
+import main
+from conftest import free_port, wait_until
+from gguf_files import write_model
+from main import SettingsStore
+
+def configure(window, **settings):
+    path = f"settings/{window.profileSelect.currentData()}"
+    profile = window.settingsStore.load(SettingsStore.PROFILE, path)
+    profile.update(settings)
+    window.settingsStore.save(SettingsStore.PROFILE, path, profile)
+
+def select_model(window, row=0):
+    window.modelSelect.setCurrentIndex(row)
+    window.model_changed(row)
+
+@pytest.fixture
+def models(window, tmp_path, stub_binary):
+    # two synthetic models served by the stub llama-server on a free port
+    paths = []
+    for name in ("a", "b"):
+        path = str(tmp_path / f"{name}.gguf")
+        write_model(path)
+        paths.append(path)
+    window.models = [{"path": path, "name": path[-6:], "parameters": "", "weights": "Q4", "layers": "4"} for path in paths]
+    window.refresh_models_table()
+    configure(window, server_binary=stub_binary, port=str(free_port()), gpu_layers="0")
+    yield paths
+    window.modelPool.stop(wait=5)
+
+@pytest.fixture
+def log_level(monkeypatch):
+    monkeypatch.setattr(main.logger, "level", main.logger.level)
+
+@pytest.mark.parametrize("env, profile, expected", [
+    (logging.DEBUG, "Warning", logging.DEBUG),
+    (logging.WARNING, "Debug", logging.DEBUG),
+    (logging.INFO, "Error", logging.INFO),
+])
+def test_profile_log_level_never_quiets_the_environment(window, models, log_level, monkeypatch, env, profile, expected):
+    monkeypatch.setattr(main, "ENV_LOG_LEVEL", env)
+    main.logger.setLevel(env)
+    configure(window, log_level=profile)
+    select_model(window)
+    assert main.logger.level == expected
+
+def test_model_switch_never_parses_gguf_on_the_gui_thread(window, models, qapp, monkeypatch):
+    gui = threading.current_thread()
+    read = window.ggufCache.read
+    readers = []
+    released = threading.Event()
+    def record(path):
+        readers.append(threading.current_thread())
+        released.wait(10)
+        return read(path)
+    monkeypatch.setattr(window.ggufCache, "read", record)
+    window.ggufCache.files.clear()
+    configure(window, ctx_size="0")
+    select_model(window)
+    assert gui not in readers
+    assert window.contextBudget is None
+    assert window.modelPool.estimates[models[0]] == os.path.getsize(models[0])
+    released.set()
+    wait_until(qapp, lambda: window.contextBudget is not None)
+    assert window.contextBudget == 8192 - int(window.budgetOptions[1])
+    assert readers and gui not in readers
+
+def test_auto_layers_stay_on_the_cpu_until_metadata_is_read(window, models, qapp, monkeypatch):
+    gui = threading.current_thread()
+    read = window.ggufCache.read
+    def background_read(path):
+        assert threading.current_thread() is not gui
+        return read(path)
+    monkeypatch.setattr(window.ggufCache, "read", background_read)
+    window.ggufCache.files.clear()
+    configure(window, gpu_layers="Auto", memory_budget="64")
+    select_model(window)
+    command = window.modelPool.servers[models[0]].command
+    assert command[command.index("--n-gpu-layers") + 1] == "0"
+    wait_until(qapp, lambda: window.ggufCache.get(models[0]) is not None and not window._estimating)
+    assert window.auto_gpu_layers(window.models[0], {"memory_budget": "4096"}) == 5
+
+def test_stream_error_drops_the_placeholder_bubble(window, models, qapp, monkeypatch):
+    monkeypatch.setenv("STUB_CHAT", "error")
+    errors = []
+    monkeypatch.setattr(main.QMessageBox, "warning", lambda parent, title, text: errors.append(text))
+    select_model(window)
+    wait_until(qapp, lambda: window.serverStatus.text() == "Ready")
+    for attempt in (1, 2):
+        window.chatInput.setText(f"Question {attempt}")
+        window.send_prompt()
+        wait_until(qapp, lambda: len(errors) == attempt)
+        assert "slot unavailable" in errors[-1]
+        assert window.chatModel.rowCount() == len(window.chatHistory)
+        assert window.chatModel._stream_row is None
+        assert window.chatHistory[-1] == {"role": "user", "content": f"Question {attempt}"}
+        assert not window._suppress_input
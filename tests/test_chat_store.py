@@ -0,0 +1,61 @@
+import pytest
+
+from PyQt6.QtGui import QHelpEvent
+
+from main import ChatStore, PersistenceService, QEvent, Qt
+
+HISTORY = [{"role": "system", "content": "You are a helpful assistant."},
+           {"role": "user", "content": "Tell me about pelicans"},
+           {"role": "assistant", "content": "Pelicans are large water birds.", "llm": "model-a.gguf"}]
+
+@pytest.fixture
+def store(tmp_path):
+    writer = PersistenceService(debounce=0.2)
+    store = ChatStore(str(tmp_path / "chats.db"), legacy_dir=str(tmp_path), writer=writer)
+    store.flush()
+    yield store
+    store.close()
+    writer.close()
+
+def no_barrier(monkeypatch, writer):
+    def flush(key=None, wait=True):
+        raise AssertionError(f"flush({key!r}) on a metadata read")
+    monkeypatch.setattr(writer, "flush", flush)
+
+def test_metadata_and_search_read_committed_rows(store, monkeypatch):
+    chat_id = store.create_chat("Birds", HISTORY[:1])
+    store.flush()
+    store.save_history(chat_id, HISTORY)
+    no_barrier(monkeypatch, store.writer)
+    assert store.chat_info(chat_id)['message_count'] == 1
+    assert store.search("pelic") == []
+    monkeypatch.undo()
+    store.flush(chat_id)
+    assert store.chat_info(chat_id)['message_count'] == 3
+    assert [row['seq'] for row in store.search("pelic")] == [1, 2]
+
+def test_chat_list_hover_does_not_flush(window, monkeypatch):
+    window.chatStore.flush()
+    item = window.chatList.item(0)
+    window.chatStore.save_history(item.data(Qt.ItemDataRole.UserRole), window.chatHistory + [{"role": "user", "content": "hello"}])
+    no_barrier(monkeypatch, window.chatStore.writer)
+    pos = window.chatList.visualItemRect(item).center()
+    event = QHelpEvent(QEvent.Type.ToolTip, pos, window.chatList.viewport().mapToGlobal(pos))
+    assert window.eventFilter(window.chatList.viewport(), event)
+    window.chatSearch.setText("hello")
+    window.search_chats()
+    monkeypatch.undo()
+
+def test_save_after_close_is_written_through():
+    writer = PersistenceService()
+    writer.close()
+    written = []
+    writer.submit("late", lambda: written.append(True))
+    assert written == [True]
+    writer.flush()
+    writer.close()
+
+def test_window_closes_twice(window):
+    window.close()
+    window.chatStore.flush()
+    window.close()
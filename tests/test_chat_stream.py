@@ -0,0 +1,81 @@
+import asyncio
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from llama_server_stub import Handler
+from main import LLMWorker, aiter_chat_stream, iter_chat_stream
+
+TOKENS = ["Hello", " wor", "ld", "\n", ' "quoted"', " zażółć", " 🙂", " back\\slash"]
+STATS = {"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 8}, "timings": {"predicted_per_second": 40.0}}
+EXPECTED = [("token", token) for token in TOKENS] + [("stats", STATS), ("done", None)]
+
+def body(newline=b"\n"):
+    events = [b': keep-alive', b'data: {"choices":[{"delta":{"role":"assistant","content":null}}]}']
+    for i, token in enumerate(TOKENS):
+        events.append(b"data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}, ensure_ascii=i % 2 == 0).encode())
+    events += [b"data: " + json.dumps(STATS).encode(), b"data: [DONE]"]
+    return b"".join(event + b"\n\n" for event in events).replace(b"\n", newline)
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n", b"\r"])
+@pytest.mark.parametrize("size", [1, 2, 7, 4096])
+def test_events_survive_any_chunking(newline, size):
+    assert list(iter_chat_stream(chunked(body(newline), size))) == EXPECTED
+
+def test_multi_line_data_and_other_fields():
+    data = b'event: message\nid: 1\ndata: {"choices": [{"delta":\ndata: {"content": "x"}}]}\n\ndata: [DONE]\n\n'
+    assert list(iter_chat_stream(chunked(data, 3))) == [("token", "x"), ("done", None)]
+
+def test_async_stream():
+    async def source():
+        for chunk in chunked(body(), 5):
+            yield chunk
+    async def collect():
+        return [event async for event in aiter_chat_stream(source())]
+    assert asyncio.run(collect()) == EXPECTED
+
+def test_error_line():
+    data = b'data: {"choices":[{"delta":{"content":"x"}}]}\n\nerror: {"code":500,"message":"slot unavailable"}\n\n'
+    assert list(iter_chat_stream(chunked(data, 4))) == [("token", "x"), ("error", {"code": 500, "message": "slot unavailable"})]
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/v1/chat/completions"
+    httpd.shutdown()
+    httpd.server_close()
+
+def run_worker(url):
+    worker = LLMWorker({"messages": [{"role": "user", "content": "hi"}], "stream": True}, url)
+    events = []
+    worker.token_emit.connect(lambda tokens: events.append(("tokens", tokens)))
+    worker.result_ready.connect(lambda reply: events.append(("reply", reply)))
+    worker.stats_emit.connect(lambda stats: events.append(("stats", stats)))
+    worker.error_emit.connect(lambda error: events.append(("error", error)))
+    worker.run()
+    return events
+
+def test_worker_reply(server):
+    events = run_worker(server)
+    assert events[-1] == ("reply", "Hello from the stub.")
+    assert not [event for event in events if event[0] == "error"]
+
+def test_worker_reports_error_status(server, monkeypatch):
+    monkeypatch.setenv("STUB_CHAT", "status")
+    events = run_worker(server)
+    assert len(events) == 1
+    kind, error = events[0]
+    assert kind == "error"
+    assert error.startswith("400 Bad Request: ") and "exceeds the available context size" in error
+
+def test_worker_reports_error_event(server, monkeypatch):
+    monkeypatch.setenv("STUB_CHAT", "error")
+    events = run_worker(server)
+    assert ("error", "slot unavailable") in events
+    assert not [event for event in events if event[0] in ("reply", "stats")]
@@ -0,0 +1,137 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from gguf import GGUFEndian, GGUFReader, GGUFWriter
+
+from conftest import wait_until
+from gguf_files import write_model
+from main import GGUFMetadataCache, GGUFScanWorker, QThread, estimate_memory, fit_gpu_layers, gguf_model_info, read_gguf_metadata
+
+@pytest.mark.parametrize("endian", [GGUFEndian.LITTLE, GGUFEndian.BIG])
+def test_metadata_matches_gguf_reader(tmp_path, endian):
+    path = str(tmp_path / "typed.gguf")
+    writer = GGUFWriter(path, "llama", endianess=endian)
+    writer.add_name("Tiny")
+    writer.add_block_count(2)
+    writer.add_uint8("t.u8", 200)
+    writer.add_int16("t.i16", -300)
+    writer.add_uint32("t.u32", 4000000000)
+    writer.add_uint64("t.u64", 2 ** 63 + 5)
+    writer.add_float64("t.f64", 2.25)
+    writer.add_bool("t.bool", True)
+    writer.add_string("t.str", "zażółć ✓")
+    writer.add_array("t.ints", [1, -2, 3])
+    writer.add_array("t.strings", ["a", "bé", ""])
+    writer.add_array("t.nested", [[1, 2], [3]])
+    writer.add_tensor("blk.0.w", np.zeros((4, 4), dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    metadata = read_gguf_metadata(path)
+    for key, field in GGUFReader(path, "r").fields.items():
+        if key.startswith("GGUF.") or key == "t.nested":
+            continue
+        ours = metadata[key].tolist() if isinstance(metadata[key], np.ndarray) else metadata[key]
+        assert ours == pytest.approx(field.contents()) if isinstance(ours, float) else ours == field.contents(), key
+    # GGUFReader flattens nested arrays
+    assert [inner.tolist() for inner in metadata["t.nested"]] == [[1, 2], [3]]
+    assert gguf_model_info(path, metadata)["layers"] == "2"
+
+def test_tensor_sizes(tmp_path):
+    path = str(tmp_path / "model.gguf")
+    sizes = write_model(path)
+    metadata = read_gguf_metadata(path, 64, tensors=True)
+    assert metadata["GGUF.layer_bytes"] == sizes["layers"]
+    assert metadata["GGUF.input_bytes"] == sizes["input"]
+    assert metadata["GGUF.output_bytes"] == sizes["output"]
+    assert metadata["GGUF.array_lengths"]["tokenizer.ggml.tokens"] == 1000
+    assert "tokenizer.ggml.tokens" not in metadata
+
+def test_estimate_memory(tmp_path):
+    path = str(tmp_path / "model.gguf")
+    sizes = write_model(path, blocks=4, embd=256, heads=8, kv_heads=2, ctx=8192)
+    metadata = read_gguf_metadata(path, 64, tensors=True)
+    kv = 8192 * 2 * (32 + 32) * 2      # ctx * kv heads * (key + value length) * f16, per block
+    cpu = estimate_memory(metadata, 0, 8192)
+    gpu = estimate_memory(metadata, 5, 8192)
+    assert cpu["vram"] == 0
+    assert cpu["ram"] > sum(sizes["layers"]) + sizes["input"] + sizes["output"] + 4 * kv
+    assert gpu["ram"] == sizes["input"]
+    assert gpu["vram"] - sum(sizes["layers"]) - sizes["output"] - 4 * kv == cpu["ram"] - sum(sizes["layers"]) - sizes["input"] - sizes["output"] - 4 * kv
+    assert estimate_memory(metadata, 2, 8192)["vram"] < estimate_memory(metadata, 4, 8192)["vram"] < gpu["vram"]
+    # 0 is the model's trained context, what llama-server runs with for -c 0
+    assert estimate_memory(metadata, 5, 0) == estimate_memory(metadata, 5, 8192)
+
+def test_fit_gpu_layers(tmp_path):
+    path = str(tmp_path / "model.gguf")
+    write_model(path)
+    metadata = read_gguf_metadata(path, 64, tensors=True)
+    full = estimate_memory(metadata, 5, 4096)["vram"]
+    assert fit_gpu_layers(metadata, full, 4096) == 5
+    assert fit_gpu_layers(metadata, 1, 4096) == 0
+    two = estimate_memory(metadata, 2, 4096)["vram"]
+    assert fit_gpu_layers(metadata, two, 4096) == 2
+    assert fit_gpu_layers(metadata, two - 1, 4096) == 1
+
+def test_cache_follows_the_file(tmp_path):
+    path = str(tmp_path / "model.gguf")
+    write_model(path)
+    cache = GGUFMetadataCache(str(tmp_path / "cache.json"))
+    metadata = cache.read(path)
+    assert GGUFMetadataCache(str(tmp_path / "cache.json")).get(path) == metadata
+    os.utime(path, ns=(1, 1))
+    assert cache.get(path) is None
+
+def test_invalid_files(tmp_path):
+    truncated = tmp_path / "truncated.gguf"
+    truncated.write_bytes(b"GGUF\x03\x00\x00\x00" + b"\x01" * 10)
+    other = tmp_path / "other.gguf"
+    other.write_bytes(b"not a gguf file at all")
+    for path in (truncated, other):
+        with pytest.raises(ValueError):
+            read_gguf_metadata(str(path))
+
+def test_model_estimates_settle(window, qapp, tmp_path):
+    # an unreadable file ends up marked as such instead of waiting forever, and is read again once it changes
+    path = str(tmp_path / "model.gguf")
+    with open(path, "wb") as f:
+        f.write(b"GGUF broken")
+    window.models = [{"path": path, "name": "Synthetic", "parameters": "", "weights": "", "layers": "4"}]
+    window.refresh_models_table()
+    wait_until(qapp, lambda: window.modelsTable.item(0, 5).text() == "Unreadable")
+    assert not window._estimating
+    write_model(path)
+    window.update_model_estimates()
+    wait_until(qapp, lambda: window.modelsTable.item(0, 5).text().startswith("VRAM"))
+    assert not window._estimating
+
+def test_close_waits_for_estimate_scans(window, qapp, tmp_path, monkeypatch):
+    path = str(tmp_path / "model.gguf")
+    write_model(path)
+    read = window.ggufCache.read
+    def slow_read(path):
+        time.sleep(0.3)
+        return read(path)
+    monkeypatch.setattr(window.ggufCache, "read", slow_read)
+    window.models = [{"path": path, "name": "Synthetic", "parameters": "", "weights": "", "layers": "4"}]
+    window.refresh_models_table()
+    assert window._estimating
+    window.close()
+    assert not any(worker.isRunning() for worker in window.findChildren(QThread))
+
+def test_rescan_after_cancel(window, qapp, tmp_path):
+    folder = tmp_path / "scan"
+    folder.mkdir()
+    for name in ("a", "b"):
+        write_model(str(folder / f"{name}.gguf"))
+    window.scan_models(str(folder))
+    cancelled = window.scanWorker
+    window.scanProgress.cancel()
+    window.scan_models(str(folder))
+    assert window.scanWorker is not cancelled
+    wait_until(qapp, lambda: len(window.models) >= 2 and not any(worker.isRunning() for worker in window.findChildren(GGUFScanWorker)), 60)
+    qapp.processEvents()
+    assert sorted(model["path"] for model in window.models) == sorted(str(folder / f"{name}.gguf") for name in ("a", "b"))
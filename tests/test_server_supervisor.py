@@ -0,0 +1,134 @@
+import json
+import time
+
+import pytest
+
+from conftest import free_port, wait_until
+from main import SERVER_FAILED, SERVER_LOADING, SERVER_READY, SERVER_STOPPED, GenerationBackend, ModelPool, ServerRegistry, ServerSupervisor
+
+def options(tmp_path, **changes):
+    return dict({"model_path": str(tmp_path / "model.gguf"), "port": free_port(), "threads": 2, "gpu_layers": 0, "batch_size": 0, "ctx_size": 0}, **changes)
+
+@pytest.fixture
+def supervisor(qapp):
+    backend = GenerationBackend()
+    supervisor = ServerSupervisor(backend, interval=0.05)
+    states = []
+    supervisor.state_changed.connect(lambda state, message: states.append((state, message)))
+    supervisor.states = states
+    yield supervisor
+    supervisor.stop()
+    backend.shutdown()
+
+def test_ready_after_health(supervisor, qapp, tmp_path, stub_binary, monkeypatch):
+    monkeypatch.setenv("STUB_LOAD", "0.3")
+    assert supervisor.start(options(tmp_path), binary=stub_binary)
+    wait_until(qapp, lambda: supervisor.state == SERVER_READY)
+    wait_until(qapp, lambda: supervisor.states and supervisor.states[-1][0] == SERVER_READY)
+    assert [state for state, _ in supervisor.states] == [SERVER_LOADING, SERVER_READY]
+    assert supervisor.load_ms >= 300
+    wait_until(qapp, lambda: any("n_ctx" in line for line in supervisor.output))
+
+def test_same_command_is_not_restarted(supervisor, qapp, tmp_path, stub_binary):
+    server = options(tmp_path)
+    assert supervisor.start(server, binary=stub_binary)
+    wait_until(qapp, lambda: supervisor.state == SERVER_READY)
+    process = supervisor.process
+    assert not supervisor.start(server, binary=stub_binary)
+    assert supervisor.process is process
+
+def test_exit_while_loading(supervisor, qapp, tmp_path, stub_binary, monkeypatch):
+    monkeypatch.setenv("STUB_FAIL", "1")
+    supervisor.start(options(tmp_path), binary=stub_binary)
+    wait_until(qapp, lambda: supervisor.state == SERVER_FAILED)
+    assert "exited with code 3" in supervisor.message
+    assert "failed to load model" in supervisor.message
+
+def test_load_timeout(supervisor, qapp, tmp_path, stub_binary, monkeypatch):
+    monkeypatch.setenv("STUB_LOAD", "60")
+    supervisor.start(options(tmp_path), binary=stub_binary, timeout=0.5)
+    wait_until(qapp, lambda: supervisor.state == SERVER_FAILED)
+    assert "did not load within" in supervisor.message
+    assert supervisor.process.poll() is not None
+
+def test_missing_binary(supervisor, qapp, tmp_path):
+    supervisor.start(options(tmp_path), binary=str(tmp_path / "missing"))
+    wait_until(qapp, lambda: supervisor.state == SERVER_FAILED)
+    assert "Could not start" in supervisor.message
+
+def test_stop(supervisor, qapp, tmp_path, stub_binary):
+    supervisor.start(options(tmp_path), binary=stub_binary)
+    wait_until(qapp, lambda: supervisor.state == SERVER_READY)
+    process = supervisor.process
+    supervisor.stop()
+    wait_until(qapp, lambda: process.poll() is not None)
+    assert supervisor.state == SERVER_STOPPED
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - started
+
+def test_start_and_stop_do_not_block(qapp, tmp_path, stub_binary, monkeypatch):
+    # the GUI thread neither waits for the orphan reclaim nor for a server that ignores SIGINT
+    monkeypatch.setenv("STUB_IGNORE_INT", "1")
+    backend = GenerationBackend()
+    registry = ServerRegistry(str(tmp_path / "servers.json"))
+    supervisor = ServerSupervisor(backend, interval=0.05, registry=registry)
+    try:
+        _, elapsed = timed(lambda: supervisor.start(options(tmp_path), binary=stub_binary))
+        assert elapsed < 0.2
+        assert supervisor.state == SERVER_LOADING
+        registry.reclaimed.set()
+        wait_until(qapp, lambda: supervisor.state == SERVER_READY)
+        process = supervisor.process
+        assert [entry["pid"] for entry in json.load(open(registry.path))["servers"]] == [process.pid]
+        gone, elapsed = timed(supervisor.stop)
+        assert elapsed < 0.2
+        assert supervisor.state == SERVER_STOPPED
+        assert gone.wait(5)
+        assert process.poll() is not None
+        wait_until(qapp, lambda: json.load(open(registry.path))["servers"] == [])
+    finally:
+        supervisor.stop()
+        backend.shutdown()
+
+def test_restart_waits_for_the_old_server(supervisor, qapp, tmp_path, stub_binary, monkeypatch):
+    # same port, new command line: the new server is launched once the old one has let go of the port
+    monkeypatch.setenv("STUB_IGNORE_INT", "1")
+    server = options(tmp_path)
+    supervisor.start(server, binary=stub_binary)
+    wait_until(qapp, lambda: supervisor.state == SERVER_READY)
+    old = supervisor.process
+    _, elapsed = timed(lambda: supervisor.start(dict(server, threads=3), binary=stub_binary))
+    assert elapsed < 0.2
+    wait_until(qapp, lambda: supervisor.state == SERVER_READY and supervisor.process is not old)
+    assert old.poll() is not None
+    assert "-t 3" in " ".join(supervisor.process.args)
+
+def test_stop_while_launching(supervisor, qapp, tmp_path, stub_binary):
+    supervisor.registry = ServerRegistry(str(tmp_path / "servers.json"))
+    supervisor.start(options(tmp_path), binary=stub_binary)
+    gone = supervisor.stop()
+    supervisor.registry.reclaimed.set()
+    assert gone.wait(5)
+    assert supervisor.process is None
+    assert supervisor.state == SERVER_STOPPED
+
+def test_pool_reuses_the_port_of_an_evicted_server(qapp, tmp_path, stub_binary, monkeypatch):
+    monkeypatch.setenv("STUB_IGNORE_INT", "1")
+    backend = GenerationBackend()
+    pool = ModelPool(backend, max_servers=1)
+    port = free_port()
+    try:
+        first = pool.acquire("a", options(tmp_path, port=port), binary=stub_binary)
+        wait_until(qapp, lambda: first.state == SERVER_READY)
+        old = first.process
+        (second, elapsed) = timed(lambda: pool.acquire("b", options(tmp_path, port=port, model_path=str(tmp_path / "b.gguf")), binary=stub_binary))
+        assert elapsed < 0.2
+        assert list(pool.servers) == ["b"] and pool.ports["b"] == port
+        wait_until(qapp, lambda: second.state == SERVER_READY)
+        assert old.poll() is not None
+    finally:
+        pool.stop(wait=5)
+        backend.shutdown()
@@ -0,0 +1,39 @@
+import json
+import os
+
+import pytest
+
+from main import PersistenceService, SettingsStore
+
+DEFAULTS = [{'type': 'number', 'name': 'ctx_size', 'default': "4096", 'use_case': [0, 1, 2]}]
+
+@pytest.fixture
+def store(qapp, tmp_path):
+    writer = PersistenceService(debounce=0.2)
+    yield SettingsStore(DEFAULTS, None, writer), str(tmp_path / "profile.json")
+    writer.close()
+
+def test_save_is_written_behind(store):
+    settings, path = store
+    settings.save(SettingsStore.PROFILE, path, {"ctx_size": "8192"})
+    assert not os.path.exists(path)
+    settings.writer.flush()
+    with open(path) as f:
+        assert json.load(f)["settings"] == {"ctx_size": "8192"}
+
+def test_remove_drops_the_queued_write(store):
+    settings, path = store
+    settings.save(SettingsStore.PROFILE, path, {"ctx_size": "8192"})
+    settings.writer.flush()
+    settings.save(SettingsStore.PROFILE, path, {"ctx_size": "2048"})
+    settings.remove(SettingsStore.PROFILE, path)
+    settings.writer.flush()
+    assert not os.path.exists(path)
+    assert path not in settings.pending
+
+def test_remove_of_a_profile_never_written(store):
+    settings, path = store
+    settings.save(SettingsStore.PROFILE, path, {"ctx_size": "8192"})
+    settings.remove(SettingsStore.PROFILE, path)
+    settings.writer.flush()
+    assert not os.path.exists(path)
@@ -0,0 +1,38 @@
+import pytest
+
+from main import MarkdownRenderCache, StreamingMarkdown, md_to_html
+
+REPLY = "Alpha beta.\n\nGamma delta.\n\n- one\n- two\n\n```python\nprint(1)\n```\n\nDone."
+
+@pytest.fixture
+def cache(tmp_path):
+    return MarkdownRenderCache(str(tmp_path / "render_cache.json"))
+
+def stream(cache, reply, size):
+    streamer = StreamingMarkdown(cache)
+    for i in range(0, len(reply), size):
+        streamer.feed(reply[i:i + size])
+        streamer.flush()
+    return streamer
+
+@pytest.mark.parametrize("newlines", [0, 1, 2, 3, 4, 7])
+@pytest.mark.parametrize("size", [1, 3, 16])
+def test_leading_newlines_stream_like_whole_reply(cache, newlines, size):
+    reply = "\n" * newlines + REPLY
+    streamed = stream(cache, reply, size).html()
+    assert streamed == StreamingMarkdown(cache).finish(reply)
+    assert streamed.count("Alpha beta.") == 1
+
+def test_finish_caches_streamed_reply(cache):
+    streamer = stream(cache, REPLY, 5)
+    html = streamer.finish(REPLY)
+    assert html == streamer.html()
+    assert cache.render(REPLY) == html
+
+def test_finish_resolves_references_across_blocks(cache):
+    reply = "See [the docs][1] and this[^n].\n\nMore text.\n\n[1]: https://example.com\n\n[^n]: A footnote."
+    html = stream(cache, reply, 4).finish(reply)
+    assert html == md_to_html(reply, extensions=MarkdownRenderCache.extensions)
+    assert '<a href="https://example.com">the docs</a>' in html
+    assert "[^n]" not in html
+    assert cache.render(reply) == html
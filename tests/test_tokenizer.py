@@ -0,0 +1,105 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+import requests
+
+from conftest import free_port, wait_until
+from gguf_files import BPE_SPECIALS, CORPUS, write_bpe_vocab, write_model, write_spm_vocab
+from main import GGUFTokenizer, LLMWorker
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llama_server_stub.py")
+
+def samples(count=400):
+    # prefixes of the corpus, shuffled pieces with specials, whitespace runs and contractions, random code points
+    rnd = random.Random(1)
+    pieces = CORPUS.split(" ") + BPE_SPECIALS + ["<s>", "</s>", "<unk>", "  ", "\n\n", "\t", "don't", "DON'T", "I'LL", "½", "x²",
+                                                "١٢٣", "👍🏽", "é", "ﬁ", "日本", "a_b", "__init__", "1234567", "...", "?!"]
+    texts = [CORPUS[:i] for i in range(0, 400, 9)]
+    texts += ["".join(rnd.choice(pieces) + rnd.choice(["", " ", "\n", "  "]) for _ in range(rnd.randint(1, 30))) for _ in range(count)]
+    texts += ["".join(chr(rnd.randint(32, 0x2FFF)) for _ in range(rnd.randint(1, 20))) for _ in range(count // 4)]
+    return texts
+
+@pytest.fixture(scope="session")
+def vocabularies(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("vocab")
+    paths = {name: str(folder / f"{name}.gguf") for name in ("llama-bpe", "gpt-2", "spm")}
+    write_bpe_vocab(paths["llama-bpe"], pre="llama-bpe")
+    write_bpe_vocab(paths["gpt-2"], pre="gpt-2")
+    write_spm_vocab(paths["spm"])
+    return paths
+
+@pytest.fixture
+def server(qapp):
+    processes = []
+    def start(model):
+        port = free_port()
+        processes.append(subprocess.Popen([sys.executable, STUB, "-m", model, "--port", str(port)], env=dict(os.environ, STUB_LOAD="0")))
+        url = f"http://127.0.0.1:{port}"
+        def healthy():
+            try:
+                return requests.get(f"{url}/health", timeout=1).status_code == 200
+            except requests.RequestException:
+                return False
+        wait_until(qapp, healthy)
+        return url
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+@pytest.mark.parametrize("name", ["llama-bpe", "gpt-2", "spm"])
+def test_counts_match_tokenize(vocabularies, server, name):
+    url = server(vocabularies[name])
+    tokenizer = GGUFTokenizer.load(vocabularies[name])
+    session = requests.Session()
+    mismatches = []
+    for text in samples():
+        expected = len(session.post(f"{url}/tokenize", json={"content": text}).json()["tokens"])
+        if tokenizer.count(text) != expected:
+            mismatches.append((text, expected, tokenizer.count(text)))
+    assert mismatches == []
+
+def test_specials_count_once(vocabularies):
+    tokenizer = GGUFTokenizer.load(vocabularies["llama-bpe"])
+    assert tokenizer.count("<|eot_id|>") == 1
+    assert tokenizer.count("<|start_header_id|>user<|end_header_id|>") == tokenizer.count("user") + 2
+
+def test_unknown_token_counts_once(vocabularies):
+    tokenizer = GGUFTokenizer.load(vocabularies["spm"])
+    assert tokenizer.count("<unk>") == 1
+    assert tokenizer.count("a<unk>b") == tokenizer.count("a") + 1 + tokenizer.count("b")
+
+def test_cached_per_file(vocabularies, tmp_path):
+    assert GGUFTokenizer.load(vocabularies["spm"]) is GGUFTokenizer.load(vocabularies["spm"])
+    path = str(tmp_path / "vocab.gguf")
+    write_spm_vocab(path)
+    first = GGUFTokenizer.load(path)
+    os.utime(path, ns=(1, 1))
+    assert GGUFTokenizer.load(path) is not first
+
+def test_model_without_tokenizer(tmp_path):
+    path = str(tmp_path / "model.gguf")
+    write_model(path)
+    with pytest.raises(ValueError):
+        GGUFTokenizer.load(path)
+
+def test_worker_counts_without_a_server(vocabularies):
+    tokenizer = GGUFTokenizer.load(vocabularies["llama-bpe"])
+    worker = LLMWorker({"messages": []}, "http://127.0.0.1:9/v1/chat/completions", tokenizer=tokenizer)
+    assert worker.tokenize("Hello there") == tokenizer.count("Hello there")
+    assert not worker._no_tokenize
+
+def test_prompt_token_count(window, qapp, vocabularies):
+    window.serverKey = vocabularies["llama-bpe"]
+    window.contextBudget = 3072
+    window.load_tokenizer(window.serverKey)
+    wait_until(qapp, lambda: window.tokenizer is not None)
+    window.chatInput.setText("Hello there<|eot_id|>")
+    expected = window.tokenizer.count("Hello there<|eot_id|>")
+    wait_until(qapp, lambda: window.tokenCount.text() == f"{expected} tokens")
+    assert "3072" in window.tokenCount.toolTip()
+    window.chatInput.clear()
+    wait_until(qapp, lambda: window.tokenCount.text() == "")